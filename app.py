@@ -6,123 +6,333 @@
 # years of tracks and writes in a column next to the year already
 # contained in the id3 tag.
 
-# uses rekordbox.xml to get the list of files in the Rekordbox collection.
+# uses rekordbox.xml to get the list of files in the Rekordbox collection,
+# or scans the library folders for audio files with TRACK_SOURCE "scan".
+
+# run without arguments for the interactive menu, or with a subcommand
+# (scan, lookup, fix, write-tags, write-xml, watch) to run headless, e.g.
+# from cron.
+
+# openai, tinytag, mutagen, pyfiglet and regex are imported where they are
+# used and the openai client is made on first use, so a command only pays
+# for what it needs and runs that never query the model don't need an api
+# key.  benchmarks/bench_startup.py tracks the startup time per command.
 
-import vars
 import os
+import sys
 import csv
-import regex
+import json
+import time
+import argparse
 
-import pyfiglet
 from termcolor import colored
 
-from openai import OpenAI
-from datetime import datetime
-from urllib.parse import unquote
-from xml.dom import minidom
-from tinytag import TinyTag
-from mutagen import File
-from mutagen.mp4 import MP4
-from mutagen.mp3 import MP3
-from mutagen.easyid3 import EasyID3
+from functools import partial
 from dotenv import load_dotenv
+from rekordbox import UNSET_XML_YEARS, iter_rekordbox_file_paths, write_patched_rekordbox_xml
+from extraction import extract_tracks, iter_extracted_tracks
+from library_scan import DEFAULT_AUDIO_EXTENSIONS, iter_audio_files, scan_library_state
+from lookup import ESCALATED_RELEASE_YEAR_PROMPT_VERSION, RELEASE_YEAR_MODEL, RELEASE_YEAR_PROMPT_VERSION, escalated_release_year_prompt, lookup_release_years, lookup_release_years_streaming
+from instrumentation import metrics
+from lookup_cache import LookupCache
+from tag_cache import TagCache, read_tags
+from offline_index import OfflineIndex
+from normalize import DEFAULT_TITLE_STRIP_RULES, StreamingKeyAliases, cluster_track_keys, compile_title_rules, format_track_title
+from checkpoint import load_processed_locations, read_last_line, repair_torn_tail
+from results_writer import ResultsWriter
+from sync import diff_track_state, hold_back_unsettled, load_track_state, scan_collection_state, write_track_state
+from track_store import TrackStore
+from track_record import TrackRecord
+from tag_writer import FAILED, SKIPPED, SUPPORTED_MIME_TYPES, WRITTEN, write_year, write_years
+from batch import OpenAIBatchTransport, download_batch_results, merge_batch_results, poll_batch, submit_batch
+
+# vars.py is optional when the settings come from the environment
+try:
+    import vars
+except ImportError:
+    vars = None
 
 load_dotenv()
-client = OpenAI()
+
+# made on first use by get_openai_client()
+client = None
 
 
 # -----------  Variable Defs  ----------- #
 
+# Read a setting from the environment (or .env), then vars.py
+# returns the value or default
+def config_value(name, default=None):
+    """
+    Environment values are read as json where possible, so numbers, lists
+    and true/false work.  Python style True, False and None are accepted
+    too, and a plain string for a list setting is split on os.pathsep.
+    """
+    value = os.environ.get(name)
+
+    if value is None:
+        return getattr(vars, name, default)
+
+    if value in ("True", "False", "None"):
+        return {"True": True, "False": False, "None": None}[value]
+
+    try:
+        return json.loads(value)
+    except ValueError:
+        if isinstance(default, list):
+            return [part for part in value.split(os.pathsep) if part]
+        return value
+
+
 # set paths
-rekordbox_xml_file_path = vars.REKORDBOX_XML_FILE_PATH
+rekordbox_xml_file_path = config_value("REKORDBOX_XML_FILE_PATH")
+
+# folder of the output files. the job runner gives every collection its
+# own
+output_dir = config_value("OUTPUT_DIR", os.path.dirname(__file__) + "/output")
 
 # set folders to search
-search_folders = vars.SEARCH_FOLDERS
+search_folders = config_value("SEARCH_FOLDERS", [])
+
+# where tracks are found. "xml" reads the rekordbox.xml collection, "scan"
+# walks the SCAN_ROOTS folders for audio files with these extensions, so
+# no export is needed. folders are listed by scan_workers threads at once
+track_source = config_value("TRACK_SOURCE", "xml")
+scan_roots = config_value("SCAN_ROOTS", [])
+scan_extensions = config_value("SCAN_EXTENSIONS", DEFAULT_AUDIO_EXTENSIONS)
+scan_workers = config_value("SCAN_WORKERS", 8)
+
+# watch mode looks for added and changed tracks every this many seconds.
+# files changed in the last settle seconds may still be copying and are
+# left for the next look
+watch_poll_interval = config_value("WATCH_POLL_INTERVAL", 60)
+watch_settle_seconds = config_value("WATCH_SETTLE_SECONDS", 10)
+
+# tag extraction workers. threads suit NAS mounted libraries where reading
+# tags is mostly i/o wait, processes suit fast local disks.
+extract_workers = config_value("EXTRACT_WORKERS", 8)
+extract_use_processes = config_value("EXTRACT_USE_PROCESSES", False)
+
+# tags read from audio files are cached by path, size and mtime, so files
+# that haven't changed since the last run aren't read again. content
+# hashing also recognizes files that were moved or renamed, at the cost
+# of reading 128KB of every file that isn't a plain hit
+use_tag_cache = config_value("TAG_CACHE", True)
+tag_cache_content_hash = config_value("TAG_CACHE_CONTENT_HASH", False)
+
+# release year lookups. requests kept in flight at once, optional openai
+# rate limits (None = no limit) and the per request timeout in seconds
+lookup_concurrency = config_value("LOOKUP_CONCURRENCY", 8)
+lookup_requests_per_minute = config_value("LOOKUP_REQUESTS_PER_MINUTE", None)
+lookup_tokens_per_minute = config_value("LOOKUP_TOKENS_PER_MINUTE", None)
+lookup_timeout = config_value("LOOKUP_TIMEOUT", 60)
+
+# tracks sent per request. above 1 several tracks are resolved in one
+# request with a json answer, saving the per request overhead
+lookup_pack_size = config_value("LOOKUP_PACK_SIZE", 1)
+
+# found years are cached across runs. cached years older than the ttl
+# (None = never expire) are looked up again
+use_lookup_cache = config_value("LOOKUP_CACHE", True)
+lookup_cache_ttl_days = config_value("LOOKUP_CACHE_TTL_DAYS", None)
+
+# sources tried in order for a year before asking the model. "cache" is
+# the lookup cache, "offline" the local dump index built with
+# offline_index.py and "model" the openai model. leave out "model" for
+# offline only runs
+year_resolvers = config_value("YEAR_RESOLVERS", ["cache", "offline", "model"])
+offline_index_file_path = config_value(
+    "OFFLINE_INDEX_FILE_PATH", output_dir + "/offline-index.bin")
+
+# version annotations stripped from track titles, as case-insensitive
+# regexes, compiled once into a single pattern
+title_strip_pattern = compile_title_rules(
+    config_value("TITLE_STRIP_RULES", DEFAULT_TITLE_STRIP_RULES))
+
+# tracks whose canonical keys are at least this similar share one lookup,
+# e.g. normalize.DEFAULT_FUZZY_THRESHOLD (None = only exact key matches
+# are shared)
+fuzzy_match_threshold = config_value("FUZZY_MATCH_THRESHOLD", None)
+
+# fresh runs stream tracks from the rekordbox.xml reader through tag
+# extraction into the lookups. this many extracted tracks can wait for a
+# lookup before extraction is held back
+pipeline_queue_size = config_value("PIPELINE_QUEUE_SIZE", 256)
+
+# model answers per track. above 1 every track is asked about this many
+# times at once and every resolver is asked too, and the answers and the
+# tagged year vote on the found year and its confidence score (0 to 1).
+# one answer alone scores 0.33, three agreeing answers score 1.0
+lookup_samples = config_value("LOOKUP_SAMPLES", 1)
+
+# rows whose confidence is below this aren't written to the tags and are
+# looked up again by fix missing years (None = no threshold)
+min_confidence = config_value("MIN_CONFIDENCE", None)
+
+# fix missing years re-queries every track without a found year at once,
+# then asks the ones still without a year again with a more detailed
+# prompt, and optionally a stronger model (None = the same model), before
+# leaving what's left for review
+fix_escalate = config_value("FIX_ESCALATE", True)
+fix_escalation_model = config_value("FIX_ESCALATION_MODEL", None)
+
+# model answers per track when fix missing years looks tracks up again,
+# so a year that is wrong once doesn't come back as the only answer
+fix_samples = config_value("FIX_SAMPLES", 3)
+
+# quiet mode replaces the per track messages with progress bars
+quiet = config_value("QUIET", False)
+
+# also write track-years.csv after fix missing years, write tags and sync
+# update the track store
+export_track_years_csv = config_value("EXPORT_TRACK_YEARS_CSV", False)
+
+# tag writing. files written at once, write to a temp copy and rename it
+# over the original so an interrupted run can't corrupt a file, and dry
+# run to only report what would be written
+tag_write_workers = config_value("TAG_WRITE_WORKERS", 8)
+tag_write_atomic = config_value("TAG_WRITE_ATOMIC", False)
+tag_write_dry_run = config_value("TAG_WRITE_DRY_RUN", False)
+
+# where the copy of rekordbox.xml with the found years set is written, for
+# importing the years into rekordbox without touching the audio files
+rekordbox_xml_output_file_path = config_value(
+    "REKORDBOX_XML_OUTPUT_FILE_PATH", output_dir + "/rekordbox-updated.xml")
+
+# lookup results are written to track-years.csv in batches of this many
+# rows, and the file is fsynced every this many seconds (None = only at
+# the end of a run)
+results_batch_size = config_value("RESULTS_BATCH_SIZE", 256)
+results_fsync_interval = config_value("RESULTS_FSYNC_INTERVAL", 5)
+
+# seconds between batch status checks in batch mode
+batch_poll_interval = config_value("BATCH_POLL_INTERVAL", 60)
+
+# the lookup cache can be shared by several output folders, and with
+# LOOKUP_CACHE_SHARED by several runs at once: a track one run is looking
+# up is claimed, and the other runs wait for its year instead of asking
+# the model too
+lookup_cache_file_path = config_value(
+    "LOOKUP_CACHE_FILE_PATH", output_dir + "/lookup-cache.sqlite")
+lookup_cache_shared = config_value("LOOKUP_CACHE_SHARED", False)
 
 # full path to the output files
-tracks_csv_file_path = os.path.dirname(__file__) + "/output/tracks.csv"
-track_years_csv_file_path = os.path.dirname(
-    __file__) + "/output/track-years.csv"
+tracks_csv_file_path = output_dir + "/tracks.csv"
+track_years_csv_file_path = output_dir + "/track-years.csv"
+tag_cache_file_path = output_dir + "/tag-cache.sqlite"
+batch_input_file_path = output_dir + "/batch-input.jsonl"
+batch_state_file_path = output_dir + "/batch-state.json"
+track_years_journal_file_path = output_dir + "/track-years.journal"
+track_store_file_path = output_dir + "/tracks.sqlite"
+track_state_csv_file_path = output_dir + "/track-state.csv"
+run_report_file_path = output_dir + "/run-report.json"
+
+# headers of the output files
+TRACKS_CSV_HEADER = "Location, Track Title, Artist, Track Title Formatted, Year\n"
+TRACK_YEARS_CSV_HEADER = "Location, Track Title, Artist, Track Title Formatted, Year, Possible Year, Confidence\n"
 
 
 # -----------  Helper Function Defs  ----------- #
 
+# Ask a yes/no question
+# returns True for "y", or right away with assume_yes (the --yes flag)
+def confirm(message, assume_yes=False, color="cyan"):
+    """
+    Prompts for confirmation.  A closed stdin (cron, pipelines) counts as
+    "no" instead of raising.
+    """
+    if assume_yes:
+        print(colored(message + "y", color=color))
+        return True
+
+    try:
+        return input(colored(message, color=color)).lower() == "y"
+    except EOFError:
+        print(colored("\nNo answer, pass --yes to run without prompts.", color="magenta"))
+        return False
+
+
 # Parse Rekordbox Collection XML
 # returns list of track file paths extracted from the rekordbox.xml
-def parse_rekordbox_xml(rekordbox_xml, search_folders):
+def parse_rekordbox_xml(rekordbox_xml, search_folders, sort=True):
     """
     Parses a rekordbox.xml file and extracts the file paths
     into a list.  Returns the list of filepaths.
     """
     print(colored("Parsing rekordbox.xml...", color="white"))
 
-    # list of files (file paths) in the rekordbox collection
-    rekordbox_collection_file_path_list = []
+    # list of files (file paths) in the rekordbox collection.
+    # the xml is streamed so only the <COLLECTION> node is read and only
+    # one <TRACK> element is held in memory at a time.
+    rekordbox_collection_file_path_list = list(metrics.timed_iter(
+        "xml_parse", iter_rekordbox_file_paths(rekordbox_xml, search_folders)))
 
-    # parse the xml file as DOM
-    dom = minidom.parse(rekordbox_xml)
+    # sort once after all tracks have been collected
+    if sort:
+        rekordbox_collection_file_path_list.sort()
 
-    # get element <COLLECTION>
-    collection = dom.getElementsByTagName("COLLECTION")
+    return rekordbox_collection_file_path_list
 
-    # get all elements named <TRACK> (this should be all files in the rekordbox collection)
-    tracks = collection[0].getElementsByTagName("TRACK")
 
-    for track in tracks:
-        # the element will be URL encoded, so we first need to unencode using the imported unquote function
-        url_unencoded_file_path = unquote(track.attributes["Location"].value)
+# Stream the file paths of the tracks from the configured track source,
+# the rekordbox.xml collection or a scan of the scan roots
+# yields track file paths
+def iter_track_file_paths(rekordbox_xml_file_path, search_folders):
+    if track_source == "scan":
+        return metrics.timed_iter("file_scan", iter_audio_files(
+            scan_roots, scan_extensions, search_folders, scan_workers))
 
-        # now we can remove the "localhost" in the file path string
-        file_path = url_unencoded_file_path.replace("file://localhost", "")
+    return metrics.timed_iter("xml_parse", iter_rekordbox_file_paths(
+        rekordbox_xml_file_path, search_folders))
 
-        # add track file path to an inclusive list for comparison later
-        # ONLY if in music-library dir and ONLY if in the specified folders
-        if "music-library" in file_path:
-            if search_folders:
-                if any(substring in file_path for substring in search_folders):
-                    rekordbox_collection_file_path_list.append(file_path)
-            else:
-                rekordbox_collection_file_path_list.append(file_path)
 
-        rekordbox_collection_file_path_list.sort()
+# Read the Location, TrackID, size and mtime of every track from the
+# configured track source
+# returns dict of Location -> (TrackID, size, mtime), TrackID "" for
+# scanned files
+def read_collection_state(rekordbox_xml_file_path, search_folders):
+    if track_source == "scan":
+        return scan_library_state(scan_roots, scan_extensions, search_folders, scan_workers)
+
+    return scan_collection_state(rekordbox_xml_file_path, search_folders)
 
-    return rekordbox_collection_file_path_list
+
+# Ask to confirm the rekordbox.xml export is current
+# returns True, always for a scanned library, which is always current
+def confirm_collection_is_current(assume_yes=False):
+    if track_source == "scan":
+        return True
+
+    return confirm("The rekordbox.xml file must be current or data will be incorrect. Continue? (y/n) ", assume_yes)
 
 
 # Extract track data from file, given the file path
-# returns list of track data [file_path, track_title, artist, track_title_formatted, and year]
-def extract_track_data(track_file_path):
+# returns track record of [file_path, track_title, artist, track_title_formatted, and year]
+def extract_track_data(track_file_path, verbose=True):
     """
     Gets the track information from the track's metadata tags.
     """
 
-    print(colored(f"Processing {track_file_path}...", color="white"))
-
-    tag: TinyTag = TinyTag.get(track_file_path)
+    if verbose:
+        print(colored(f"Processing {track_file_path}...", color="white"))
 
-    # format existing year to 4 digits
-    if tag.year == None:
-        year = tag.year
+    # title, artist and the year formatted to 4 digits
+    track_title, artist, year = read_tags(track_file_path)
 
-    else:
-        if len(tag.year) == 4:
-            year = tag.year
-
-        elif len(tag.year) == 10:
-            dt = datetime.strptime(tag.year, "%Y-%m-%d")
-            year = dt.year
+    return make_track_data_item(track_file_path, track_title, artist, year)
 
-        else:
-            dt = datetime.strptime(tag.year, "%Y-%m-%dT%H:%M:%SZ")
-            year = dt.year
 
-    # format track title
-    track_title_formatted = str(tag.title).replace(
-        "(Clean)", "").replace("(Dirty)", "").replace("(Intro)", "").replace("(Intro Clean)", "").replace("(Intro Dirty)", "").replace("(Intro - Clean)", "").replace("(Intro - Dirty)", "").replace("(HH Clean Intro)", "").replace("(HH Dirty Intro)", "").replace("(HH Dirty Mixshow)", "").replace("*", "").strip()
+# Build the track data item of a file from its tags
+# returns track record of [file_path, track_title, artist, track_title_formatted, and year]
+def make_track_data_item(track_file_path, track_title, artist, year):
+    # format track title, stripping version annotations like "(Clean)"
+    # or "[Extended Mix]" in one pass of the title strip rules
+    track_title_formatted = format_track_title(
+        track_title, title_strip_pattern)
 
-    # create list with [file_path, track_title, artist, track_title_formatted, year]
-    track_data_item = [track_file_path, str(tag.title), str(
-        tag.artist), track_title_formatted, str(year)]
+    # create record with [file_path, track_title, artist, track_title_formatted, year]
+    track_data_item = TrackRecord(
+        track_file_path, track_title, artist, track_title_formatted, year)
 
     # extra check to make sure the data going into our list is properly
     # formatted. there should be only 5 items in the track data list item.
@@ -135,19 +345,20 @@ def extract_track_data(track_file_path):
     return track_data_item
 
 
-# Parse csv file and convert data to list of lists
+# Parse csv file and convert data to list of track records
 # note: this will remove the 0 index tuple which contains the headers
 def parse_csv_to_list(csv_file_path):
     """
     Converts a csv file to a list of track data items.
-    Track data items are also a list of the tracks data.
+    Track data items are compact track records of the tracks data.
     """
     print(colored("Parsing track data from csv file...", color="white"))
 
     with open(csv_file_path) as file:
-        track_data_list = [line for line in csv.reader(file)]
-        # remove the header line ["Location", "Title", "Artist"....]
-        track_data_list.pop(0)
+        reader = metrics.timed_iter("csv_read", csv.reader(file))
+        # skip the header line ["Location", "Title", "Artist"....]
+        next(reader, None)
+        track_data_list = [TrackRecord.from_row(line) for line in reader if line]
 
     return track_data_list
 
@@ -160,60 +371,54 @@ def get_last_processed_track(track_years_csv_file_path):
     """
     print(colored("Getting last processed track...", color="white"))
 
-    with open(track_years_csv_file_path, 'r') as file:
-        reader = reversed(list(csv.reader(file)))
-        last_row = list(next(reader))
+    # read from the end of the file instead of reading the whole file
+    last_line = read_last_line(track_years_csv_file_path)
 
-    return last_row
+    if last_line is None:
+        return []
 
+    return next(csv.reader([last_line]))
 
-# Create list of track data lists based on the last track that was processed
-# params: list of the last processed track data, our main track data list
+
+# Remove the resume journal after track-years.csv was rewritten as a whole
+# a later resume then reads the processed tracks from track-years.csv
+def discard_track_years_journal():
+    if os.path.exists(track_years_journal_file_path):
+        os.remove(track_years_journal_file_path)
+
+
+# Create list of track data lists that haven't been processed yet
+# params: set of processed Locations, our main track data list
 # returns: new track_data_list with only the remaining unprocessed tracks
-def create_continuation_track_data_list(last_processed_track, track_data_list):
+def create_continuation_track_data_list(processed_locations, track_data_list):
     """
     Creates a list of remaining track data items for us to process.
     """
     print(colored("Creating new track_data_list with remaining unprocessed file paths...", color="white"))
 
-    idx_of_last_processed_item = [idx for idx,
-                                  item in enumerate(track_data_list) if item[0] == last_processed_track[0]][0]
-
-    starting_index = idx_of_last_processed_item + 1
-
-    cont_track_data_list = track_data_list[starting_index:]
+    # tracks may have been processed in any order, so filter against the
+    # whole set of processed Locations instead of slicing after the last one
+    cont_track_data_list = [
+        item for item in track_data_list if item[0] not in processed_locations]
 
     return cont_track_data_list
 
 
-# Send request for track release year
-# returns the possible release year or 0
-def search_for_release_year(track_title, artist, set_year):
-    """
-    Sends a query for the 4 digit track year.
-    """
-    print(colored(
-        f"\nSending chatGPT query for {track_title} by {artist}...", color="white"))
+# Get the shared openai client, making it on first use
+# returns an openai.OpenAI client
+def get_openai_client():
+    global client
 
-    response = client.responses.create(
-        model="gpt-5-nano",
-        input=f"What year was {track_title} by {artist} released?  Please return only exact 4 digit exact release year."
-    )
+    if client is None:
+        from openai import OpenAI
+        client = OpenAI()
 
-    if len(response.output_text) == 4:
-        return response.output_text
-    else:
-        print(
-            colored(f"==> Response not a 4 digit year for {track_title} by {artist}", color="white"))
-        print(
-            colored(f"==> Chat response: {response.output_text}", color="red"))
-
-        return "0"
+    return client
 
 
 # Appends possible year to a track data list item where no possible exists.
-# return: updated track data item [file_path, track_title, artist, track_title_formatted, year, found_year]
-def update_track_data_with_possible_year(track_data_item, updated_year):
+# return: updated track data item [file_path, track_title, artist, track_title_formatted, year, found_year, confidence]
+def update_track_data_with_possible_year(track_data_item, updated_year, confidence=None):
     """
     Updates a track data item with possible release year.
     """
@@ -222,11 +427,14 @@ def update_track_data_with_possible_year(track_data_item, updated_year):
     artist = track_data_item[2]
     set_year = track_data_item[4]
 
-    print(colored(
-        f"Updating {track_title_formatted} by {artist} with {updated_year}...", color="white"))
+    if not quiet:
+        print(colored(
+            f"Updating {track_title_formatted} by {artist} with {updated_year}...", color="white"))
 
-    # add possible release year to track data
-    track_data_item[5] = updated_year
+    # add possible release year and its confidence to track data. items
+    # read from tracks.csv or fresh from the tags don't have these columns
+    # yet, rows from before confidence scores only have the year.
+    track_data_item[5:] = [updated_year, confidence]
 
     return track_data_item
 
@@ -240,209 +448,895 @@ def output_to_csv(track_data_list, filename):
     print(colored("Writing data to csv file...", color="white"))
 
     # write our outputs to the file with our filename arg
-    file = open(
-        f"/Users/jasontakahashi/Documents/Jaytee/Projects/my-projects/song-years/output/{filename}.csv", "w")
+    file = open(output_dir + f"/{filename}.csv", "w")
 
-    file.write(
-        "Location, Track Title, Artist, Track Title Formatted, Year\n")
+    # rows with a possible year get the track-years header
+    if track_data_list and len(track_data_list[0]) > 5:
+        file.write(TRACK_YEARS_CSV_HEADER)
+    else:
+        file.write(TRACKS_CSV_HEADER)
 
+    writer = csv.writer(file, quoting=csv.QUOTE_ALL)
     for item in track_data_list:
-        writer = csv.writer(file, quoting=csv.QUOTE_ALL)
-        writer.writerow(item)
+        with metrics.timed("csv_write"):
+            writer.writerow(item)
 
     # close the file
     file.close()
 
 
+# Parse the rekordbox.xml, extract the tag data of every track and write
+# it to tracks.csv
+# returns the list of track data items
+def build_track_data_list(rekordbox_xml_file_path, search_folders):
+    """
+    Builds the track data list for the rekordbox collection and
+    writes it to tracks.csv.
+    """
+    if track_source == "scan":
+        print(colored(f"Scanning {', '.join(scan_roots)} for audio files...", color="white"))
+        rekordbox_collection_files = sorted(
+            iter_track_file_paths(rekordbox_xml_file_path, search_folders))
+    else:
+        rekordbox_collection_files = parse_rekordbox_xml(
+            rekordbox_xml_file_path, search_folders)
+
+    print(colored(f"Extracting data from {len(rekordbox_collection_files)} tracks...", color="white"))
+
+    # read tags concurrently. files that can't be read are logged
+    # and left out instead of stopping the run. unchanged files come
+    # from the tag cache
+    tag_cache = open_tag_cache()
+    track_data_list, _ = extract_tracks(
+        rekordbox_collection_files, partial(
+            extract_track_data, verbose=False),
+        workers=extract_workers, use_processes=extract_use_processes,
+        **tag_cache_options(tag_cache))
+    close_tag_cache(tag_cache)
+
+    # write our track data list to file
+    output_to_csv(track_data_list, "tracks")
+
+    return track_data_list
+
+
+# Stream the track data of the rekordbox collection, writing every track
+# to tracks.csv as its tags are read
+# yields track data items
+def stream_track_data(rekordbox_xml_file_path, search_folders):
+    """
+    Front of the fresh run pipeline: rekordbox.xml reader -> tag
+    extraction.  Both stages are generators, so a track reaches the
+    lookups as soon as its tags are read.  Rows go to a temp file that
+    becomes tracks.csv once the whole collection is read.
+    """
+    print(colored("Streaming the collection into tag extraction and lookups...", color="white"))
+
+    temp_file_path = tracks_csv_file_path + ".partial"
+    track_count = 0
+    failed_count = 0
+
+    # opened here, in the thread that runs this generator, as a sqlite
+    # connection can't be shared between threads
+    tag_cache = open_tag_cache()
+
+    # the tags read so far stay cached when the lookups stop early
+    try:
+        with open(temp_file_path, "w") as file:
+            file.write(TRACKS_CSV_HEADER)
+            writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+
+            results = iter_extracted_tracks(
+                iter_track_file_paths(rekordbox_xml_file_path, search_folders),
+                partial(extract_track_data, verbose=False),
+                workers=extract_workers, use_processes=extract_use_processes, ordered=False,
+                **tag_cache_options(tag_cache))
+
+            for file_path, track_data_item, error in results:
+                if error is not None:
+                    failed_count += 1
+                    print(colored(
+                        f"==> Could not read tags for {file_path}: {error}", color="magenta"))
+                    continue
+
+                # written before the item is handed on and gets its found year
+                writer.writerow(track_data_item)
+                track_count += 1
+
+                yield track_data_item
+
+    finally:
+        close_tag_cache(tag_cache)
+
+    os.replace(temp_file_path, tracks_csv_file_path)
+
+    print(colored(
+        f"Read {track_count} tracks from the collection, {failed_count} files could not be read.", color="white"))
+
+
+# Open the track store, importing track-years.csv the first time
+# returns a TrackStore
+def open_track_store(track_years_csv_file_path):
+    """
+    Opens the indexed track store that fix missing years and write tags
+    work on.  An empty store is filled from track-years.csv.
+    """
+    store = TrackStore(track_store_file_path)
+
+    if store.count() == 0 and os.path.exists(track_years_csv_file_path):
+        store.import_csv(track_years_csv_file_path)
+
+    return store
+
+
+# Load the results of a finished run from track-years.csv into the track store
+def import_track_years_into_store(track_years_csv_file_path, replace=False):
+    """
+    Imports track-years.csv into the track store.  replace=True starts
+    the store over, for fresh runs.
+    """
+    store = TrackStore(track_store_file_path)
+    store.import_csv(track_years_csv_file_path, replace=replace)
+    store.close()
+
+
+# Export the track store to track-years.csv when csv export is turned on
+def export_track_store_to_csv(store, track_years_csv_file_path):
+    if export_track_years_csv:
+        store.export_csv(track_years_csv_file_path)
+
+
+# Open the persistent lookup cache for the current model and prompt
+# returns a LookupCache or None when the cache is turned off
+def open_lookup_cache(model=RELEASE_YEAR_MODEL, prompt_version=RELEASE_YEAR_PROMPT_VERSION):
+    """
+    Opens the lookup cache used to skip already resolved tracks.  Years
+    are stored and served under the model and prompt version that found
+    them.
+    """
+    if not use_lookup_cache:
+        return None
+
+    ttl_seconds = lookup_cache_ttl_days * \
+        86400 if lookup_cache_ttl_days is not None else None
+
+    return LookupCache(lookup_cache_file_path, model, prompt_version, ttl_seconds,
+                       shared=lookup_cache_shared, title_pattern=title_strip_pattern)
+
+
+# Open the persistent tag cache
+# returns a TagCache or None when the cache is turned off
+def open_tag_cache():
+    if not use_tag_cache:
+        return None
+
+    return TagCache(tag_cache_file_path, tag_cache_content_hash)
+
+
+# Build the extraction options that serve unchanged files from the tag
+# cache and add the tags of every file read to it
+# returns dict of keyword arguments for extract_tracks / iter_extracted_tracks
+def tag_cache_options(tag_cache):
+    if tag_cache is None:
+        return {}
+
+    def cached_track(track_file_path):
+        tags = tag_cache.get(track_file_path)
+
+        return None if tags is None else make_track_data_item(track_file_path, *tags)
+
+    def on_extracted(track_file_path, track_data_item):
+        tag_cache.put(track_file_path, track_data_item[1],
+                      track_data_item[2], track_data_item[4])
+
+    return {"cached_track": cached_track, "on_extracted": on_extracted}
+
+
+# Print the stats of the tag cache, add its hits and misses to the run
+# metrics and close it
+def close_tag_cache(tag_cache):
+    if tag_cache is None:
+        return
+
+    metrics.increment(f"{tag_cache.name}_hits", tag_cache.hits)
+    metrics.increment(f"{tag_cache.name}_misses", tag_cache.misses)
+    metrics.increment(f"{tag_cache.name}_moved", tag_cache.moved)
+    tag_cache.print_stats()
+    tag_cache.close()
+
+
+# Open the local sources of the resolver chain in the configured order
+# returns a list of resolvers with a get(artist, track_title) method
+def open_year_resolvers(lookup_cache):
+    """
+    Builds the resolver chain tried before the model from YEAR_RESOLVERS.
+    The offline index is skipped if it hasn't been built.
+    """
+    resolvers = []
+
+    for name in year_resolvers:
+        if name == "cache" and lookup_cache:
+            resolvers.append(lookup_cache)
+
+        elif name == "offline":
+            if os.path.exists(offline_index_file_path):
+                resolvers.append(OfflineIndex(offline_index_file_path, title_strip_pattern))
+            else:
+                print(colored(
+                    f"No offline index at {offline_index_file_path}, skipping the offline resolver.", color="magenta"))
+
+    return resolvers
+
+
+# Print the stats of the resolver chain and the lookup cache, add their
+# hits and misses to the run metrics and close them
+def close_year_resolvers(resolvers, lookup_cache):
+    # the cache is closed last, and also when it isn't in the chain
+    closing = [resolver for resolver in resolvers if resolver is not lookup_cache]
+    if lookup_cache:
+        closing.append(lookup_cache)
+
+    for resolver in closing:
+        metrics.increment(f"{resolver.name}_hits", resolver.hits)
+        metrics.increment(f"{resolver.name}_misses", resolver.misses)
+        resolver.print_stats()
+        resolver.close()
+
+
+# Look up release years concurrently with the configured engine options
+# and the resolver chain, calling on_result(track_data_item, found_year,
+# confidence) for every track in track order
+# stream == True: track_data_list is an iterator that is consumed while
+# the lookups run, results come in completion order
+# escalated == True: the tracks already went through the resolver chain
+# without a year, so they go straight to the model with the escalated
+# prompt and the escalation model
+# samples overrides LOOKUP_SAMPLES
+# fresh == True: the cache isn't asked, only written, so years looked up
+# again aren't answered by the years they are looked up again for
+# returns the engine stats dict
+def lookup_track_data_release_years(track_data_list, on_result, ordered=True, stream=False, escalated=False, samples=None,
+                                    fresh=False):
+    """
+    Looks up the release year of every track data item.
+    """
+    if escalated:
+        # the escalated answers are labelled with the model and prompt
+        # that gave them
+        lookup_cache = open_lookup_cache(fix_escalation_model or RELEASE_YEAR_MODEL,
+                                         ESCALATED_RELEASE_YEAR_PROMPT_VERSION)
+        resolvers = []
+    else:
+        lookup_cache = open_lookup_cache()
+        resolvers = open_year_resolvers(None if fresh else lookup_cache)
+
+    engine_options = dict(
+        concurrency=lookup_concurrency,
+        requests_per_minute=lookup_requests_per_minute,
+        tokens_per_minute=lookup_tokens_per_minute,
+        timeout=lookup_timeout,
+        cache=lookup_cache,
+        pack_size=lookup_pack_size,
+        resolvers=resolvers,
+        use_model="model" in year_resolvers,
+        verbose=not quiet,
+        samples=samples or lookup_samples,
+        title_pattern=title_strip_pattern)
+
+    if escalated:
+        # the escalated prompt is per track, so it isn't packed
+        engine_options.update(model=fix_escalation_model or RELEASE_YEAR_MODEL,
+                              prompt=escalated_release_year_prompt, pack_size=1, use_model=True)
+
+    # quiet mode: one progress bar instead of a message per track
+    progress_bar = None
+    if quiet:
+        from tqdm import tqdm
+
+        progress_bar = tqdm(total=len(track_data_list) if hasattr(
+            track_data_list, "__len__") else None, desc="Looking up years", unit="track")
+        report_result = on_result
+
+        def on_result(track_data_item, found_year, confidence):
+            report_result(track_data_item, found_year, confidence)
+            progress_bar.update(1)
+
+    if stream:
+        # the collection isn't known up front, so tracks are clustered
+        # as they arrive
+        if fuzzy_match_threshold is not None:
+            engine_options["key_aliases"] = StreamingKeyAliases(
+                fuzzy_match_threshold)
+
+        stats = lookup_release_years_streaming(
+            track_data_list, on_result, queue_size=pipeline_queue_size, **engine_options)
+
+    else:
+        if fuzzy_match_threshold is not None:
+            engine_options["key_aliases"] = cluster_track_keys(
+                track_data_list, fuzzy_match_threshold, title_strip_pattern)
+            print(colored(
+                f"Clustered {len(engine_options['key_aliases'])} near-duplicate track keys into {len(set(engine_options['key_aliases'].values()))} lookups.", color="white"))
+
+        stats = lookup_release_years(
+            track_data_list, on_result, ordered=ordered, **engine_options)
+
+    if progress_bar is not None:
+        progress_bar.close()
+
+    for counter in ["requests", "retries", "failed", "not_found", "deduplicated", "clustered", "resolved_locally", "shared"]:
+        metrics.increment(f"lookup_{counter}", stats[counter])
+
+    print(colored(
+        f"Lookups: {stats['requests']} requests, {stats['retries']} retries, {stats['failed']} failed, {stats['not_found']} without a year, {stats['tokens']} tokens, {stats['deduplicated']} duplicates skipped, {stats['clustered']} resolved by a fuzzy match, {stats['resolved_locally']} resolved locally {stats['resolver_hits']}.", color="white"))
+
+    close_year_resolvers(resolvers, lookup_cache)
+
+    return stats
+
+
+# Look up release years concurrently and append each result to a csv file
+# results are written in batches as they come in and every written row is
+# recorded in the journal, so an interrupted run can be continued with only
+# the tracks that weren't written yet
+def append_release_years_to_csv(track_data_list, results, stream=False):
+    """
+    Looks up the release year of every track data item and hands the
+    updated track data items to the ResultsWriter.
+    """
+    def write_result(track_data_item, found_year, confidence):
+        track_data = update_track_data_with_possible_year(
+            track_data_item, found_year, confidence)
+
+        with metrics.timed("csv_write"):
+            results.write(track_data)
+
+    # resuming doesn't depend on row order, so results are written as
+    # soon as they are done
+    return lookup_track_data_release_years(track_data_list, write_result, ordered=False, stream=stream)
+
+
+# Open the batched writer of track-years.csv and its journal
+# returns a ResultsWriter
+def open_results_writer(track_years_csv_file_path, fresh=False):
+    return ResultsWriter(track_years_csv_file_path, track_years_journal_file_path, fresh=fresh,
+                         header=TRACK_YEARS_CSV_HEADER, batch_size=results_batch_size,
+                         fsync_interval=results_fsync_interval)
+
+
+# Open the writer of an interrupted run's track-years.csv and its journal
+# returns a tuple of (ResultsWriter, set of processed Locations)
+def open_resumed_results_writer(track_years_csv_file_path):
+    """
+    Cuts off a partly written last row and reads the processed Locations
+    from the journal, or from track-years.csv for runs without one.
+    """
+    # drop a row that was only partly written when the run stopped
+    if os.path.exists(track_years_csv_file_path) and repair_torn_tail(track_years_csv_file_path):
+        print(colored(
+            "==> Removed a partly written row from the end of track-years.csv.", color="magenta"))
+
+    journal_exists = os.path.exists(track_years_journal_file_path)
+    processed_locations = load_processed_locations(
+        track_years_journal_file_path, track_years_csv_file_path)
+
+    # rows are only journaled once they are fsynced, so the rows written
+    # since the last fsync are missing from the journal.  they are looked
+    # up again, except the last one
+    last_processed_track = None
+    if os.path.exists(track_years_csv_file_path):
+        last_processed_track = get_last_processed_track(track_years_csv_file_path)
+
+    unjournaled_location = None
+    if last_processed_track and last_processed_track[0] not in processed_locations | {"Location"}:
+        unjournaled_location = last_processed_track[0]
+        processed_locations.add(unjournaled_location)
+
+    results = open_results_writer(track_years_csv_file_path)
+
+    # a run without a journal gets one seeded with everything already in
+    # track-years.csv
+    if not journal_exists:
+        results.journal.append_many(processed_locations)
+    elif unjournaled_location:
+        results.journal.append(unjournaled_location)
+
+    return results, processed_locations
+
+
+# Check for looked up tracks in track-years.csv or its journal
+# returns True if a fresh run would throw results away
+def has_track_years_results(track_years_csv_file_path):
+    if os.path.exists(track_years_journal_file_path) and os.path.getsize(track_years_journal_file_path):
+        return True
+
+    if not os.path.exists(track_years_csv_file_path):
+        return False
+
+    with open(track_years_csv_file_path) as file:
+        file.readline()
+        return bool(file.readline().strip())
+
+
+# Sort track-years.csv of a finished run by Location, one row per track
+def compact_track_years_csv(results):
+    with metrics.timed("csv_write"):
+        row_count, duplicate_count = results.compact()
+
+    print(colored(
+        f"Wrote {results.rows_written} rows in {results.batches_written} batches, {row_count} tracks in track-years.csv after dropping {duplicate_count} duplicate rows.", color="white"))
+
+
 # -----------  Get Track Release Years  ----------- #
 
-def get_track_release_year(tracks_csv_file_path, track_years_csv_file_path, rekordbox_xml_file_path, search_folders):
+# resuming: every row written to track-years.csv is also recorded in
+# track-years.journal. the tracks in tracks.csv that aren't in the journal
+# are the ones left to process. a streamed run stopped before tracks.csv
+# was complete is continued by streaming the collection again and only
+# looking up the tracks that aren't in the journal.
+# resume=False starts over even if tracks.csv exists
+# returns the lookup stats dict, or None if the run was cancelled
+def get_track_release_year(tracks_csv_file_path, track_years_csv_file_path, rekordbox_xml_file_path, search_folders, assume_yes=False, resume=None):
     # if tracks.csv exists, then we are continuing an error'd out or cancelled
     # operation so we can check the track-years csv file and parse the remaining
     # unprocessed tracks to create a new track_data_list and pass it to the
     # update_track_data func and avoid parsing the rekordbox xml again or
     # re-searching already processed tracks
-    if (os.path.exists(tracks_csv_file_path)):
-        proceed = input(colored(
-            "==> track-years.csv file exists. Continue track year updating? (y/n) ", color="magenta"))
-
-        if proceed.lower() == "y":
+    if os.path.exists(tracks_csv_file_path) and resume is not False:
+        if confirm("==> track-years.csv file exists. Continue track year updating? (y/n) ", assume_yes, color="magenta"):
             print(colored("Continuing getting track years...", color="white"))
 
             orig_track_data_list = parse_csv_to_list(tracks_csv_file_path)
 
-            last_processed_track = get_last_processed_track(
+            # open the csv file and the journal that we will append to
+            results, processed_locations = open_resumed_results_writer(
                 track_years_csv_file_path)
 
-            cont_track_data_list = create_continuation_track_data_list(
-                last_processed_track, orig_track_data_list)
+            try:
+                cont_track_data_list = create_continuation_track_data_list(
+                    processed_locations, orig_track_data_list)
 
-            if len(cont_track_data_list) < 1:
-                print(colored("No tracks left to process. Quitting...", color="magenta"))
-                exit()
+                if len(cont_track_data_list) < 1:
+                    print(colored("No tracks left to process. Quitting...", color="magenta"))
+                    return {}
+
+                # optional: write our continuation track list to a new file
+                output_to_csv(cont_track_data_list, "tracks-continued")
+
+                stats = append_release_years_to_csv(
+                    cont_track_data_list, results)
+
+            finally:
+                # rows already looked up are kept for the next resume
+                results.close()
+
+            compact_track_years_csv(results)
+            import_track_years_into_store(track_years_csv_file_path)
+
+            print(colored("Finished getting track years.  Exiting...", color="white"))
+            return stats
 
-            # optional: write our continuation track list to a new file
-            output_to_csv(cont_track_data_list, "tracks-continued")
+        else:
+            print(colored("Quitting script...", color="magenta"))
+            return None
 
-            # open the csv file that we will append to
-            file = open(track_years_csv_file_path, "a")
+    # starting a fresh operation with tracks.csv not present
+    else:
+        # a streamed run that was stopped before the whole collection was
+        # read left tracks.csv.partial, its results are kept and only the
+        # tracks it didn't write are looked up
+        continue_stream = False
+        if resume is not False and os.path.exists(tracks_csv_file_path + ".partial") and \
+                has_track_years_results(track_years_csv_file_path):
+            continue_stream = confirm(
+                "==> An earlier run was stopped while reading the collection. Continue it, keeping the track years it found? (y/n) ", assume_yes, color="magenta")
+
+        # a fresh run starts track-years.csv and its journal over
+        if not continue_stream and has_track_years_results(track_years_csv_file_path):
+            if not confirm("==> track-years.csv holds the results of an earlier run, which a fresh run replaces. Continue? (y/n) ", assume_yes, color="magenta"):
+                print(colored("Quitting script...", color="magenta"))
+                return None
 
-            for track_data_item in cont_track_data_list:
-                formatted_track_title = track_data_item[3]
-                artist = track_data_item[2]
+        # ensure user has exported a current version of the Rekordbox.xml
+        if confirm_collection_is_current(assume_yes):
+            # xml reader -> tag extraction -> lookups -> csv writer, all
+            # running at once with bounded queues between them
+            track_data_list = stream_track_data(
+                rekordbox_xml_file_path, search_folders)
+
+            if continue_stream:
+                print(colored("Continuing getting track years...", color="white"))
 
-                found_year = search_for_release_year(
-                    formatted_track_title, artist)
+                results, processed_locations = open_resumed_results_writer(
+                    track_years_csv_file_path)
 
-                track_data = update_track_data_with_possible_year(
-                    track_data_item, found_year)
+                # every track still goes to tracks.csv, only the lookups
+                # of processed ones are skipped
+                track_data_list = (track_data_item for track_data_item in track_data_list
+                                   if track_data_item[0] not in processed_locations)
+
+            else:
+                # create the file and the journal that we will incrementally
+                # write to, with the header since this is a fresh write
+                results = open_results_writer(track_years_csv_file_path, fresh=True)
 
-                # Incrementally writes to csv so if an error occurs,
-                # we can restart without reprocessing already processed tracks.
-                writer = csv.writer(file, quoting=csv.QUOTE_ALL)
-                writer.writerow(track_data)
+            try:
+                stats = append_release_years_to_csv(
+                    track_data_list, results, stream=True)
+            finally:
+                results.close()
 
-            # close the file
-            file.close()
+            compact_track_years_csv(results)
+            import_track_years_into_store(
+                track_years_csv_file_path, replace=True)
 
             print(colored("Finished getting track years.  Exiting...", color="white"))
-            exit()
+            return stats
 
         else:
             print(colored("Quitting script...", color="magenta"))
-            exit()
+            return None
+
+
+# -----------  Get Track Release Years (Batch)  ----------- #
+
+# submits every track as one batch api job instead of one request per
+# track. slower to come back (up to 24h) but much cheaper for full library
+# runs. the batch id is saved so the script can be quit and started again
+# later to collect the results.
+# returns the number of tracks the batch found a year for, or None if the
+# run was cancelled
+def get_track_release_years_batch(tracks_csv_file_path, track_years_csv_file_path, rekordbox_xml_file_path, search_folders, transport=None, assume_yes=False):
+    transport = transport or OpenAIBatchTransport(get_openai_client())
+    lookup_cache = open_lookup_cache()
+
+    if os.path.exists(batch_state_file_path):
+        if not confirm("==> A submitted batch exists. Check on it and merge its results? (y/n) ", assume_yes, color="magenta"):
+            print(colored("Quitting script...", color="magenta"))
+            return None
+
+        with open(batch_state_file_path) as file:
+            state = json.load(file)
+
+        track_data_list = parse_csv_to_list(tracks_csv_file_path)
 
-    # starting a fresh operation with tracks.csv not present
     else:
-        # ensure user has exported a current version of the Rekordbox.xml
-        proceed = input(colored(
-            "The rekordbox.xml file must be current or data will be incorrect. Continue? (y/n) ", color="cyan"))
+        if os.path.exists(tracks_csv_file_path):
+            print(colored("Using track data from tracks.csv...", color="white"))
+            track_data_list = parse_csv_to_list(tracks_csv_file_path)
 
-        if proceed.lower() == "y":
-            rekordbox_collection_files = parse_rekordbox_xml(
+        else:
+            # ensure user has exported a current version of the Rekordbox.xml
+            if not confirm_collection_is_current(assume_yes):
+                print(colored("Quitting script...", color="magenta"))
+                return None
+
+            track_data_list = build_track_data_list(
                 rekordbox_xml_file_path, search_folders)
 
-            print(colored("Extracting data from parsed rekordbox xml...", color="white"))
+        state = submit_batch(track_data_list, transport, batch_input_file_path,
+                             batch_state_file_path, RELEASE_YEAR_MODEL, lookup_cache, title_strip_pattern)
 
-            track_data_list = []
-            for file_path in rekordbox_collection_files:
-                track_data = extract_track_data(file_path)
-                track_data_list.append(track_data)
+    found_years = {}
 
-            # write our track data list to file
-            output_to_csv(track_data_list, "tracks")
+    if state["batch_id"]:
+        print(colored(
+            "Waiting for the batch to finish. It is safe to quit (ctrl-c) and run this option again later.", color="white"))
 
-            # create the file that we will incrementally write to
-            file = open(track_years_csv_file_path, "w")
+        batch = poll_batch(transport, state["batch_id"], batch_poll_interval)
+        found_years = download_batch_results(transport, batch)
 
-            # write header for csv since this is a going to be a fresh write
-            file.write(
-                "Location, Track Title, Artist, Track Title Formatted, Year, Possible Year\n")
+    merge_batch_results(track_data_list, state, found_years,
+                        track_years_csv_file_path, lookup_cache, title_strip_pattern)
+    discard_track_years_journal()
+    import_track_years_into_store(track_years_csv_file_path)
 
-            for track_data_item in track_data_list:
-                formatted_track_title = track_data_item[3]
-                artist = track_data_item[2]
+    # the batch is merged, the next run starts a new one
+    os.remove(batch_state_file_path)
 
-                found_year = search_for_release_year(
-                    formatted_track_title, artist)
-                track_data = update_track_data_with_possible_year(
-                    track_data_item, found_year)
+    if lookup_cache:
+        lookup_cache.print_stats()
+        lookup_cache.close()
 
-                # Incrementally writes to csv so if an error occurs,
-                # we can restart without reprocessing already processed tracks.
-                writer = csv.writer(file, quoting=csv.QUOTE_ALL)
-                writer.writerow(track_data)
+    print(colored("Finished getting track years.  Exiting...", color="white"))
+    return len(found_years)
 
-            # close the file
-            file.close()
 
-            print(colored("Finished getting track years.  Exiting...", color="white"))
-            exit()
+# -----------  Sync New and Changed Tracks  ----------- #
 
-        else:
-            print(colored("Quitting script...", color="magenta"))
-            exit()
+# only processes the tracks that were added or changed since the last
+# sync (or full run) and prunes the tracks that were removed from the
+# collection, instead of redoing the whole library
+# returns a dict of added, modified, deleted and failed track counts and
+# the lookup stats, or None if the run was cancelled
+def sync_track_release_years(tracks_csv_file_path, track_years_csv_file_path, rekordbox_xml_file_path, search_folders, assume_yes=False):
+    # ensure user has exported a current version of the Rekordbox.xml
+    if not confirm_collection_is_current(assume_yes):
+        print(colored("Quitting script...", color="magenta"))
+        return None
+
+    store = open_track_store(track_years_csv_file_path)
+
+    current_state = read_collection_state(
+        rekordbox_xml_file_path, search_folders)
+
+    result = sync_changed_tracks(store, current_state)
+    store.close()
+
+    if result["added"] or result["modified"] or result["deleted"]:
+        print(colored(
+            f"Finished syncing track years. The track store now holds {result['track_count']} tracks.  Exiting...", color="white"))
+    else:
+        print(colored("Track years are up to date.  Exiting...", color="white"))
+
+    return result
+
+
+# Extract, look up and store the tracks added or changed since the last
+# sync, and remove the deleted ones
+# settle_seconds holds back files changed that recently
+# returns a summary dict of the changes
+def sync_changed_tracks(store, current_state, settle_seconds=None):
+    """
+    Diffs the current state of the collection against track-state.csv and
+    updates the track store and track-state.csv.
+    """
+    stored_state = load_track_state(track_state_csv_file_path)
+
+    # first sync after a full run: the tracks already in the track store
+    # count as unchanged
+    if not stored_state:
+        known_locations = store.locations()
+        stored_state = {location: signature for location, signature in current_state.items()
+                        if location in known_locations}
+
+    if settle_seconds:
+        current_state = hold_back_unsettled(current_state, stored_state, settle_seconds)
+
+    added, modified, deleted = diff_track_state(stored_state, current_state)
+
+    if not added and not modified and not deleted:
+        write_track_state(track_state_csv_file_path, current_state)
+        return {"added": 0, "modified": 0, "deleted": 0, "failed": 0, "lookups": {},
+                "track_count": store.count()}
+
+    print(colored(
+        f"{len(added)} added, {len(modified)} modified and {len(deleted)} deleted tracks since the last sync.", color="white"))
+
+    track_year_rows = []
+    failed = []
+    stats = {}
+
+    # read tags for the added and modified tracks only. a track whose
+    # TrackID changed but whose file didn't comes from the tag cache
+    if added or modified:
+        tag_cache = open_tag_cache()
+        track_data_list, failed = extract_tracks(
+            added + modified, partial(extract_track_data, verbose=False),
+            workers=extract_workers, use_processes=extract_use_processes,
+            **tag_cache_options(tag_cache))
+        close_tag_cache(tag_cache)
+
+        def collect_result(track_data_item, found_year, confidence):
+            track_year_rows.append(update_track_data_with_possible_year(
+                track_data_item, found_year, confidence))
+
+        stats = lookup_track_data_release_years(track_data_list, collect_result)
+
+    # update only the changed rows of the track store
+    store.upsert_tracks(track_year_rows)
+    store.delete(deleted)
+
+    export_track_store_to_csv(store, track_years_csv_file_path)
+
+    # tracks that couldn't be read are left out of the state so the next
+    # sync tries them again
+    failed_locations = set(file_path for file_path, _ in failed)
+    write_track_state(track_state_csv_file_path, {location: signature for location, signature in current_state.items()
+                                                  if location not in failed_locations})
+
+    return {"added": len(added), "modified": len(modified), "deleted": len(deleted),
+            "failed": len(failed), "lookups": stats, "track_count": store.count()}
+
+
+# -----------  Watch the Library  ----------- #
+
+# looks for added and changed tracks every interval seconds and looks up
+# their years right away, so the track store stays current without
+# running anything by hand. with the scan source no export is needed.
+# runs until interrupted, or for polls looks
+# returns a summary dict of the changes handled
+def watch_library(track_years_csv_file_path, rekordbox_xml_file_path, search_folders, interval=None, polls=None):
+    interval = watch_poll_interval if interval is None else interval
+    source = ", ".join(scan_roots) if track_source == "scan" else rekordbox_xml_file_path
+
+    store = open_track_store(track_years_csv_file_path)
+    totals = {"polls": 0, "added": 0, "modified": 0, "deleted": 0, "failed": 0}
+
+    print(colored(
+        f"Watching {source} for added and changed tracks every {interval}s, ctrl+c to stop...", color="white"))
+
+    try:
+        while polls is None or totals["polls"] < polls:
+            if totals["polls"]:
+                time.sleep(interval)
+
+            result = sync_changed_tracks(
+                store, read_collection_state(rekordbox_xml_file_path, search_folders),
+                settle_seconds=watch_settle_seconds)
+            totals["polls"] += 1
+
+            for counter in ["added", "modified", "deleted", "failed"]:
+                totals[counter] += result[counter]
+
+            if result["added"] or result["modified"] or result["deleted"]:
+                print(colored(
+                    f"The track store now holds {result['track_count']} tracks.", color="white"))
+
+    except KeyboardInterrupt:
+        print(colored("\nStopped watching.", color="magenta"))
+
+    finally:
+        store.close()
+
+    print(colored(
+        f"{totals['added']} added, {totals['modified']} modified and {totals['deleted']} deleted tracks in {totals['polls']} looks, {totals['failed']} files could not be read.", color="white"))
+
+    return totals
 
 
 # -----------  Fix Missing Track Years  ----------- #
 
-# chatGPT may have not retured a release year.  it this case
-# the entered year is "0".  this func re-queries those entries.
-# and alternatively allows user to enter their own found year.
-def fix_missing_years(track_years_csv_file_path):
-    track_years_data_list = parse_csv_to_list(track_years_csv_file_path)
+# Re-query tracks concurrently
+# params: lists of track data items without a found year and with a low
+# confidence one
+# returns list of (found_year, confidence) tuples, by row index of the
+# two lists one after the other
+def requery_missing_years(missing_years_track_list, low_confidence_track_list=()):
+    """
+    Looks every track up again through the resolver chain and the model,
+    with FIX_SAMPLES answers per track.  Low confidence tracks skip the
+    lookup cache, which holds the year they are looked up again for.
+    Tracks still without a year are asked once more with the escalated
+    prompt when FIX_ESCALATE is on.
+    """
+    requeued_track_list = list(missing_years_track_list) + list(low_confidence_track_list)
+    found_years = [("0", 0.0)] * len(requeued_track_list)
 
-    # missing_years_track_list will be a list of nested tuples:
-    # [ tuple( index in track_years_data_list, [track_data] ) ]
-    missing_years_track_list = [
-        (idx, item) for idx, item in enumerate(track_years_data_list) if item[5] == "0"]
+    def requery(row_indexes, escalated, fresh=False):
+        if not row_indexes:
+            return
 
-    proceed = input(colored(
-        f"There are {len(missing_years_track_list)} tracks that need to be rechecked.  Would you like to continue? (y/n): ", color="cyan"))
+        track_data_list = [requeued_track_list[index]
+                           for index in row_indexes]
+        results = iter(row_indexes)
 
-    if proceed.lower() == "y":
+        # results come back in track order, so they map back to their rows
+        def on_result(track_data_item, found_year, confidence):
+            found_years[next(results)] = (found_year, confidence)
 
-        # loop through each item, get the year again, and replace the
-        # item in our main_track_years_data_list with the updated item
-        for (idx_in_track_years_list, track_data_item) in missing_years_track_list:
-            artist = track_data_item[2]
-            formatted_track_name = track_data_item[3]
-            set_year = track_data_item[4]
+        lookup_track_data_release_years(
+            track_data_list, on_result, ordered=True, escalated=escalated,
+            samples=fix_samples, fresh=fresh)
 
-            print(
-                colored(f"\nNext track to query for: {formatted_track_name} by {artist} with set year {set_year}", color="white"))
+    print(colored(
+        f"Looking up {len(requeued_track_list)} tracks again...", color="white"))
+    missing_count = len(missing_years_track_list)
+    requery(list(range(missing_count)), escalated=False)
+    requery(list(range(missing_count, len(requeued_track_list))), escalated=False, fresh=True)
 
-            user_response = None
-            user_entered_year = None
-            year_to_add = None
+    unresolved = [index for index, (found_year, _) in enumerate(found_years) if found_year == "0"]
 
-            while True:
-                user_response = input(colored(
-                    "Enter \"run\" to query, enter your own 4 digit year, press the return button to skip this track, or enter \"quit\" to exit: ", color="cyan"))
+    if fix_escalate and unresolved:
+        model = fix_escalation_model or RELEASE_YEAR_MODEL
+        print(colored(
+            f"Asking {model} about the {len(unresolved)} tracks still without a year with a more detailed prompt...", color="white"))
+        requery(unresolved, escalated=True)
 
-                if user_response.lower() in ["run", "quit", "", ]:
-                    break
+    return found_years
 
-                if regex.match(r"(?:19|20)\d{2}", user_response):
-                    year_to_add = user_response
-                    break
 
-            if user_response.lower() == "quit":
-                break
+# Ask the user for the years of tracks the lookups couldn't find
+# returns a list of (location, year, confidence) tuples for the entered years
+def review_missing_years(unresolved_track_list):
+    import regex
 
-            if user_response == "":
-                print(colored("Skipping current track...", color="magenta"))
-                continue
+    entered_years = []
 
-            if user_response.lower() == "run":
-                found_year = search_for_release_year(
-                    formatted_track_name, artist, set_year)
+    for track_data_item in unresolved_track_list:
+        print(colored(
+            f"\nNo year found for: {track_data_item[3]} by {track_data_item[2]} with set year {track_data_item[4]}", color="white"))
 
-                if found_year == "0":
-                    print(colored("Skipping current track...", color="magenta"))
-                    break
+        while True:
+            try:
+                user_response = input(colored(
+                    "Enter your own 4 digit year, press the return button to skip this track, or enter \"quit\" to stop reviewing: ", color="cyan"))
+            except EOFError:
+                # no terminal to answer on
+                user_response = "quit"
 
-                year_to_add = found_year
+            if user_response.lower() in ["quit", ""] or regex.fullmatch(r"(?:19|20)\d{2}", user_response):
+                break
 
-            # replace "missing" year with user-entered year
-            track_data_item = update_track_data_with_possible_year(
-                track_data_item, year_to_add)
+        if user_response.lower() == "quit":
+            break
 
-            # replace the current track_data_item in the track_data_list with updated track_data_item
-            track_years_data_list[idx_in_track_years_list] = track_data_item
+        if user_response == "":
+            print(colored("Skipping current track...", color="magenta"))
+            continue
 
-        # write updated data to csv
-        output_to_csv(track_years_data_list, "track-years")
+        # the user knows best
+        entered_years.append((track_data_item[0], user_response, 1.0))
 
-    else:
+    return entered_years
+
+
+# chatGPT may have not retured a release year.  it this case
+# the entered year is "0".  this func re-queries those entries, and the
+# ones whose confidence is below MIN_CONFIDENCE, concurrently, writes
+# every found year back in one pass, and then lets the user enter the
+# years of the tracks that are still missing.
+# interactive=False skips the review
+# returns a dict of fixed, skipped and improved track counts, or None if cancelled
+def fix_missing_years(track_years_csv_file_path, assume_yes=False, interactive=True):
+    store = open_track_store(track_years_csv_file_path)
+
+    # indexed selects of the tracks without a found year, and with one
+    # that isn't confident enough
+    missing_years_track_list = store.missing_found_years()
+    low_confidence_track_list = store.low_confidence_tracks(
+        min_confidence) if min_confidence is not None else []
+
+    message = f"There are {len(missing_years_track_list)} tracks that need to be rechecked"
+    if low_confidence_track_list:
+        message += f" and {len(low_confidence_track_list)} with a confidence below {min_confidence}"
+
+    if not confirm(message + ".  Would you like to continue? (y/n): ", assume_yes):
+        store.close()
         print(colored("Quitting script...", color="magenta"))
-        exit()
+        return None
+
+    requeued_track_list = missing_years_track_list + low_confidence_track_list
+    found_years = requery_missing_years(missing_years_track_list, low_confidence_track_list)
+
+    # a low confidence year is only replaced by a more confident one
+    updates = []
+    for track_data_item, (found_year, confidence) in zip(requeued_track_list, found_years):
+        if found_year != "0" and (track_data_item[5] == "0" or confidence > (track_data_item.confidence or 0)):
+            updates.append((track_data_item[0], found_year, confidence))
+
+    # write every found year back in one transaction
+    store.set_found_years(updates)
+
+    unresolved_track_list = [track_data_item for track_data_item, (found_year, _)
+                             in zip(missing_years_track_list, found_years) if found_year == "0"]
+    fixed_count = len(missing_years_track_list) - len(unresolved_track_list)
+    improved_count = len(updates) - fixed_count
+
+    print(colored(
+        f"Found {fixed_count} of {len(missing_years_track_list)} missing years, {len(unresolved_track_list)} still missing.", color="white"))
+    if low_confidence_track_list:
+        print(colored(
+            f"Found a more confident year for {improved_count} of {len(low_confidence_track_list)} low confidence tracks.", color="white"))
+
+    if interactive and unresolved_track_list:
+        entered_years = review_missing_years(unresolved_track_list)
+        store.set_found_years(entered_years)
+        fixed_count += len(entered_years)
+
+    export_track_store_to_csv(store, track_years_csv_file_path)
+    store.close()
+
+    return {"fixed": fixed_count, "skipped": len(missing_years_track_list) - fixed_count,
+            "improved": improved_count}
 
 
 # -----------  Write Results to ID3 Tag  ----------- #
 
 # gets the file type so that mutagen can handle properly
 def get_file_format(file_path):
+    from mutagen import File
+
     if (os.path.exists(file_path)):
         audio = File(file_path)
         if audio is not None:
@@ -455,6 +1349,9 @@ def get_file_format(file_path):
 # gets the current year based on file type
 # returns current year or None
 def get_year(file_path, file_mime_type):
+    from mutagen.easyid3 import EasyID3
+    from mutagen.mp4 import MP4
+
     if file_mime_type == "audio/mp4":
         return MP4(file_path).tags.get("\xa9day", [None])[-1]
 
@@ -469,15 +1366,13 @@ def get_year(file_path, file_mime_type):
 
 # sets the current year based on file type
 def set_year(file_path, year, file_mime_type):
-    if file_mime_type == "audio/mp4":
-        tags = MP4(file_path).tags
-        tags["\xa9day"] = year
-        tags.save(file_path)
+    if file_mime_type in SUPPORTED_MIME_TYPES:
+        # opens the file once, with the format detected from the same handle
+        _, _, status, message = write_year(
+            file_path, year, atomic=tag_write_atomic)
 
-    elif file_mime_type == "audio/mp3":
-        audio = EasyID3(file_path)
-        audio["date"] = year
-        audio.save()
+        if status != WRITTEN:
+            print(colored(f"Could not set year: {message}", color="magenta"))
 
     else:
         print(colored("Cannot set year for this audio format.", color="magenta"))
@@ -486,84 +1381,375 @@ def set_year(file_path, year, file_mime_type):
 # write year to ID3 tags
 # type == "missing": tagged year unset, found year is not 0
 # type == "differing" tagged year different from found year
-def write_track_release_years(track_years_csv_file_path, type):
-    track_data_list = parse_csv_to_list(track_years_csv_file_path)
+# dry_run == True: report what would be written without touching any file
+# returns dict of status -> list of write results, or None if cancelled
+def write_track_release_years(track_years_csv_file_path, type, dry_run=None, assume_yes=False):
+    if dry_run is None:
+        dry_run = tag_write_dry_run
+
+    store = open_track_store(track_years_csv_file_path)
 
     tracks_to_write = []
-    proceed = None
+    held_back_count = 0
+    message = None
 
+    # years below the minimum confidence are held back
     if type == "missing":
-        tracks_to_write = [
-            (idx, item) for idx, item in enumerate(track_data_list) if (item[4] == "0" or item[4] == "None") and not item[5] == "0"]
+        tracks_to_write = store.tracks_with_unset_year(min_confidence)
+        if min_confidence is not None:
+            held_back_count = store.count_tracks_with_unset_year() - len(tracks_to_write)
 
-        if len(tracks_to_write) == 0:
-            print(colored(
-                "There are no tracks left to write tags to.  Quitting script...", color="magenta"))
-            exit()
-
-        proceed = input(colored(
-            f"There are {len(tracks_to_write)} tracks that have no release year set, but a potential updated release year.  Would you like to continue and write the new release years to the tracks? (y/n): ", color="cyan"))
+        message = f"There are {len(tracks_to_write)} tracks that have no release year set, but a potential updated release year.  Would you like to continue and write the new release years to the tracks? (y/n): "
 
     if type == "differing":
-        tracks_to_write = [
-            (idx, item) for idx, item in enumerate(track_data_list) if not item[5] == "0" and not item[4] == item[5]]
+        tracks_to_write = store.tracks_with_differing_year(min_confidence)
+        if min_confidence is not None:
+            held_back_count = store.count_tracks_with_differing_year() - len(tracks_to_write)
 
-        if len(tracks_to_write) == 0:
-            print(colored(
-                "There are no tracks left to write tags to.  Quitting script...", color="magenta"))
-            exit()
+        message = f"There are {len(tracks_to_write)} tracks that have potential updated release years.  Would you like to continue? (y/n): "
 
-        proceed = input(colored(
-            f"There are {len(tracks_to_write)} tracks that have potential updated release years.  Would you like to continue? (y/n): ", color="cyan"))
+    if held_back_count:
+        print(colored(
+            f"==> {held_back_count} tracks with a confidence below {min_confidence} are left out.  Fix missing years looks them up again.", color="magenta"))
 
-    if proceed.lower() == "y":
-        print(colored("Continuing...", color="white"))
+    if len(tracks_to_write) == 0:
+        print(colored(
+            "There are no tracks left to write tags to.  Quitting script...", color="magenta"))
+        store.close()
+        return {WRITTEN: [], SKIPPED: [], FAILED: []}
 
-        for idx_in_track_data_list, track_data_item in tracks_to_write:
-            file_path = track_data_item[0]
-            found_year = track_data_item[5]
+    if confirm(message, assume_yes):
+        print(colored("Continuing...", color="white"))
 
-            file_type = get_file_format(file_path)
+        def record_result(result):
+            file_path, found_year, status, _ = result
 
-            if file_type == None:
-                print(colored(
-                    f"{file_path} doesn't exist, please check for errors. skipping...", color="magenta"))
+            # after setting year in ID3 tag, update the track's tagged year in the track store
+            if status == WRITTEN and not dry_run:
+                store.set_year(file_path, found_year)
 
-            elif file_type == "Unknown format":
-                print(colored(
-                    "Current track is of unknown format, will not attempt to write year...skipping", color="magenta"))
+        # each file is opened once and written on a bounded thread pool
+        results = write_years([(item[0], item[5]) for item in tracks_to_write],
+                              workers=tag_write_workers, dry_run=dry_run, atomic=tag_write_atomic,
+                              on_result=record_result)
 
-            elif file_type == "audio/mp3" or file_type == "audio/mp4":
-                print(colored(
-                    f"Current track is of \"{file_type}\" format. Writing \"{found_year}\" to ID3 tag...", color="white"))
+        export_track_store_to_csv(store, track_years_csv_file_path)
+        store.close()
 
-                set_year(file_path, found_year, file_type)
+        return results
 
-                # after setting year in ID3 tag, update the current track_data_item with the new year
-                track_data_item[4] = found_year
+    else:
+        store.close()
+        print(colored("Quitting script...", color="magenta"))
+        return None
 
-                # set the track_data_item in the track_data_list to the updated track_data_item
-                track_data_list[idx_in_track_data_list
-                                ] = track_data_item
 
-            else:
-                print(colored(
-                    f"Current track is of \"{file_type}\" format.  This script doesn't account for this file format.", color="magenta"))
-                print(colored(
-                    f"Please contact the developer to add support for this file format.", color="magenta"))
-                print(colored("Skipping track...", color="magenta"))
+# -----------  Write Track Years to Rekordbox XML  ----------- #
 
-        # write the updated track_data_list to the track_years_csv file
-        output_to_csv(track_data_list, "track-years")
+# streams rekordbox.xml into a copy with the Year of every track set from
+# the track store, in one pass and without touching any audio file. the
+# copy is imported in rekordbox instead of having it re-read every tag.
+# returns dict with the number of "tracks" and "patched" tracks, or None
+# if the run was cancelled
+def write_track_release_years_to_xml(track_years_csv_file_path, rekordbox_xml_file_path, type, output_xml_file_path=None, assume_yes=False):
+    output_xml_file_path = output_xml_file_path or rekordbox_xml_output_file_path
 
+    if type == "missing":
+        message = f"This writes a copy of rekordbox.xml to {output_xml_file_path} with the found years set on the tracks without a year.  Would you like to continue? (y/n): "
     else:
+        message = f"This writes a copy of rekordbox.xml to {output_xml_file_path} with the found years set on every track whose year is different.  Would you like to continue? (y/n): "
+
+    if not confirm(message, assume_yes):
         print(colored("Quitting script...", color="magenta"))
-        exit()
+        return None
+
+    store = open_track_store(track_years_csv_file_path)
+
+    def year_for_track(file_path, current_year):
+        # the year in the xml is what rekordbox has, the tags may differ
+        if type == "missing" and current_year not in UNSET_XML_YEARS:
+            return None
+
+        # years below the minimum confidence are held back
+        return store.found_year(file_path, min_confidence)
+
+    print(colored("Writing track years to rekordbox.xml...", color="white"))
+
+    try:
+        stats = write_patched_rekordbox_xml(
+            rekordbox_xml_file_path, output_xml_file_path, year_for_track)
+    finally:
+        store.close()
+
+    print(colored(
+        f"Set the year of {stats['patched']} of {stats['tracks']} tracks in {output_xml_file_path}.", color="white"))
+    print(colored(
+        "==> In rekordbox, pick this file under Preferences > Advanced > rekordbox xml, then import the tracks from the rekordbox xml tree to update the collection.", color="cyan"))
+
+    return stats
+
+
+# -----------  Run Report  ----------- #
+
+# Write the run report of the metrics recorded so far
+# returns the report dict
+def write_run_report(command, **extra):
+    """
+    Writes stage latencies, throughput, errors, token use, estimated cost
+    and cache hit rates to output/run-report.json.
+    """
+    report = metrics.write_report(
+        run_report_file_path, model=RELEASE_YEAR_MODEL, command=command, **extra)
+
+    cost = report["cost"]["estimated_usd"] if report["cost"] else 0
+    print(colored(
+        f"Run report written to {run_report_file_path} ({report['duration_seconds']:.1f}s, about ${cost:.4f} in model usage).", color="white"))
+
+    return report
+
+
+# -----------  Command Line  ----------- #
+
+# exit codes of the headless commands (argparse exits with 2 on bad usage)
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_CANCELLED = 3
+EXIT_INCOMPLETE = 4
+
+
+# Build the parser of the headless commands
+# returns an argparse.ArgumentParser
+def build_argument_parser():
+    """
+    Every subcommand shares the confirmation and concurrency flags.  Flags
+    override the environment, which overrides vars.py.
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-y", "--yes", action="store_true",
+                        help="answer yes to every prompt")
+    common.add_argument("--xml", help="path to rekordbox.xml (REKORDBOX_XML_FILE_PATH)")
+    common.add_argument("--search-folder", action="append", dest="search_folders",
+                        help="only process tracks in this folder, can be repeated (SEARCH_FOLDERS)")
+    common.add_argument("--source", choices=["xml", "scan"],
+                        help="find tracks in the rekordbox.xml or by scanning the scan roots (TRACK_SOURCE)")
+    common.add_argument("--root", action="append", dest="scan_roots", metavar="FOLDER",
+                        help="scan this folder for audio files instead of reading the rekordbox.xml, can be repeated (SCAN_ROOTS)")
+    common.add_argument("--extract-workers", type=int, help="EXTRACT_WORKERS")
+    common.add_argument("--lookup-concurrency", type=int, help="LOOKUP_CONCURRENCY")
+    common.add_argument("--requests-per-minute", type=int, help="LOOKUP_REQUESTS_PER_MINUTE")
+    common.add_argument("--tokens-per-minute", type=int, help="LOOKUP_TOKENS_PER_MINUTE")
+    common.add_argument("--pack-size", type=int, help="LOOKUP_PACK_SIZE")
+    common.add_argument("--tag-write-workers", type=int, help="TAG_WRITE_WORKERS")
+    common.add_argument("--no-cache", action="store_true", help="turn off the lookup cache")
+    common.add_argument("--no-tag-cache", action="store_true",
+                        help="read the tags of every file instead of serving unchanged files from the tag cache (TAG_CACHE)")
+    common.add_argument("-q", "--quiet", action="store_true",
+                        help="show progress bars instead of a message per track (QUIET)")
+
+    parser = argparse.ArgumentParser(
+        description="Find the release years of a rekordbox collection and write them to the tags. "
+                    "Run without a command for the interactive menu.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("scan", parents=[common],
+                          help="read the collection and its tags into tracks.csv")
+
+    lookup_parser = subparsers.add_parser("lookup", parents=[common],
+                                          help="look up the release year of every track")
+    lookup_parser.add_argument("--mode", choices=["full", "batch", "sync"], default="full",
+                               help="full run (resumable), batch api job, or only new and changed tracks (default full)")
+    lookup_parser.add_argument("--fresh", action="store_true",
+                               help="start a full run over instead of continuing the last one")
+    lookup_parser.add_argument("--samples", type=int,
+                               help="model answers per track, combined into a consensus year (LOOKUP_SAMPLES)")
+
+    fix_parser = subparsers.add_parser("fix", parents=[common],
+                                       help="look up the tracks without a found year again")
+    fix_parser.add_argument("--interactive", action="store_true",
+                            help="afterwards, enter the years of the tracks still without one, like the menu")
+    fix_parser.add_argument("--no-escalate", action="store_true",
+                            help="don't ask again with the more detailed prompt (FIX_ESCALATE)")
+    fix_parser.add_argument("--escalation-model",
+                            help="model for the second attempt (FIX_ESCALATION_MODEL)")
+    fix_parser.add_argument("--min-confidence", type=float,
+                            help="also look up the tracks whose confidence is below this (MIN_CONFIDENCE)")
+
+    write_parser = subparsers.add_parser("write-tags", parents=[common],
+                                         help="write found years to the tags")
+    write_parser.add_argument("--type", choices=["missing", "differing"], default="missing",
+                              help="tracks with an unset tagged year, or with a tagged year different from the found year (default missing)")
+    write_parser.add_argument("--dry-run", action="store_true",
+                              help="only report which tags would be written")
+    write_parser.add_argument("--atomic", action="store_true",
+                              help="write to a copy of each file and rename it over the original")
+    write_parser.add_argument("--min-confidence", type=float,
+                              help="only write found years with at least this confidence (MIN_CONFIDENCE)")
+
+    watch_parser = subparsers.add_parser("watch", parents=[common],
+                                         help="keep looking up the years of added and changed tracks")
+    watch_parser.add_argument("--interval", type=float,
+                              help="seconds between looks (WATCH_POLL_INTERVAL)")
+    watch_parser.add_argument("--polls", type=int, metavar="N",
+                              help="stop after N looks instead of running until interrupted")
+
+    write_xml_parser = subparsers.add_parser("write-xml", parents=[common],
+                                             help="write found years to a copy of rekordbox.xml for import")
+    write_xml_parser.add_argument("--type", choices=["missing", "differing"], default="missing",
+                                  help="tracks without a year in rekordbox, or with a year different from the found year (default missing)")
+    write_xml_parser.add_argument("--output", metavar="PATH",
+                                  help="where to write the updated rekordbox.xml (REKORDBOX_XML_OUTPUT_FILE_PATH)")
+    write_xml_parser.add_argument("--min-confidence", type=float,
+                                  help="only write found years with at least this confidence (MIN_CONFIDENCE)")
+
+    return parser
+
+
+# Apply the command line flags over the configured settings
+def apply_command_line_settings(args):
+    global rekordbox_xml_file_path, search_folders, track_source, scan_roots, extract_workers, lookup_concurrency, \
+        lookup_requests_per_minute, lookup_tokens_per_minute, lookup_pack_size, \
+        tag_write_workers, tag_write_atomic, use_lookup_cache, use_tag_cache, quiet, fix_escalate, \
+        fix_escalation_model, lookup_samples, min_confidence
+
+    if args.xml:
+        rekordbox_xml_file_path = args.xml
+    if args.search_folders:
+        search_folders = args.search_folders
+    if args.source:
+        track_source = args.source
+    if args.scan_roots:
+        scan_roots = args.scan_roots
+        track_source = "scan"
+    if args.extract_workers:
+        extract_workers = args.extract_workers
+    if args.lookup_concurrency:
+        lookup_concurrency = args.lookup_concurrency
+    if args.requests_per_minute:
+        lookup_requests_per_minute = args.requests_per_minute
+    if args.tokens_per_minute:
+        lookup_tokens_per_minute = args.tokens_per_minute
+    if args.pack_size:
+        lookup_pack_size = args.pack_size
+    if args.tag_write_workers:
+        tag_write_workers = args.tag_write_workers
+    if getattr(args, "atomic", False):
+        tag_write_atomic = True
+    if getattr(args, "no_escalate", False):
+        fix_escalate = False
+    if getattr(args, "escalation_model", None):
+        fix_escalation_model = args.escalation_model
+    if getattr(args, "samples", None):
+        lookup_samples = args.samples
+    if getattr(args, "min_confidence", None) is not None:
+        min_confidence = args.min_confidence
+    if args.no_cache:
+        use_lookup_cache = False
+    if args.no_tag_cache:
+        use_tag_cache = False
+    if args.quiet:
+        quiet = True
+
+
+# Run one headless command
+# returns the exit code
+def run_command_line(argv):
+    """
+    Parses argv, runs the command and maps its outcome to an exit code:
+    0 done, 1 error, 2 bad usage, 3 cancelled at a prompt, 4 finished but
+    some tracks failed.
+    """
+    parser = build_argument_parser()
+    args = parser.parse_args(argv)
+    apply_command_line_settings(args)
+
+    reads_collection = args.command in ["scan", "lookup", "watch"]
+
+    if (args.command == "write-xml" or reads_collection and track_source == "xml") and not rekordbox_xml_file_path:
+        parser.error(
+            "no rekordbox.xml, pass --xml or set REKORDBOX_XML_FILE_PATH")
+
+    if reads_collection and track_source == "scan" and not scan_roots:
+        parser.error("no folders to scan, pass --root or set SCAN_ROOTS")
+
+    exit_code = run_command(args)
+    write_run_report(args.command, exit_code=exit_code)
+
+    return exit_code
+
+
+# Run the parsed headless command
+# returns the exit code
+def run_command(args):
+    try:
+        if args.command == "scan":
+            track_data_list = build_track_data_list(
+                rekordbox_xml_file_path, search_folders)
+            print(colored(
+                f"Wrote {len(track_data_list)} tracks to {tracks_csv_file_path}.", color="white"))
+            return EXIT_OK
+
+        if args.command == "lookup" and args.mode == "full":
+            stats = get_track_release_year(tracks_csv_file_path, track_years_csv_file_path,
+                                           rekordbox_xml_file_path, search_folders,
+                                           assume_yes=args.yes, resume=False if args.fresh else None)
+            if stats is None:
+                return EXIT_CANCELLED
+            return EXIT_INCOMPLETE if stats.get("failed") else EXIT_OK
+
+        if args.command == "lookup" and args.mode == "batch":
+            found_count = get_track_release_years_batch(tracks_csv_file_path, track_years_csv_file_path,
+                                                        rekordbox_xml_file_path, search_folders,
+                                                        assume_yes=args.yes)
+            return EXIT_CANCELLED if found_count is None else EXIT_OK
+
+        if args.command == "lookup" and args.mode == "sync":
+            result = sync_track_release_years(tracks_csv_file_path, track_years_csv_file_path,
+                                              rekordbox_xml_file_path, search_folders,
+                                              assume_yes=args.yes)
+            if result is None:
+                return EXIT_CANCELLED
+            return EXIT_INCOMPLETE if result["failed"] or result["lookups"].get("failed") else EXIT_OK
+
+        if args.command == "fix":
+            result = fix_missing_years(track_years_csv_file_path, assume_yes=args.yes,
+                                       interactive=args.interactive)
+            return EXIT_CANCELLED if result is None else EXIT_OK
+
+        if args.command == "write-tags":
+            results = write_track_release_years(track_years_csv_file_path, args.type,
+                                                dry_run=args.dry_run or None, assume_yes=args.yes)
+            if results is None:
+                return EXIT_CANCELLED
+            return EXIT_INCOMPLETE if results[FAILED] else EXIT_OK
+
+        if args.command == "watch":
+            watch_library(track_years_csv_file_path, rekordbox_xml_file_path, search_folders,
+                          interval=args.interval, polls=args.polls)
+            return EXIT_OK
+
+        if args.command == "write-xml":
+            stats = write_track_release_years_to_xml(track_years_csv_file_path, rekordbox_xml_file_path,
+                                                     args.type, args.output, assume_yes=args.yes)
+            return EXIT_CANCELLED if stats is None else EXIT_OK
+
+    except KeyboardInterrupt:
+        print(colored("\nInterrupted.", color="magenta"))
+        return 130
+
+    except Exception as error:
+        # headless runs have nobody watching, so keep where it failed in the log
+        import traceback
+
+        traceback.print_exc()
+        print(colored(f"==> {type(error).__name__}: {error}", color="red"))
+        return EXIT_ERROR
 
 
 # -----------  Run App  ----------- #
 
 def main(rekordbox_xml_file_path, search_folders, tracks_csv_file_path, track_years_csv_file_path):
+    import pyfiglet
+
     print(colored(pyfiglet.figlet_format(
         "Track Release Years", font="slant"), color="cyan"))
     print(colored(
@@ -571,10 +1757,10 @@ def main(rekordbox_xml_file_path, search_folders, tracks_csv_file_path, track_ye
 
     function_to_run = ""
 
-    while not function_to_run.lower() in ["1", "2", "3", "q"]:
+    while not function_to_run.lower() in ["1", "2", "3", "4", "5", "6", "7", "q"]:
         print(colored("Please enter a number to start:", color="cyan"))
         function_to_run = input(colored(
-            "=> \"1\" to get all track years\n=> \"2\" to fix missing track years\n=> \"3\" to write track years to meta tags\n=> or type \"q\" to exit.\nYour choice: ", color="white"))
+            "=> \"1\" to get all track years\n=> \"4\" to get all track years as a batch job (cheaper, results within 24h)\n=> \"5\" to sync track years for tracks added or changed since the last run\n=> \"2\" to fix missing track years\n=> \"3\" to write track years to meta tags\n=> \"6\" to write track years to a copy of rekordbox.xml for import\n=> \"7\" to watch for added and changed tracks and look up their years as they come in\n=> or type \"q\" to exit.\nYour choice: ", color="white"))
 
     if function_to_run == "1":
         proceed = input(
@@ -586,6 +1772,36 @@ def main(rekordbox_xml_file_path, search_folders, tracks_csv_file_path, track_ye
             print(colored("Quitting script...", color="magenta"))
             exit()
 
+    elif function_to_run == "4":
+        proceed = input(
+            colored("\"4. Get all track years as a batch job\" entered. Ok to proceed? (y/n): ", color="cyan"))
+        if proceed.lower() == "y":
+            get_track_release_years_batch(tracks_csv_file_path, track_years_csv_file_path,
+                                          rekordbox_xml_file_path, search_folders)
+        else:
+            print(colored("Quitting script...", color="magenta"))
+            exit()
+
+    elif function_to_run == "5":
+        proceed = input(
+            colored("\"5. Sync new and changed track years\" entered. Ok to proceed? (y/n): ", color="cyan"))
+        if proceed.lower() == "y":
+            sync_track_release_years(tracks_csv_file_path, track_years_csv_file_path,
+                                     rekordbox_xml_file_path, search_folders)
+        else:
+            print(colored("Quitting script...", color="magenta"))
+            exit()
+
+    elif function_to_run == "7":
+        proceed = input(
+            colored("\"7. Watch for added and changed tracks\" entered. Ok to proceed? (y/n): ", color="cyan"))
+        if proceed.lower() == "y":
+            watch_library(track_years_csv_file_path,
+                          rekordbox_xml_file_path, search_folders)
+        else:
+            print(colored("Quitting script...", color="magenta"))
+            exit()
+
     elif function_to_run == "2":
         proceed = input(colored(
             "\"2. Get missing track years\" entered. Ok to proceed? (y/n): ", color="cyan"))
@@ -634,11 +1850,42 @@ def main(rekordbox_xml_file_path, search_folders, tracks_csv_file_path, track_ye
             print(colored("Quitting script...", color="magenta"))
             exit()
 
+    elif function_to_run == "6":
+        print(colored(
+            "\"6. Write track years to rekordbox.xml\" entered. Please enter one of the following:", color="cyan"))
+        print(colored("==> \"1\" to write tracks without a year in rekordbox and a found year that is not 0.", color="white"))
+        print(colored(
+            "==> \"2\" to write tracks where the year in rekordbox is different than the found year.", color="white"))
+
+        type_of_years = ""
+
+        while not type_of_years.lower() in ["1", "2", "q"]:
+            type_of_years = input(colored(
+                "Please enter either \"1\" or \"2\" or type \"q\" to exit: ", color="cyan"))
+
+        if type_of_years in ["1", "2"]:
+            write_track_release_years_to_xml(track_years_csv_file_path, rekordbox_xml_file_path,
+                                             "missing" if type_of_years == "1" else "differing")
+        else:
+            print(colored("Quitting script...", color="magenta"))
+            exit()
+
     else:
         print(colored("Quitting script...", color="magenta"))
         exit()
 
 
 if __name__ == "__main__":
-    main(rekordbox_xml_file_path, search_folders,
-         tracks_csv_file_path, track_years_csv_file_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # any arguments run a headless command instead of the menu
+    if len(sys.argv) > 1:
+        sys.exit(run_command_line(sys.argv[1:]))
+
+    try:
+        main(rekordbox_xml_file_path, search_folders,
+             tracks_csv_file_path, track_years_csv_file_path)
+    finally:
+        # only runs that did some work get a report
+        if metrics.stages:
+            write_run_report("menu")
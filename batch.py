@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# batch api mode for bulk release year lookups.
+
+# for full library runs latency doesn't matter, cost and throughput do.
+# the release year prompts for every track are written to a jsonl file,
+# submitted as one batch, polled until the batch is done and the answers
+# are merged back into track-years.csv by Location.  anything that failed
+# or didn't come back is left as "0" for fix_missing_years to pick up.
+
+# the transport that talks to the batch api is pluggable:
+# OpenAIBatchTransport uses the real api and LocalBatchTransport answers
+# the requests in process, for testing against a local fake.
+
+import csv
+import io
+import json
+import os
+import time
+
+from termcolor import colored
+
+from consensus import consensus_year
+from lookup import parse_release_year, release_year_prompt
+from lookup_cache import lookup_key
+from normalize import DEFAULT_TITLE_STRIP_PATTERN
+from track_record import TrackRecord
+
+
+# batch statuses after which the batch won't change anymore
+FINAL_BATCH_STATUSES = ["completed", "failed", "expired", "cancelled"]
+
+
+# -----------  Transports  ----------- #
+
+class OpenAIBatchTransport:
+    """
+    Submits batches through the openai files and batches apis.
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI()
+
+        self.client = client
+
+    def upload(self, jsonl_file_path):
+        with open(jsonl_file_path, "rb") as file:
+            return self.client.files.create(file=file, purpose="batch").id
+
+    def create(self, input_file_id):
+        batch = self.client.batches.create(
+            input_file_id=input_file_id, endpoint="/v1/responses", completion_window="24h")
+
+        return batch.id
+
+    def retrieve(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "completed": counts.completed if counts else 0,
+            "failed": counts.failed if counts else 0,
+            "total": counts.total if counts else 0,
+        }
+
+    def download(self, file_id):
+        return self.client.files.content(file_id).text
+
+
+class LocalBatchTransport:
+    """
+    Answers batch requests in process with respond(body), which returns
+    the output text for one request or raises to fail it.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.files = {}
+        self.batches = {}
+
+    def upload(self, jsonl_file_path):
+        file_id = f"file-{len(self.files)}"
+
+        with open(jsonl_file_path) as file:
+            self.files[file_id] = file.read()
+
+        return file_id
+
+    def create(self, input_file_id):
+        batch_id = f"batch-{len(self.batches)}"
+        output_lines = []
+        error_lines = []
+
+        for line in self.files[input_file_id].splitlines():
+            request = json.loads(line)
+
+            try:
+                output_text = self.respond(request["body"])
+            except Exception as error:
+                error_lines.append(json.dumps({"custom_id": request["custom_id"], "response": None,
+                                               "error": {"code": type(error).__name__, "message": str(error)}}))
+                continue
+
+            body = {"output": [{"type": "message", "content": [
+                {"type": "output_text", "text": output_text}]}]}
+            output_lines.append(json.dumps({"custom_id": request["custom_id"], "error": None,
+                                            "response": {"status_code": 200, "body": body}}))
+
+        self.files[f"{batch_id}-output"] = "\n".join(output_lines)
+        self.files[f"{batch_id}-errors"] = "\n".join(error_lines)
+        self.batches[batch_id] = {
+            "status": "completed",
+            "output_file_id": f"{batch_id}-output",
+            "error_file_id": f"{batch_id}-errors" if error_lines else None,
+            "completed": len(output_lines),
+            "failed": len(error_lines),
+            "total": len(output_lines) + len(error_lines),
+        }
+
+        return batch_id
+
+    def retrieve(self, batch_id):
+        return self.batches[batch_id]
+
+    def download(self, file_id):
+        return self.files[file_id]
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Pull the output text out of a raw responses api body
+# returns the concatenated output text
+def response_body_output_text(body):
+    """
+    Joins the output_text parts of the message items in a response body.
+    """
+    texts = []
+
+    for item in body.get("output") or []:
+        if item.get("type") != "message":
+            continue
+
+        for content in item.get("content") or []:
+            if content.get("type") == "output_text":
+                texts.append(content.get("text", ""))
+
+    return "".join(texts)
+
+
+# Write the batch input file for the tracks, one request per unique lookup key
+# returns dict of custom_id -> [artist, track_title_formatted]
+def write_batch_input(track_data_list, jsonl_file_path, model, cache=None, title_pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Writes a jsonl batch input file with the release year prompt for every
+    unique (artist, formatted title) in track_data_list that isn't already
+    in the cache.  Titles are told apart with the title strip rules of
+    title_pattern.  Returns the custom ids of the requests.
+    """
+    custom_ids = {}
+    seen_keys = set()
+
+    with open(jsonl_file_path, "w") as file:
+        for track_data_item in track_data_list:
+            artist = track_data_item[2]
+            track_title_formatted = track_data_item[3]
+            key = lookup_key(artist, track_title_formatted, title_pattern)
+
+            if key in seen_keys:
+                continue
+            seen_keys.add(key)
+
+            if cache and cache.get(artist, track_title_formatted) is not None:
+                continue
+
+            custom_id = f"track-{len(custom_ids)}"
+            custom_ids[custom_id] = [artist, track_title_formatted]
+
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/responses",
+                "body": {"model": model, "input": release_year_prompt(track_title_formatted, artist)},
+            }
+            file.write(json.dumps(request) + "\n")
+
+    return custom_ids
+
+
+# Parse batch output and error files
+# returns dict of custom_id -> found year ("0" for failed requests)
+def parse_batch_results(output_text, error_text=""):
+    """
+    Maps each custom id in the batch output to its found year.  Requests
+    that errored or didn't return a 4 digit year map to "0".
+    """
+    found_years = {}
+
+    for line in (output_text or "").splitlines():
+        if not line.strip():
+            continue
+
+        result = json.loads(line)
+        response = result.get("response") or {}
+
+        if result.get("error") or response.get("status_code") != 200:
+            found_years[result["custom_id"]] = "0"
+            continue
+
+        found_years[result["custom_id"]] = parse_release_year(
+            response_body_output_text(response.get("body") or {}))
+
+    for line in (error_text or "").splitlines():
+        if line.strip():
+            found_years[json.loads(line)["custom_id"]] = "0"
+
+    return found_years
+
+
+# -----------  Submit / Poll / Merge  ----------- #
+
+# Build and submit a batch for the tracks
+# returns the batch state dict, also saved to state_file_path
+def submit_batch(track_data_list, transport, jsonl_file_path, state_file_path, model, cache=None,
+                 title_pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Writes the batch input file, submits it and saves the batch id and
+    custom ids so the batch can be picked up again after a restart.
+    """
+    print(colored("Building batch input file...", color="white"))
+
+    custom_ids = write_batch_input(
+        track_data_list, jsonl_file_path, model, cache, title_pattern)
+
+    state = {"batch_id": None, "custom_ids": custom_ids,
+             "submitted_at": time.time()}
+
+    if custom_ids:
+        print(colored(
+            f"Submitting batch of {len(custom_ids)} requests...", color="white"))
+        state["batch_id"] = transport.create(transport.upload(jsonl_file_path))
+    else:
+        print(colored("Every track is already cached, nothing to submit.", color="white"))
+
+    with open(state_file_path, "w") as file:
+        json.dump(state, file)
+
+    return state
+
+
+# Poll a batch until it reaches a final status
+# returns the last batch info dict
+def poll_batch(transport, batch_id, poll_interval=60):
+    """
+    Polls the batch every poll_interval seconds and prints its progress
+    until it has completed, failed, expired or been cancelled.
+    """
+    while True:
+        batch = transport.retrieve(batch_id)
+
+        print(colored(
+            f"Batch {batch_id}: {batch['status']} ({batch['completed']} completed, {batch['failed']} failed of {batch['total']})", color="white"))
+
+        if batch["status"] in FINAL_BATCH_STATUSES:
+            return batch
+
+        time.sleep(poll_interval)
+
+
+# Download the results of a finished batch
+# returns dict of custom_id -> found year
+def download_batch_results(transport, batch):
+    """
+    Downloads and parses the output and error files of a batch.
+    Expired batches still return the requests that finished in time.
+    """
+    output_text = transport.download(
+        batch["output_file_id"]) if batch.get("output_file_id") else ""
+    error_text = transport.download(
+        batch["error_file_id"]) if batch.get("error_file_id") else ""
+
+    return parse_batch_results(output_text, error_text)
+
+
+# Merge found years into track-years.csv by Location
+# returns the merged list of track data items
+def merge_batch_results(track_data_list, state, found_years, track_years_csv_file_path, cache=None,
+                        title_pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Sets the possible year of every track from the batch results (or the
+    cache) and writes track-years.csv.  Rows already in track-years.csv
+    for tracks outside this batch are kept.  Tracks without a result are
+    left as "0".
+    """
+    print(colored("Merging batch results into track-years.csv...", color="white"))
+
+    # lookup key -> found year for everything answered in this batch
+    key_years = {}
+    for custom_id, (artist, track_title_formatted) in state["custom_ids"].items():
+        found_year = found_years.get(custom_id, "0")
+        key_years[lookup_key(artist, track_title_formatted, title_pattern)] = found_year
+
+        if cache:
+            cache.put(artist, track_title_formatted, found_year)
+
+    # existing rows, keyed by Location
+    merged_rows = {}
+    if os.path.exists(track_years_csv_file_path):
+        with open(track_years_csv_file_path) as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            merged_rows = {row[0]: TrackRecord.from_row(row) for row in reader if row}
+
+    for track_data_item in track_data_list:
+        artist = track_data_item[2]
+        track_title_formatted = track_data_item[3]
+        key = lookup_key(artist, track_title_formatted, title_pattern)
+
+        found_year = key_years.get(key)
+        source = "model"
+        if found_year is None and cache:
+            found_year = cache.get(artist, track_title_formatted)
+            source = "cache"
+
+        # one answer, weighed against the tagged year.  a failed request
+        # stays "0", its tagged year isn't a found year
+        if found_year is None or found_year == "0":
+            found_year, confidence = "0", 0.0
+        else:
+            found_year, confidence = consensus_year(
+                [(source, found_year), ("tag", track_data_item[4])])
+
+        merged_rows[track_data_item[0]] = TrackRecord(
+            *track_data_item[:5], found_year, confidence)
+
+    # write to a temp file first so an interrupted merge can't truncate
+    # the existing results
+    buffer = io.StringIO()
+    buffer.write(
+        "Location, Track Title, Artist, Track Title Formatted, Year, Possible Year, Confidence\n")
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    writer.writerows(merged_rows.values())
+
+    temp_file_path = track_years_csv_file_path + ".tmp"
+    with open(temp_file_path, "w") as file:
+        file.write(buffer.getvalue())
+    os.replace(temp_file_path, track_years_csv_file_path)
+
+    missing = sum(1 for row in merged_rows.values() if row[5] == "0")
+    print(colored(
+        f"Merged {len(track_data_list)} tracks, {missing} without a year.", color="white"))
+
+    return list(merged_rows.values())
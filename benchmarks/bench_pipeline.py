@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# end to end benchmark of the headless pipeline.
+
+# a synthetic rekordbox.xml and small tagged mp3 / mp4 fixtures are written
+# to a temp dir, and a copy of the app runs scan, lookup, fix and
+# write-tags against them with the model replaced by a local fake
+# Responses server.  every command writes its run report, so the phases
+# (xml parse, tag extraction, model lookups, csv i/o, tag writes) come
+# from the app's own instrumentation.  results are saved as json with the
+# commit they were measured at, and --compare reports the change against
+# an earlier result file.
+
+# usage:
+#   python benchmarks/bench_pipeline.py --tracks 2000 --latency-ms 50 --error-rate 0.02
+#   python benchmarks/bench_pipeline.py --compare benchmarks/results/pipeline-<commit>.json
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_responses_server import FakeResponsesServer  # noqa: E402
+from synthetic_collection import write_audio_fixtures, write_synthetic_rekordbox_xml  # noqa: E402
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+# the commands of one pipeline run, in order
+COMMANDS = {
+    "scan": ["scan", "--yes"],
+    "lookup": ["lookup", "--yes", "--mode", "full", "--fresh", "--no-cache"],
+    "fix": ["fix", "--yes", "--no-cache"],
+    "write-tags": ["write-tags", "--yes", "--type", "missing"],
+}
+
+# stage numbers compared between result files, with True where higher is better
+COMPARED_STAGE_VALUES = {"items_per_second": True, "p50_ms": False, "p95_ms": False}
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Get the commit the benchmark runs at
+# returns the short hash, with "-dirty" for uncommitted changes, or None
+def current_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit + ("-dirty" if dirty else "")
+
+
+# Copy the app to a temp dir so the benchmark has its own output dir
+# returns the app dir
+def copy_app(tmp_dir):
+    app_dir = os.path.join(tmp_dir, "app")
+    os.makedirs(os.path.join(app_dir, "output"))
+
+    for file_path in glob.glob(os.path.join(REPO_DIR, "*.py")):
+        if os.path.basename(file_path) != "vars.py":
+            shutil.copy(file_path, app_dir)
+
+    return app_dir
+
+
+# Run one command of the app copy
+# returns a dict of the wall time, exit code and the stages and counters of its run report
+def run_command(app_dir, arguments, env):
+    report_file_path = os.path.join(app_dir, "output", "run-report.json")
+    if os.path.exists(report_file_path):
+        os.remove(report_file_path)
+
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, os.path.join(app_dir, "app.py")] + arguments,
+                               cwd=app_dir, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - start
+
+    if completed.returncode not in (0, 4):
+        sys.stderr.write(completed.stderr)
+
+    report = {}
+    if os.path.exists(report_file_path):
+        with open(report_file_path) as file:
+            report = json.load(file)
+
+    stages = {}
+    for stage, stage_report in report.get("stages", {}).items():
+        latency = stage_report["latency_ms"]
+        stages[stage] = {
+            "items": stage_report["items"],
+            "errors": stage_report["errors"],
+            "items_per_second": stage_report["items_per_second"],
+            "mean_ms": latency["mean"],
+            "p50_ms": latency["p50"],
+            "p95_ms": latency["p95"],
+            "p99_ms": latency["p99"],
+        }
+
+    return {
+        "wall_seconds": seconds,
+        "exit_code": completed.returncode,
+        "stages": stages,
+        "counters": report.get("counters", {}),
+    }
+
+
+# Run the whole pipeline once on fresh fixtures
+# returns dict of command -> command result
+def run_pipeline(args, server):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app_dir = copy_app(tmp_dir)
+
+        # the app only picks up tracks inside a "music-library" dir
+        root = os.path.join(tmp_dir, "music-library")
+        xml_file_path = os.path.join(tmp_dir, "rekordbox.xml")
+        write_synthetic_rekordbox_xml(xml_file_path, args.tracks, playlist_count=10, root=root)
+        write_audio_fixtures(args.tracks, root, size=args.fixture_kb * 1024)
+
+        env = dict(os.environ, REKORDBOX_XML_FILE_PATH=xml_file_path, SEARCH_FOLDERS="[]",
+                   OPENAI_API_KEY="benchmark", OPENAI_BASE_URL=server.base_url,
+                   YEAR_RESOLVERS='["cache", "model"]', QUIET="true",
+                   LOOKUP_CONCURRENCY=str(args.lookup_concurrency),
+                   LOOKUP_PACK_SIZE=str(args.pack_size),
+                   EXTRACT_WORKERS=str(args.extract_workers),
+                   TAG_WRITE_WORKERS=str(args.tag_write_workers))
+
+        results = {}
+        for name, arguments in COMMANDS.items():
+            results[name] = run_command(app_dir, arguments, env)
+
+        return results
+
+
+# Combine repeated runs, keeping the median of every number
+# returns dict of command -> command result
+def median_results(runs):
+    combined = {}
+
+    for name in runs[0]:
+        command_runs = [run[name] for run in runs]
+        stages = {}
+
+        for stage in command_runs[0]["stages"]:
+            stage_runs = [run["stages"][stage] for run in command_runs if stage in run["stages"]]
+            stages[stage] = {}
+
+            for value_name in stage_runs[0]:
+                values = [stage_run[value_name] for stage_run in stage_runs
+                          if stage_run[value_name] is not None]
+                stages[stage][value_name] = statistics.median(values) if values else None
+
+        combined[name] = {
+            "wall_seconds": statistics.median(run["wall_seconds"] for run in command_runs),
+            "exit_code": max(run["exit_code"] for run in command_runs),
+            "stages": stages,
+            "counters": command_runs[-1]["counters"],
+        }
+
+    return combined
+
+
+# Print the results of a run
+def print_results(results):
+    print(f"{'command':<12}{'wall':>9}  {'stage':<14}{'items':>8}{'items/s':>11}{'p50':>10}{'p95':>10}{'errors':>8}")
+
+    for name, result in results.items():
+        print(f"{name:<12}{result['wall_seconds']:>8.2f}s  exit {result['exit_code']}")
+
+        for stage, stage_result in result["stages"].items():
+            per_second = stage_result["items_per_second"]
+            print(f"{'':<23}{stage:<14}{stage_result['items']:>8.0f}"
+                  f"{per_second or 0:>11.0f}{stage_result['p50_ms'] or 0:>8.2f}ms"
+                  f"{stage_result['p95_ms'] or 0:>8.2f}ms{stage_result['errors']:>8.0f}")
+
+
+# Compare a run against an earlier result file
+# returns the list of regressions beyond threshold percent
+def compare_results(baseline, results, threshold):
+    print(f"\nCompared to {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp', '?')}):")
+    regressions = []
+
+    def report(label, old, new, higher_is_better):
+        if not old or new is None:
+            return
+
+        change = (new - old) / old * 100
+        worse = -change if higher_is_better else change
+        marker = ""
+        if worse > threshold:
+            marker = "  <== regression"
+            regressions.append(label)
+        elif worse < -threshold:
+            marker = "  improved"
+
+        print(f"  {label:<40}{old:>12.2f}{new:>12.2f}{change:>+9.1f}%{marker}")
+
+    for name, result in results.items():
+        old_result = baseline["commands"].get(name)
+        if not old_result:
+            continue
+
+        report(f"{name} wall seconds", old_result["wall_seconds"], result["wall_seconds"], False)
+
+        for stage, stage_result in result["stages"].items():
+            old_stage = old_result["stages"].get(stage, {})
+            for value_name, higher_is_better in COMPARED_STAGE_VALUES.items():
+                report(f"{name} {stage} {value_name}", old_stage.get(value_name),
+                       stage_result[value_name], higher_is_better)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark scan, lookup, fix and write-tags end to end against a fake Responses server.")
+    parser.add_argument("--tracks", type=int, default=1000)
+    parser.add_argument("--fixture-kb", type=int, default=64,
+                        help="size of every audio fixture")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs of the whole pipeline, the median is kept")
+    parser.add_argument("--latency-ms", type=float, default=50,
+                        help="fake model response time")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of model requests answered with a 429 or 500")
+    parser.add_argument("--lookup-concurrency", type=int, default=8)
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--extract-workers", type=int, default=8)
+    parser.add_argument("--tag-write-workers", type=int, default=8)
+    parser.add_argument("--output", metavar="PATH",
+                        help="result file (default benchmarks/results/pipeline-<commit>.json)")
+    parser.add_argument("--compare", metavar="PATH",
+                        help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="percent change that counts as a regression (default 10)")
+    args = parser.parse_args()
+
+    commit = current_commit()
+
+    with FakeResponsesServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                             error_rate=args.error_rate) as server:
+        runs = []
+        for run in range(args.repeat):
+            print(f"Pipeline run {run + 1}/{args.repeat} with {args.tracks} tracks...")
+            runs.append(run_pipeline(args, server))
+
+        server_stats = {"requests": server.requests, "injected_errors": server.errors}
+
+    results = median_results(runs)
+    print_results(results)
+
+    output = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "params": {name: value for name, value in vars(args).items()
+                   if name not in ("output", "compare", "threshold")},
+        "fake_server": server_stats,
+        "commands": results,
+    }
+
+    output_file_path = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_file_path)), exist_ok=True)
+    with open(output_file_path, "w") as file:
+        json.dump(output, file, indent=2)
+    print(f"\nResults written to {output_file_path}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        if baseline.get("params") != output["params"]:
+            print("Note: the baseline was run with different parameters.")
+
+        regressions = compare_results(baseline, results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions beyond {args.threshold:g}%.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# benchmarks the batched ResultsWriter against the per row writer the
+# lookups used before it, on synthetic looked up track records.
+
+# the per row writer wrote every row with csv.writer, flushed the file and
+# appended the Location to the journal, one write each, and never fsynced.
+# the ResultsWriter runs with its default batches and fsync interval, with
+# an fsync (and journal write) after every batch, and fed by several
+# threads at once.  then
+# the written file is compacted, and --crash-runs child processes are
+# killed mid-write to check that the file they leave behind has no torn
+# rows and that every journaled Location has its row.
+
+# usage: python benchmarks/bench_results_writer.py --rows 100000
+
+import argparse
+import csv
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_collection import synthetic_file_path, synthetic_track_tags  # noqa: E402
+from checkpoint import ProcessedJournal, load_journal, repair_torn_tail  # noqa: E402
+from results_writer import ResultsWriter, compact_csv  # noqa: E402
+from track_record import TrackRecord  # noqa: E402
+
+
+HEADER = "Location, Track Title, Artist, Track Title Formatted, Year, Possible Year, Confidence\n"
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Build looked up track records in completion order, not Location order
+# returns a list of TrackRecords
+def synthetic_results(row_count, seed=0):
+    rows = []
+
+    for track_id in range(1, row_count + 1):
+        title, artist = synthetic_track_tags(track_id)
+        rows.append(TrackRecord(synthetic_file_path(track_id), title, artist,
+                                title.split(" (")[0], "None", str(1960 + track_id % 65), 0.33))
+
+    random.Random(seed).shuffle(rows)
+
+    return rows
+
+
+# Write rows the way the lookups did before the ResultsWriter
+def write_per_row(rows, csv_file_path, journal_file_path):
+    file = open(csv_file_path, "w")
+    journal = ProcessedJournal(journal_file_path, fresh=True)
+    file.write(HEADER)
+
+    writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+    for row in rows:
+        writer.writerow(row)
+        file.flush()
+        journal.append(row[0])
+
+    journal.close()
+    file.close()
+
+
+# Write rows with a ResultsWriter from one or more threads
+def write_batched(rows, csv_file_path, journal_file_path, threads=1, **options):
+    with ResultsWriter(csv_file_path, journal_file_path, fresh=True, header=HEADER, **options) as results:
+        if threads == 1:
+            for row in rows:
+                results.write(row)
+            return
+
+        def feed(offset):
+            for row in rows[offset::threads]:
+                results.write(row)
+
+        workers = [threading.Thread(target=feed, args=(offset,)) for offset in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+
+# Check a csv file and journal left behind by a killed writer
+# returns a tuple of (rows, torn rows, journaled Locations without a row)
+def check_crashed_files(csv_file_path, journal_file_path):
+    repair_torn_tail(csv_file_path)
+
+    with open(csv_file_path) as file:
+        file.readline()
+        rows = [row for row in csv.reader(file) if row]
+
+    torn = sum(1 for row in rows if len(row) != 7)
+    locations = set(row[0] for row in rows)
+    unwritten = len(load_journal(journal_file_path) - locations)
+
+    return len(rows), torn, unwritten
+
+
+# Kill writer child processes mid-write and check what they leave behind
+# returns a list of (rows, torn rows, journaled Locations without a row)
+def crash_runs(row_count, run_count, tmp_dir):
+    results = []
+
+    for run in range(run_count):
+        csv_file_path = os.path.join(tmp_dir, f"crash-{run}.csv")
+        journal_file_path = os.path.join(tmp_dir, f"crash-{run}.journal")
+
+        child = subprocess.Popen([sys.executable, __file__, "--child", str(row_count),
+                                  csv_file_path, journal_file_path])
+
+        # let it get into the rows, then kill it without any clean up
+        while not os.path.exists(journal_file_path):
+            time.sleep(0.01)
+        time.sleep(random.uniform(0.05, 0.5))
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+
+        results.append(check_crashed_files(csv_file_path, journal_file_path))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the batched track-years.csv writer against the per row writer.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=8,
+                        help="writer threads of the concurrent run")
+    parser.add_argument("--crash-runs", type=int, default=5)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # a child of the crash runs writes rows until it is killed
+    if args.child:
+        rows = synthetic_results(int(args.child[0]))
+        while True:
+            write_batched(rows, args.child[1], args.child[2], fsync_interval=0.1)
+
+    rows = synthetic_results(args.rows)
+
+    runs = [
+        ("per row (before)", lambda csv_path, journal_path: write_per_row(rows, csv_path, journal_path)),
+        ("batched", lambda csv_path, journal_path: write_batched(rows, csv_path, journal_path)),
+        ("batched, fsync per batch", lambda csv_path, journal_path: write_batched(
+            rows, csv_path, journal_path, fsync_interval=0)),
+        (f"batched, {args.threads} threads", lambda csv_path, journal_path: write_batched(
+            rows, csv_path, journal_path, threads=args.threads)),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file_path = os.path.join(tmp_dir, "track-years.csv")
+        journal_file_path = os.path.join(tmp_dir, "track-years.journal")
+
+        print(f"{args.rows} rows:")
+        print(f"{'writer':<28}{'seconds':>10}{'rows/s':>12}")
+
+        baseline = None
+        for name, write in runs:
+            start = time.perf_counter()
+            write(csv_file_path, journal_file_path)
+            seconds = time.perf_counter() - start
+            baseline = baseline or seconds
+
+            print(f"{name:<28}{seconds:>10.2f}{args.rows / seconds:>12.0f}  {baseline / seconds:.1f}x")
+
+        start = time.perf_counter()
+        kept, dropped = compact_csv(csv_file_path)
+        print(f"{'compact':<28}{time.perf_counter() - start:>10.2f}  {kept} rows kept, {dropped} dropped")
+
+        if args.crash_runs:
+            print(f"\nKilled writers ({args.crash_runs} runs):")
+            for row_count, torn, unwritten in crash_runs(args.rows, args.crash_runs, tmp_dir):
+                print(f"{row_count:>10} rows, {torn} torn, {unwritten} journaled without a row")
+
+
+if __name__ == "__main__":
+    main()
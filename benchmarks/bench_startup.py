@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# benchmarks the cold start of every app.py command.
+
+# each command runs in a fresh interpreter against a copy of the app and a
+# small synthetic collection whose files don't exist, so the commands do
+# almost no work and the time measured is mostly interpreter start and
+# imports.  one more run per command under -X importtime shows which
+# modules it imported and what they cost.
+
+# usage: python benchmarks/bench_startup.py [--repeat 5] [--json startup.json]
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_collection import write_synthetic_rekordbox_xml  # noqa: E402
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "help": ["--help"],
+    "scan": ["scan", "--yes"],
+    "lookup": ["lookup", "--yes", "--mode", "sync"],
+    "fix": ["fix", "--yes"],
+    "write-tags": ["write-tags", "--yes", "--dry-run"],
+}
+
+# modules worth calling out when a command imports them
+HEAVY_MODULES = ["openai", "mutagen", "tinytag", "pyfiglet", "regex"]
+
+
+# Run one command of the app copy in a fresh interpreter
+# returns (seconds, stderr)
+def run_command(app_dir, arguments, env, importtime=False):
+    # every run starts from an empty output dir so it does the same work
+    output_dir = os.path.join(app_dir, "output")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.mkdir(output_dir)
+
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + \
+        [os.path.join(app_dir, "app.py")] + arguments
+
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=app_dir, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - start
+
+    return seconds, completed.stderr
+
+
+# Read the imports out of -X importtime output
+# returns (dict of top level module -> cumulative microseconds, set of every module)
+def parse_importtime(stderr):
+    top_level = {}
+    modules = set()
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+
+        # nested imports are indented under the module that imported them
+        if not name[1:].startswith(" "):
+            top_level[name.strip()] = int(cumulative)
+
+    return top_level, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the cold start and imports of every app.py command.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--json", metavar="PATH",
+                        help="also write the results to a json file")
+    args = parser.parse_args()
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app_dir = os.path.join(tmp_dir, "app")
+        os.mkdir(app_dir)
+        for file_path in glob.glob(os.path.join(REPO_DIR, "*.py")):
+            if os.path.basename(file_path) != "vars.py":
+                shutil.copy(file_path, app_dir)
+
+        xml_file_path = os.path.join(tmp_dir, "rekordbox.xml")
+        write_synthetic_rekordbox_xml(xml_file_path, args.tracks, playlist_count=2)
+
+        # settings come from the environment, a dummy key is enough as no
+        # command gets far enough to send a request
+        env = dict(os.environ, REKORDBOX_XML_FILE_PATH=xml_file_path, SEARCH_FOLDERS="[]",
+                   OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "benchmark"))
+
+        print(f"{'command':<12}{'median':>10}{'min':>10}{'imports':>10}  heavy modules")
+
+        for name, arguments in COMMANDS.items():
+            # warm up the bytecode cache
+            run_command(app_dir, arguments, env)
+
+            timings = [run_command(app_dir, arguments, env)[0]
+                       for _ in range(args.repeat)]
+
+            _, stderr = run_command(app_dir, arguments, env, importtime=True)
+            top_level, modules = parse_importtime(stderr)
+            imported = [module for module in HEAVY_MODULES if module in modules]
+
+            results[name] = {
+                "median_ms": statistics.median(timings) * 1000,
+                "min_ms": min(timings) * 1000,
+                "import_ms": sum(top_level.values()) / 1000,
+                "heavy_modules": imported,
+                "slowest_imports_ms": {module: microseconds / 1000 for module, microseconds in
+                                       sorted(top_level.items(), key=lambda item: -item[1])[:5]},
+            }
+
+            result = results[name]
+            print(f"{name:<12}{result['median_ms']:>8.0f}ms{result['min_ms']:>8.0f}ms"
+                  f"{result['import_ms']:>8.0f}ms  {', '.join(imported) or '-'}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"python": sys.version.split()[0], "repeat": args.repeat,
+                       "commands": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
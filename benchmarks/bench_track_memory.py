@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# memory use of track data items, and of the menu flows on a big library.
+
+# first the bytes per track of the old plain lists and of TrackRecord are
+# measured with tracemalloc, for rows read from tracks.csv (5 columns) and
+# from track-years.csv (7 columns).  then a synthetic tracks.csv of
+# --tracks rows is written to a copy of the app, and the three menu flows
+# run on it headless against the local fake Responses server: get all
+# track years (resuming from tracks.csv), fix missing years and a dry run
+# of write track years.  the peak resident memory of every flow is read
+# from the os when its process exits, next to the baseline of a process
+# that only imports the app.  the flows run before anything big is built
+# here, as a child process starts out with the memory of this one.
+
+# usage: python benchmarks/bench_track_memory.py --tracks 200000
+
+import argparse
+import csv
+import gc
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import copy_app  # noqa: E402
+from fake_responses_server import FakeResponsesServer  # noqa: E402
+from synthetic_collection import synthetic_file_path, synthetic_track_tags  # noqa: E402
+from normalize import DEFAULT_TITLE_STRIP_RULES, compile_title_rules, format_track_title  # noqa: E402
+from track_record import TrackRecord  # noqa: E402
+
+
+# the menu flows, as the headless commands they run, after a baseline
+# that only imports the app
+FLOWS = {
+    "import only": ["-c", "import app"],
+    "get track years": ["lookup", "--yes", "--mode", "full"],
+    "fix missing years": ["fix", "--yes"],
+    "write track years": ["write-tags", "--yes", "--type", "missing", "--dry-run"],
+}
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Build the tracks.csv rows of a synthetic library
+# yields [file_path, track_title, artist, track_title_formatted, year] lists
+def synthetic_track_rows(track_count, root):
+    title_strip_pattern = compile_title_rules(DEFAULT_TITLE_STRIP_RULES)
+
+    for track_id in range(1, track_count + 1):
+        title, artist = synthetic_track_tags(track_id)
+        year = "2003" if track_id % 4 == 0 else "None"
+
+        yield [synthetic_file_path(track_id, root), title, artist,
+               format_track_title(title, title_strip_pattern), year]
+
+
+# Write rows to a csv string the way the app writes its csv files
+# returns the csv text
+def rows_to_csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(rows)
+
+    return buffer.getvalue()
+
+
+# Measure the memory of the items parsed from csv text
+# returns bytes per item
+def measure_items(csv_text, make_item, item_count):
+    gc.collect()
+    tracemalloc.start()
+
+    items = [make_item(row) for row in csv.reader(io.StringIO(csv_text))]
+
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert len(items) == item_count
+    del items
+
+    return size / item_count
+
+
+# Compare plain lists and track records
+# returns dict of columns -> {"list": bytes per track, "record": bytes per track}
+def measure_track_items(track_count):
+    rows = list(synthetic_track_rows(track_count, "/Users/dj/music-library"))
+    looked_up_rows = [row + [str(1960 + index % 65), "0.67"] for index, row in enumerate(rows)]
+
+    results = {}
+    for label, csv_text in (("tracks.csv", rows_to_csv(rows)),
+                            ("track-years.csv", rows_to_csv(looked_up_rows))):
+        results[label] = {
+            "list": measure_items(csv_text, list, track_count),
+            "record": measure_items(csv_text, TrackRecord.from_row, track_count),
+        }
+
+    return results
+
+
+# Run one flow of the app copy, reading its peak memory when it exits
+# returns a tuple of (exit code, wall seconds, peak resident MB)
+def run_flow(app_dir, arguments, env):
+    start = time.perf_counter()
+    if arguments[0] != "-c":
+        arguments = [os.path.join(app_dir, "app.py")] + arguments
+
+    process = subprocess.Popen([sys.executable] + arguments,
+                               cwd=app_dir, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+    return process.returncode, seconds, peak_mb
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the memory of track records and of the menu flows on a synthetic library.")
+    parser.add_argument("--tracks", type=int, default=200000)
+    parser.add_argument("--latency-ms", type=float, default=5,
+                        help="fake model response time")
+    parser.add_argument("--lookup-concurrency", type=int, default=32)
+    parser.add_argument("--pack-size", type=int, default=50)
+    parser.add_argument("--skip-flows", action="store_true",
+                        help="only measure the bytes per track")
+    args = parser.parse_args()
+
+    if not args.skip_flows:
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                FakeResponsesServer(latency_ms=args.latency_ms) as server:
+            app_dir = copy_app(tmp_dir)
+
+            # an existing tracks.csv makes get track years resume from it,
+            # so the rekordbox.xml is never read
+            with open(os.path.join(app_dir, "output", "tracks.csv"), "w") as file:
+                file.write("Location, Track Title, Artist, Track Title Formatted, Year\n")
+                csv.writer(file, quoting=csv.QUOTE_ALL).writerows(
+                    synthetic_track_rows(args.tracks, os.path.join(tmp_dir, "music-library")))
+
+            # the synthetic titles only differ by their numbers, which
+            # fuzzy matching compares nearly all pairs of, so it's off
+            env = dict(os.environ, REKORDBOX_XML_FILE_PATH=os.path.join(tmp_dir, "rekordbox.xml"),
+                       SEARCH_FOLDERS="[]", OPENAI_API_KEY="benchmark", FUZZY_MATCH_THRESHOLD="null",
+                       OPENAI_BASE_URL=server.base_url, YEAR_RESOLVERS='["cache", "model"]',
+                       QUIET="true", LOOKUP_CONCURRENCY=str(args.lookup_concurrency),
+                       LOOKUP_PACK_SIZE=str(args.pack_size))
+
+            print(f"Menu flows, {args.tracks} tracks:")
+            print(f"{'flow':<20}{'exit':>6}{'wall':>10}{'peak rss':>12}")
+            for name, arguments in FLOWS.items():
+                exit_code, seconds, peak_mb = run_flow(app_dir, arguments, env)
+                print(f"{name:<20}{exit_code:>6}{seconds:>9.1f}s{peak_mb:>9.0f} MB")
+
+            print(f"Fake server: {server.requests} requests.\n")
+
+    print(f"Bytes per track, {args.tracks} tracks:")
+    print(f"{'rows':<18}{'list':>10}{'record':>10}{'saved':>8}")
+    for label, result in measure_track_items(args.tracks).items():
+        saved = 1 - result["record"] / result["list"]
+        print(f"{label:<18}{result['list']:>10.0f}{result['record']:>10.0f}{saved:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
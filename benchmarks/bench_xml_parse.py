@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# benchmarks the streaming rekordbox.xml reader against the previous
+# minidom based parse_rekordbox_xml on a synthetic collection.
+
+# usage: python benchmarks/bench_xml_parse.py --tracks 100000
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from urllib.parse import unquote
+from xml.dom import minidom
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rekordbox import iter_rekordbox_file_paths  # noqa: E402
+from synthetic_collection import write_synthetic_rekordbox_xml  # noqa: E402
+
+
+# the minidom implementation parse_rekordbox_xml used before the
+# streaming reader, kept here as the baseline.  note the sort inside
+# the loop, which is part of what is being measured.
+def parse_rekordbox_xml_minidom(rekordbox_xml, search_folders):
+    rekordbox_collection_file_path_list = []
+
+    dom = minidom.parse(rekordbox_xml)
+    collection = dom.getElementsByTagName("COLLECTION")
+    tracks = collection[0].getElementsByTagName("TRACK")
+
+    for track in tracks:
+        url_unencoded_file_path = unquote(track.attributes["Location"].value)
+        file_path = url_unencoded_file_path.replace("file://localhost", "")
+
+        if "music-library" in file_path:
+            if search_folders:
+                if any(substring in file_path for substring in search_folders):
+                    rekordbox_collection_file_path_list.append(file_path)
+            else:
+                rekordbox_collection_file_path_list.append(file_path)
+
+        rekordbox_collection_file_path_list.sort()
+
+    return rekordbox_collection_file_path_list
+
+
+def parse_rekordbox_xml_streaming(rekordbox_xml, search_folders):
+    file_paths = list(iter_rekordbox_file_paths(rekordbox_xml, search_folders))
+    file_paths.sort()
+
+    return file_paths
+
+
+# Time a parser and measure its peak traced memory in a second pass
+# returns (seconds, peak bytes, result)
+def measure(parser, xml_file_path, search_folders):
+    start = time.perf_counter()
+    result = parser(xml_file_path, search_folders)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    parser(xml_file_path, search_folders)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return seconds, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the streaming rekordbox.xml reader against the old minidom parser.")
+    parser.add_argument("--tracks", type=int, default=100_000)
+    parser.add_argument("--playlists", type=int, default=50)
+    parser.add_argument("--search-folders", nargs="*", default=[])
+    parser.add_argument("--skip-minidom", action="store_true",
+                        help="only run the streaming reader")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xml_file_path = os.path.join(tmp_dir, "rekordbox.xml")
+        write_synthetic_rekordbox_xml(
+            xml_file_path, args.tracks, playlist_count=args.playlists)
+
+        size_mb = os.path.getsize(xml_file_path) / 1_000_000
+        print(f"synthetic rekordbox.xml: {args.tracks} tracks, {size_mb:.1f} MB")
+
+        stream_seconds, stream_peak, stream_result = measure(
+            parse_rekordbox_xml_streaming, xml_file_path, args.search_folders)
+        print(f"iterparse: {stream_seconds:8.2f}s  peak {stream_peak / 1_000_000:8.1f} MB  "
+              f"{len(stream_result)} tracks")
+
+        if args.skip_minidom:
+            return
+
+        dom_seconds, dom_peak, dom_result = measure(
+            parse_rekordbox_xml_minidom, xml_file_path, args.search_folders)
+        print(f"minidom:   {dom_seconds:8.2f}s  peak {dom_peak / 1_000_000:8.1f} MB  "
+              f"{len(dom_result)} tracks")
+
+        if dom_result != stream_result:
+            print("results differ between parsers!")
+            sys.exit(1)
+
+        print(f"speedup {dom_seconds / stream_seconds:.1f}x, "
+              f"memory {dom_peak / max(stream_peak, 1):.1f}x lower")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# local stand-in for the openai Responses endpoint, for the benchmarks.
+
+# answers POST /v1/responses like the real api does for the release year
+# prompts: a plain 4 digit year (or "unknown") for single track prompts
+# and a json "results" list for packed prompts.  the year of a track is a
+# hash of its prompt line, so every run gets the same answers.  latency,
+# jitter and the share of requests failing with a 429 or a 500 are
+# configurable, so retries and backoff are exercised too.
+
+# usage: python benchmarks/fake_responses_server.py [--port 8765] [--latency-ms 50] [--error-rate 0.05]
+#        then OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python3 app.py ...
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# share of tracks the fake model doesn't know the year of
+UNKNOWN_RATE = 0.1
+
+# "1. Song by Artist" lines of a packed prompt
+PACKED_TRACK_LINE = re.compile(r"^(\d+)\. (.+)$", re.MULTILINE)
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Pick the release year the fake model answers for a track
+# returns a 4 digit year string or None if "unknown"
+def fake_release_year(track):
+    digest = hashlib.blake2b(track.encode("utf-8"), digest_size=4).digest()
+    value = int.from_bytes(digest, "little")
+
+    if value % 1000 < UNKNOWN_RATE * 1000:
+        return None
+
+    return str(1960 + value % 65)
+
+
+# Build the answer text for a request body
+# returns the output text
+def fake_output_text(body):
+    prompt = str(body.get("input", ""))
+    text_format = (body.get("text") or {}).get("format") or {}
+
+    if text_format.get("type") == "json_schema":
+        results = []
+        for number, track in PACKED_TRACK_LINE.findall(prompt):
+            results.append({"id": int(number), "year": fake_release_year(track) or "0"})
+
+        return json.dumps({"results": results})
+
+    return fake_release_year(prompt) or "unknown"
+
+
+# Build a Responses api response object
+# returns a dict
+def fake_response(body, output_text):
+    input_tokens = max(1, len(str(body.get("input", ""))) // 4)
+    output_tokens = max(1, len(output_text) // 4)
+
+    return {
+        "id": "resp_fake",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": body.get("model", "fake"),
+        "output": [{
+            "type": "message",
+            "id": "msg_fake",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": output_text, "annotations": []}],
+        }],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+# -----------  Server  ----------- #
+
+class _HTTPServer(ThreadingHTTPServer):
+    # the default backlog of 5 drops connections when many requests come
+    # in at once, and the client's connect retry then shows up as latency
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class FakeResponsesServer:
+    """
+    Threaded http server answering release year prompts on a local port.
+    Port 0 picks a free port.  Counts requests and injected errors.
+    """
+
+    def __init__(self, port=0, latency_ms=50, jitter_ms=0, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(
+                    int(self.headers.get("Content-Length", 0))) or b"{}")
+                server.handle(self, body)
+
+        self.http_server = _HTTPServer(("127.0.0.1", port), Handler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.http_server.server_address[1]}/v1"
+
+    def handle(self, handler, body):
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency_ms +
+                        self.rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            failure = self.rng.random() < self.error_rate
+            status = self.rng.choice([429, 500]) if failure else 200
+            if failure:
+                self.errors += 1
+
+        time.sleep(delay)
+
+        if status != 200:
+            payload = {"error": {"message": "injected benchmark error", "type": "server_error"}}
+        else:
+            payload = fake_response(body, fake_output_text(body))
+
+        data = json.dumps(payload).encode("utf-8")
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            handler.send_header("retry-after", "0.1")
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.http_server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+# -----------  Run  ----------- #
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve fake release year answers on a local Responses endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeResponsesServer(args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Serving fake responses on {server.base_url}, ctrl+c to stop.")
+
+    try:
+        server.http_server.serve_forever()
+    except KeyboardInterrupt:
+        server.http_server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# generates synthetic rekordbox.xml collections for the benchmarks.
+
+# the generated file mirrors the layout of a real export: a <COLLECTION>
+# of <TRACK> entries with <TEMPO> and <POSITION_MARK> children, followed
+# by a <PLAYLISTS> tree that references the tracks by TrackID.  the audio
+# fixtures are small but real mp3 and mp4 files with the same title and
+# artist tags, so tag extraction and tag writing do their usual work.
+
+import os
+import random
+import struct
+from urllib.parse import quote
+from xml.sax.saxutils import quoteattr
+
+
+ARTISTS = ["Artist %d" % n for n in range(2000)]
+FOLDERS = ["hip-hop", "house", "disco", "funk", "top-40", "latin"]
+TITLE_SUFFIXES = ["", " (Clean)", " (Dirty)", " (Intro Clean)",
+                  " (Intro Dirty)", " (HH Clean Intro)"]
+
+
+# Build the title and artist of a synthetic track
+# returns a tuple of (title, artist)
+def synthetic_track_tags(track_id):
+    title = f"Song Number {track_id}" + \
+        TITLE_SUFFIXES[track_id % len(TITLE_SUFFIXES)]
+
+    return title, ARTISTS[track_id * 7919 % len(ARTISTS)]
+
+
+# Build the local file path for a synthetic track
+# returns the file path string
+def synthetic_file_path(track_id, root="/Users/dj/music-library"):
+    """
+    Returns a file path for a synthetic track inside a music-library dir.
+    """
+    folder = FOLDERS[track_id % len(FOLDERS)]
+    extension = "m4a" if track_id % 3 == 0 else "mp3"
+
+    return f"{root}/{folder}/Track {track_id} - Song Number {track_id}.{extension}"
+
+
+# Write a synthetic rekordbox.xml with track_count tracks
+# returns the list of file paths written to the collection
+def write_synthetic_rekordbox_xml(xml_file_path, track_count, playlist_count=50,
+                                  cues_per_track=8, root="/Users/dj/music-library", seed=0):
+    """
+    Writes a rekordbox.xml shaped file with track_count collection tracks
+    and playlist_count playlists.  Returns the list of file paths.
+    """
+    rng = random.Random(seed)
+    file_paths = []
+
+    with open(xml_file_path, "w", encoding="utf-8") as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        file.write('<DJ_PLAYLISTS Version="1.0.0">\n')
+        file.write(
+            '  <PRODUCT Name="rekordbox" Version="6.8.5" Company="AlphaTheta"/>\n')
+        file.write(f'  <COLLECTION Entries="{track_count}">\n')
+
+        for track_id in range(1, track_count + 1):
+            file_path = synthetic_file_path(track_id, root)
+            file_paths.append(file_path)
+
+            title, artist = synthetic_track_tags(track_id)
+            location = "file://localhost" + quote(file_path)
+
+            file.write(
+                f'    <TRACK TrackID="{track_id}" Name={quoteattr(title)} '
+                f'Artist={quoteattr(artist)} Kind="MP3 File" '
+                f'Size="{rng.randrange(4_000_000, 20_000_000)}" '
+                f'TotalTime="{rng.randrange(120, 420)}" '
+                f'Year="{rng.choice(["", "1994", "2003", "2019"])}" '
+                f'AverageBpm="{rng.uniform(80, 130):.2f}" '
+                f'Location={quoteattr(location)}>\n')
+            file.write(
+                '      <TEMPO Inizio="0.025" Bpm="100.00" Metro="4/4" Battito="1"/>\n')
+
+            for cue in range(cues_per_track):
+                file.write(
+                    f'      <POSITION_MARK Name="" Type="0" Start="{cue * 15}.000" Num="{cue}"/>\n')
+
+            file.write('    </TRACK>\n')
+
+        file.write('  </COLLECTION>\n')
+        file.write('  <PLAYLISTS>\n')
+        file.write('    <NODE Type="0" Name="ROOT" Count="1">\n')
+        file.write(
+            f'      <NODE Name="Playlists" Type="0" Count="{playlist_count}">\n')
+
+        for playlist in range(playlist_count):
+            entries = min(track_count, 500)
+            file.write(
+                f'        <NODE Name="Playlist {playlist}" Type="1" KeyType="0" Entries="{entries}">\n')
+
+            for _ in range(entries):
+                file.write(
+                    f'          <TRACK Key="{rng.randrange(1, track_count + 1)}"/>\n')
+
+            file.write('        </NODE>\n')
+
+        file.write('      </NODE>\n')
+        file.write('    </NODE>\n')
+        file.write('  </PLAYLISTS>\n')
+        file.write('</DJ_PLAYLISTS>\n')
+
+    return file_paths
+
+
+# -----------  Audio Fixtures  ----------- #
+
+# a 128kbps 44.1kHz mpeg 1 layer 3 frame header, every frame is 417 bytes
+MP3_FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+
+
+def _atom(kind, payload):
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def _full_atom(kind, payload, flags=0):
+    return _atom(kind, struct.pack(">I", flags) + payload)
+
+
+# Build a minimal aac in mp4 file
+# returns the file bytes
+def _mp4_bytes(size):
+    """
+    One audio track of silent 256 byte samples in a single chunk: just
+    the atoms mutagen and tinytag need to read and tag the file.
+    """
+    sample_rate = 44100
+    sample_count = max(1, size // 256)
+    duration = sample_count * 1024
+    matrix = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+    esds = _full_atom(b"esds", bytes([3, 25, 0, 1, 0, 4, 17, 0x40, 0x15, 0, 0, 0]) +
+                      struct.pack(">II", 128000, 128000) + bytes([5, 2, 0x12, 0x10, 6, 1, 2]))
+    mp4a = _atom(b"mp4a", b"\x00" * 6 + struct.pack(">H", 1) + b"\x00" * 8 +
+                 struct.pack(">HHHHI", 2, 16, 0, 0, sample_rate << 16) + esds)
+    sample_table = (_full_atom(b"stsd", struct.pack(">I", 1) + mp4a) +
+                    _full_atom(b"stts", struct.pack(">III", 1, sample_count, 1024)) +
+                    _full_atom(b"stsc", struct.pack(">IIII", 1, 1, sample_count, 1)) +
+                    _full_atom(b"stsz", struct.pack(">II", 256, sample_count)))
+
+    media = _atom(b"mdia",
+                  _full_atom(b"mdhd", struct.pack(">IIIIHH", 0, 0, sample_rate, duration, 0x55c4, 0)) +
+                  _full_atom(b"hdlr", b"\x00" * 4 + b"soun" + b"\x00" * 13) +
+                  _atom(b"minf", _full_atom(b"smhd", b"\x00" * 4) +
+                        _atom(b"dinf", _full_atom(b"dref", struct.pack(">I", 1) + _full_atom(b"url ", b"", flags=1))) +
+                        _atom(b"stbl", sample_table + _full_atom(b"stco", struct.pack(">II", 1, 0)))))
+    track = _atom(b"trak",
+                  _full_atom(b"tkhd", struct.pack(">IIIII", 0, 0, 1, 0, duration) + b"\x00" * 8 +
+                             struct.pack(">hhhh", 0, 0, 0x0100, 0) + matrix + b"\x00" * 8, flags=7) +
+                  media)
+    movie = _atom(b"moov",
+                  _full_atom(b"mvhd", struct.pack(">IIII", 0, 0, sample_rate, duration) +
+                             struct.pack(">IH", 0x10000, 0x100) + b"\x00" * 10 + matrix +
+                             b"\x00" * 24 + struct.pack(">I", 2)) +
+                  track)
+    file_type = _atom(b"ftyp", b"M4A " + struct.pack(">I", 0) + b"M4A mp42isom")
+
+    # the chunk offset points just past the mdat header, stco is the last
+    # 4 bytes of moov
+    chunk_offset = len(file_type) + len(movie) + 8
+    movie = movie[:-4] + struct.pack(">I", chunk_offset)
+
+    return file_type + movie + _atom(b"mdat", b"\x00" * (sample_count * 256))
+
+
+# Write a tagged mp3 or mp4 fixture for a synthetic track
+def write_audio_fixture(file_path, title, artist, year=None, size=64 * 1024):
+    """
+    Writes a file of about size bytes with title, artist and optionally
+    year tags.  The format follows the extension.
+    """
+    from mutagen import File
+    from mutagen.easyid3 import EasyID3
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    if file_path.endswith(".mp3"):
+        with open(file_path, "wb") as file:
+            file.write(MP3_FRAME * max(1, size // len(MP3_FRAME)))
+        audio = EasyID3()
+    else:
+        with open(file_path, "wb") as file:
+            file.write(_mp4_bytes(size))
+        audio = File(file_path, easy=True)
+        audio.add_tags()
+
+    audio["title"] = title
+    audio["artist"] = artist
+    if year:
+        audio["date"] = year
+
+    if file_path.endswith(".mp3"):
+        audio.save(file_path)
+    else:
+        audio.save()
+
+
+# Write the audio fixtures of a synthetic collection
+# returns the number of files written
+def write_audio_fixtures(track_count, root, size=64 * 1024, tagged_year_every=4):
+    """
+    Writes a fixture for every track of a collection generated with the
+    same root.  Every tagged_year_every-th track already has a year tag.
+    """
+    for track_id in range(1, track_count + 1):
+        title, artist = synthetic_track_tags(track_id)
+        year = "2003" if tagged_year_every and track_id % tagged_year_every == 0 else None
+
+        write_audio_fixture(synthetic_file_path(track_id, root), title, artist, year, size)
+
+    return track_count
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# resume checkpoint for release year runs.
+
+# every track whose row has been written to track-years.csv is recorded
+# in an append-only journal of Locations.  resuming loads the journal into
+# a set and filters the remaining tracks against it, so it doesn't matter
+# in which order tracks were processed or how many ran at once.  the last
+# row of a file is read from the end of the file instead of reading the
+# whole file.
+
+import csv
+import os
+
+from termcolor import colored
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Read the last complete line of a file without reading the whole file
+# returns the line without its newline, or None for an empty file
+def read_last_line(file_path, block_size=4096):
+    """
+    Seeks backwards from the end of the file one block at a time until
+    the start of the last line is found.
+    """
+    with open(file_path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        end = file.tell()
+
+        if end == 0:
+            return None
+
+        # ignore the newline that ends the last line
+        file.seek(end - 1)
+        if file.read(1) == b"\n":
+            end -= 1
+
+        position = end
+        tail = b""
+
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            file.seek(position)
+            tail = file.read(read_size) + tail
+
+            newline = tail.rfind(b"\n")
+            if newline != -1:
+                return tail[newline + 1:].decode("utf-8")
+
+        return tail.decode("utf-8")
+
+
+# Remove a partly written last line from a file
+# returns True if the file was truncated
+def repair_torn_tail(file_path, block_size=4096):
+    """
+    If the file doesn't end with a newline, its last line was only partly
+    written when the run stopped.  The partial line is cut off so that new
+    rows aren't appended onto it.
+    """
+    with open(file_path, "rb+") as file:
+        file.seek(0, os.SEEK_END)
+        end = file.tell()
+
+        if end == 0:
+            return False
+
+        file.seek(end - 1)
+        if file.read(1) == b"\n":
+            return False
+
+        position = end
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            file.seek(position)
+            newline = file.read(read_size).rfind(b"\n")
+
+            if newline != -1:
+                file.truncate(position + newline + 1)
+                return True
+
+        file.truncate(0)
+        return True
+
+
+# -----------  Processed Journal  ----------- #
+
+class ProcessedJournal:
+    """
+    Append-only journal of processed Locations, one per line.  Each line
+    is written with a single O_APPEND write, so lines from concurrent
+    writers never interleave.
+    """
+
+    def __init__(self, journal_file_path, fresh=False):
+        self.journal_file_path = journal_file_path
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if fresh:
+            flags |= os.O_TRUNC
+
+        self.file_descriptor = os.open(journal_file_path, flags, 0o644)
+
+    def append(self, location):
+        os.write(self.file_descriptor, (location + "\n").encode("utf-8"))
+
+    def append_many(self, locations):
+        """
+        Appends several Locations with one write.
+        """
+        if locations:
+            os.write(self.file_descriptor, "".join(
+                location + "\n" for location in locations).encode("utf-8"))
+
+    def sync(self):
+        os.fsync(self.file_descriptor)
+
+    def close(self):
+        os.close(self.file_descriptor)
+
+
+# Read the processed Locations from a journal
+# returns a set of Locations
+def load_journal(journal_file_path):
+    """
+    Reads every complete line of the journal.  A partly written last line
+    is ignored.
+    """
+    with open(journal_file_path, "rb") as file:
+        data = file.read()
+
+    # anything after the last newline was never fully written
+    complete = data[:data.rfind(b"\n") + 1].decode("utf-8")
+
+    return set(complete.splitlines())
+
+
+# Get the Locations already processed in a run
+# returns a set of Locations
+def load_processed_locations(journal_file_path, track_years_csv_file_path):
+    """
+    Loads the processed Locations from the journal.  Runs started before
+    the journal existed fall back to the Locations in track-years.csv.
+    """
+    if os.path.exists(journal_file_path):
+        return load_journal(journal_file_path)
+
+    print(colored("No journal found, reading processed tracks from track-years.csv...", color="white"))
+
+    if not os.path.exists(track_years_csv_file_path):
+        return set()
+
+    with open(track_years_csv_file_path) as file:
+        reader = csv.reader(file)
+        next(reader, None)
+
+        return set(row[0] for row in reader if row)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# release year consensus and confidence scores.
+
+# a found year used to be a single model answer, trusted as much as any
+# other.  now every source asked about a track casts a vote: each model
+# answer, the lookup cache, the offline index and the year already in the
+# tags.  votes are weighted by how reliable their source is, the year with
+# the most weight wins and the confidence is the share of the weight that
+# agrees with it.  the total weight is at least FULL_CONFIDENCE_WEIGHT, so
+# a lone answer never scores 1.0: one model answer is 0.33, three
+# agreeing answers or an offline index hit and an agreeing model answer
+# are 1.0.
+
+from datetime import datetime
+
+
+# the oldest recordings are from the 1860s, and no release is from later
+# than next year
+MIN_RELEASE_YEAR = 1860
+
+# weight of one vote per source
+SOURCE_WEIGHTS = {
+    "offline": 2.0,
+    "cache": 1.0,
+    "model": 1.0,
+    "tag": 0.5,
+}
+
+# the vote weight behind a confidence of 1.0
+FULL_CONFIDENCE_WEIGHT = 3.0
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Check a year string is a plausible release year
+# returns True or False
+def is_valid_release_year(year):
+    year = str(year or "").strip()
+
+    return len(year) == 4 and year.isdigit() and \
+        MIN_RELEASE_YEAR <= int(year) <= datetime.now().year + 1
+
+
+# -----------  Consensus  ----------- #
+
+# Turn a stored confidence back into a vote
+# returns a (source, year, weight) vote that scores confidence on its own,
+# or a plain (source, year) vote when there is no confidence
+def confidence_vote(source, year, confidence):
+    """
+    A cached year carries the weight of the consensus that found it, so a
+    year three samples agreed on keeps its 1.0 instead of counting as one
+    vote.
+    """
+    if confidence is None:
+        return source, year
+
+    return source, year, confidence * FULL_CONFIDENCE_WEIGHT
+
+
+# Combine the votes of every source asked about a track
+# params: list of (source, year) tuples, or (source, year, weight) to
+# override the weight of the source, year is None or "0" when the source
+# had no answer
+# returns a tuple of (year, confidence), ("0", 0.0) without a valid year
+def consensus_year(votes):
+    """
+    Sources that had no answer count towards the total weight, so they
+    lower the confidence.  A tagged year only votes when it is set, as an
+    unset tag says nothing about the release year, and only adds weight to
+    a year another source found: a tag that disagrees lowers the
+    confidence, and without another answer there is no year.  Ties go to
+    the year that was voted for first.
+    """
+    year_weights = {}
+    tag_weights = {}
+    total_weight = 0.0
+
+    for source, year, *weight in votes:
+        valid = is_valid_release_year(year)
+
+        if source == "tag" and not valid:
+            continue
+
+        weight = weight[0] if weight else SOURCE_WEIGHTS.get(source, 1.0)
+        total_weight += weight
+
+        if valid:
+            year = str(year).strip()
+            weights = tag_weights if source == "tag" else year_weights
+            weights[year] = weights.get(year, 0.0) + weight
+
+    if not year_weights:
+        return "0", 0.0
+
+    for year, weight in tag_weights.items():
+        if year in year_weights:
+            year_weights[year] += weight
+
+    year = max(year_weights, key=year_weights.get)
+
+    return year, round(year_weights[year] / max(total_weight, FULL_CONFIDENCE_WEIGHT), 2)
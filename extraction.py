@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# concurrent tag extraction stage.
+
+# reading tags is almost all i/o wait on NAS mounted libraries, so the
+# files are read by a bounded pool of workers.  every file is wrapped so
+# that one corrupt file or odd year format is logged and skipped instead
+# of ending the whole run.  files the tag cache already knows are served
+# from it in this process and never reach the pool.
+
+import time
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from termcolor import colored
+
+from instrumentation import metrics
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Run the extract function for one file and capture any error
+# returns a tuple of (file_path, track_data_item or None, error or None, seconds)
+def safe_extract(extract_func, file_path):
+    """
+    Calls extract_func on file_path, returning the error message
+    instead of raising.  The time taken is returned too, as the worker
+    may be another process that can't record it itself.
+    """
+    start = time.perf_counter()
+
+    try:
+        return file_path, extract_func(file_path), None, time.perf_counter() - start
+    except Exception as error:
+        return file_path, None, f"{type(error).__name__}: {error}", time.perf_counter() - start
+
+
+# -----------  Concurrent Extraction  ----------- #
+
+# Extract track data for each file path across a bounded worker pool
+# yields a tuple of (file_path, track_data_item or None, error or None)
+def iter_extracted_tracks(file_paths, extract_func, workers=8, use_processes=False, ordered=True,
+                          cached_track=None, on_extracted=None):
+    """
+    Streams extraction results for file_paths.  At most workers * 2 files
+    are in flight at once, so file_paths can be any iterable, including a
+    generator.  With ordered=True results come back in input order,
+    otherwise they come back as soon as each file is done.
+
+    cached_track(file_path) may return a track data item for a file that
+    doesn't need to be read, and on_extracted(file_path, track_data_item)
+    is called for every file that was read.
+    """
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    max_in_flight = max(1, workers) * 2
+    file_path_iter = iter(file_paths)
+
+    with executor_class(max_workers=max(1, workers)) as executor:
+        # futures kept in submission order
+        in_flight = deque()
+
+        def submit_next():
+            file_path = next(file_path_iter, None)
+            if file_path is None:
+                return False
+
+            track_data_item = cached_track(file_path) if cached_track else None
+
+            if track_data_item is not None:
+                # already done, it keeps its place among the files being read
+                future = Future()
+                future.set_result((file_path, track_data_item, None, None))
+                in_flight.append(future)
+            else:
+                in_flight.append(executor.submit(
+                    safe_extract, extract_func, file_path))
+            return True
+
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            if ordered:
+                future = in_flight.popleft()
+                result = future.result()
+            else:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                in_flight.remove(future)
+                result = future.result()
+
+            submit_next()
+
+            file_path, track_data_item, error, seconds = result
+
+            # cached files weren't read and have no time
+            if seconds is not None:
+                metrics.record("tag_extract", seconds, error=error is not None)
+
+                if error is None and on_extracted:
+                    on_extracted(file_path, track_data_item)
+
+            yield file_path, track_data_item, error
+
+
+# Extract track data for all file paths, with a progress bar
+# returns a tuple of (track_data_list, failed list of (file_path, error))
+def extract_tracks(file_paths, extract_func, workers=8, use_processes=False, ordered=True, progress=True,
+                   cached_track=None, on_extracted=None):
+    """
+    Extracts track data for every file path concurrently.  Files that fail
+    are logged and returned separately so the run can keep going.
+    """
+    from tqdm import tqdm
+
+    track_data_list = []
+    failed = []
+
+    total = len(file_paths) if hasattr(file_paths, "__len__") else None
+
+    results = iter_extracted_tracks(
+        file_paths, extract_func, workers, use_processes, ordered, cached_track, on_extracted)
+
+    with tqdm(total=total, desc="Extracting tags", unit="track", disable=not progress) as progress_bar:
+        for file_path, track_data_item, error in results:
+            if error is None:
+                track_data_list.append(track_data_item)
+            else:
+                failed.append((file_path, error))
+                progress_bar.write(colored(
+                    f"==> Could not read tags for {file_path}: {error}", color="magenta"))
+
+            progress_bar.update(1)
+
+    if failed:
+        print(colored(
+            f"==> {len(failed)} files could not be read and were skipped.", color="magenta"))
+
+    return track_data_list, failed
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# run instrumentation.
+
+# every stage of a run (xml parse, tag extraction, model lookups, csv
+# reads and writes, tag writes) records how long each item took into a
+# latency histogram with fixed log-scale buckets, so recording is cheap and
+# memory doesn't grow with the run.  counters hold tokens, requests and
+# resolver hits.  the shared `metrics` registry is thread-safe and turned
+# into a json run report at the end of a run.
+
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+# upper bounds of the latency buckets in milliseconds, the last bucket
+# holds everything slower
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100,
+                      250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+# estimated usd per million tokens of the models we use, for the cost
+# estimate in the run report
+MODEL_PRICING = {
+    "gpt-5-nano": {"input": 0.05, "output": 0.40},
+}
+
+
+# -----------  Histogram  ----------- #
+
+class LatencyHistogram:
+    """
+    Fixed bucket latency histogram.  Percentiles are estimated as the
+    upper bound of the bucket they fall in.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+
+    def record(self, milliseconds):
+        index = 0
+        while index < len(LATENCY_BUCKETS_MS) and milliseconds > LATENCY_BUCKETS_MS[index]:
+            index += 1
+
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.total_ms += milliseconds
+        self.min_ms = milliseconds if self.min_ms is None else min(self.min_ms, milliseconds)
+        self.max_ms = milliseconds if self.max_ms is None else max(self.max_ms, milliseconds)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+
+        rank = fraction * self.count
+        seen = 0
+
+        for index, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else self.max_ms
+
+        return self.max_ms
+
+    def to_dict(self):
+        buckets = {}
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if bucket_count:
+                label = f"<={LATENCY_BUCKETS_MS[index]}" if index < len(
+                    LATENCY_BUCKETS_MS) else f">{LATENCY_BUCKETS_MS[-1]}"
+                buckets[label] = bucket_count
+
+        return {
+            "min": self.min_ms,
+            "mean": self.total_ms / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max_ms,
+            "buckets": buckets,
+        }
+
+
+# -----------  Run Metrics  ----------- #
+
+class RunMetrics:
+    """
+    Stage latencies, error counts and counters of one run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    def record(self, stage, seconds, error=False):
+        """
+        Records one item of a stage that took seconds.
+        """
+        now = time.perf_counter()
+
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = {"histogram": LatencyHistogram(), "errors": 0,
+                                      "first": now - seconds, "last": now}
+
+            stage_metrics = self.stages[stage]
+            stage_metrics["histogram"].record(seconds * 1000)
+            stage_metrics["last"] = now
+            if error:
+                stage_metrics["errors"] += 1
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        Times the block as one item of stage.  An exception counts as an
+        error and is raised again.
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        except BaseException:
+            self.record(stage, time.perf_counter() - start, error=True)
+            raise
+
+        self.record(stage, time.perf_counter() - start)
+
+    def timed_iter(self, stage, iterable):
+        """
+        Yields the items of iterable, timing how long each one took to
+        produce.
+        """
+        iterator = iter(iterable)
+
+        while True:
+            start = time.perf_counter()
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+
+            self.record(stage, time.perf_counter() - start)
+
+            yield item
+
+    def increment(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def report(self, model=None, **extra):
+        """
+        Returns the run report as a dict.
+        """
+        with self.lock:
+            stages = {}
+
+            for stage, stage_metrics in self.stages.items():
+                histogram = stage_metrics["histogram"]
+                span = stage_metrics["last"] - stage_metrics["first"]
+
+                stages[stage] = {
+                    "items": histogram.count,
+                    "errors": stage_metrics["errors"],
+                    "items_per_second": histogram.count / span if span > 0 else None,
+                    "latency_ms": histogram.to_dict(),
+                }
+
+            counters = dict(self.counters)
+
+        # hit rates of every "<name>_hits" / "<name>_misses" counter pair
+        hit_rates = {}
+        for counter, hits in counters.items():
+            if counter.endswith("_hits"):
+                name = counter[:-len("_hits")]
+                lookups = hits + counters.get(f"{name}_misses", 0)
+                hit_rates[name] = hits / lookups if lookups else None
+
+        pricing = MODEL_PRICING.get(model)
+        cost = None
+        if pricing:
+            cost = {"model": model, "usd_per_million_tokens": pricing,
+                    "estimated_usd": round((counters.get("input_tokens", 0) * pricing["input"] +
+                                            counters.get("output_tokens", 0) * pricing["output"]) / 1_000_000, 6)}
+
+        return dict({
+            "started_at": self.started_at.isoformat(),
+            "duration_seconds": time.perf_counter() - self.started,
+            "stages": stages,
+            "counters": counters,
+            "hit_rates": hit_rates,
+            "cost": cost,
+        }, **extra)
+
+    def write_report(self, report_file_path, model=None, **extra):
+        """
+        Writes the run report as json through a temp file.  Returns the
+        report dict.
+        """
+        report = self.report(model, **extra)
+        temp_file_path = report_file_path + ".tmp"
+
+        with open(temp_file_path, "w") as file:
+            json.dump(report, file, indent=2)
+
+        os.replace(temp_file_path, report_file_path)
+
+        return report
+
+
+# shared by every module of a run
+metrics = RunMetrics()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# runs the app for several rekordbox collections at once.
+
+# every job is a collection (a rekordbox.xml and optionally its search
+# folders) run as its own app.py process with its own output folder, so
+# each job keeps its own tracks.csv, track-years.csv, journal, track store
+# and run report and resumes on its own.  the jobs share one lookup cache
+# with claims turned on, so a song found for one collection is a cache hit
+# for every other one, and a song two jobs need at the same time is only
+# asked about once.  the lookup concurrency and rate limits are a budget
+# for all jobs together, split evenly between the jobs running at once.
+
+# usage:
+#   python3 jobs.py --job alice=~/alice/rekordbox.xml --job bob=~/bob/rekordbox.xml
+#   python3 jobs.py --jobs-file jobs.json --parallel 4 --lookup-concurrency 32
+#   python3 jobs.py --jobs-file jobs.json -- write-xml --type missing
+
+# jobs.json is a list of {"name": ..., "xml": ..., "search_folders": [...]}
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from termcolor import colored
+
+import app
+from lookup_cache import LookupCache
+
+
+# command run for every job when none is given after "--"
+DEFAULT_JOB_COMMAND = ["lookup"]
+
+# seconds between checks of the running jobs
+JOB_POLL_INTERVAL = 0.5
+
+# job names are used as folder names
+JOB_NAME = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Read the jobs from --job NAME=XML flags and a jobs file
+# returns a list of {"name", "xml", "search_folders"} dicts
+def load_jobs(job_flags, jobs_file_path=None):
+    """
+    Raises ValueError for a malformed flag, a bad or repeated name or a
+    job without an xml.
+    """
+    jobs = []
+
+    if jobs_file_path:
+        with open(jobs_file_path) as file:
+            jobs += json.load(file)
+
+    for flag in job_flags or []:
+        name, separator, xml = flag.partition("=")
+        if not separator:
+            raise ValueError(f"--job {flag} is not NAME=PATH")
+        jobs.append({"name": name, "xml": xml})
+
+    names = set()
+    for job in jobs:
+        if not JOB_NAME.match(job.get("name", "")):
+            raise ValueError(f"bad job name {job.get('name')!r}, use letters, digits, . _ and -")
+        if job["name"] in names:
+            raise ValueError(f"job {job['name']} is given twice")
+        if not job.get("xml"):
+            raise ValueError(f"job {job['name']} has no xml")
+
+        names.add(job["name"])
+        job["xml"] = os.path.expanduser(job["xml"])
+        job.setdefault("search_folders", app.search_folders)
+
+    return jobs
+
+
+# Split a budget evenly between slots, the remainder going to the first ones
+# returns a list of shares, None for every slot without a budget
+def split_budget(budget, slots):
+    if budget is None:
+        return [None] * slots
+
+    return [max(1, budget // slots + (1 if slot < budget % slots else 0)) for slot in range(slots)]
+
+
+# Build the environment of a job's app.py process
+# returns an environ dict
+def job_environment(job, output_dir, lookup_cache_file_path, concurrency, requests_per_minute, tokens_per_minute):
+    env = dict(os.environ,
+               REKORDBOX_XML_FILE_PATH=job["xml"],
+               SEARCH_FOLDERS=json.dumps(job["search_folders"]),
+               OUTPUT_DIR=output_dir,
+               LOOKUP_CACHE_FILE_PATH=lookup_cache_file_path,
+               LOOKUP_CACHE_SHARED="true",
+               # the jobs share the offline index of the main output folder
+               OFFLINE_INDEX_FILE_PATH=app.offline_index_file_path,
+               LOOKUP_CONCURRENCY=str(concurrency),
+               LOOKUP_REQUESTS_PER_MINUTE=json.dumps(requests_per_minute),
+               LOOKUP_TOKENS_PER_MINUTE=json.dumps(tokens_per_minute),
+               # the jobs' output goes to their log files
+               PYTHONUNBUFFERED="1")
+
+    return env
+
+
+# Read the counters of a job's run report
+# returns dict of counter -> value, empty if the job wrote no report
+def job_counters(output_dir):
+    try:
+        with open(os.path.join(output_dir, "run-report.json")) as file:
+            return json.load(file).get("counters", {})
+    except (OSError, ValueError):
+        return {}
+
+
+# -----------  Job Runner  ----------- #
+
+class JobRunner:
+    """
+    Runs app.py once per job, at most parallel at a time.  Every job gets
+    jobs_dir/<name> as its output folder and writes its output to
+    job.log there.  The state of every job is kept in
+    jobs_dir/jobs-state.json while the jobs run.
+    """
+
+    def __init__(self, jobs, jobs_dir, command, parallel=2, lookup_concurrency=8,
+                 requests_per_minute=None, tokens_per_minute=None,
+                 lookup_cache_file_path=None):
+        self.jobs = jobs
+        self.jobs_dir = jobs_dir
+        self.command = command
+        self.lookup_cache_file_path = lookup_cache_file_path or app.lookup_cache_file_path
+        self.state_file_path = os.path.join(jobs_dir, "jobs-state.json")
+
+        # one share of each budget per job running at once
+        slots = max(1, min(parallel, len(jobs)))
+        self.slots = list(zip(split_budget(lookup_concurrency, slots),
+                              split_budget(requests_per_minute, slots),
+                              split_budget(tokens_per_minute, slots)))
+
+        self.state = {job["name"]: {"xml": job["xml"], "status": "pending"} for job in jobs}
+
+    def write_state(self):
+        temp_file_path = self.state_file_path + ".tmp"
+
+        with open(temp_file_path, "w") as file:
+            json.dump(self.state, file, indent=2)
+
+        os.replace(temp_file_path, self.state_file_path)
+
+    def start(self, job, slot):
+        output_dir = os.path.join(self.jobs_dir, job["name"])
+        os.makedirs(output_dir, exist_ok=True)
+
+        concurrency, requests_per_minute, tokens_per_minute = self.slots[slot]
+        env = job_environment(job, output_dir, self.lookup_cache_file_path,
+                              concurrency, requests_per_minute, tokens_per_minute)
+
+        log_file = open(os.path.join(output_dir, "job.log"), "a")
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")] +
+            self.command + ["--yes"], env=env, stdin=subprocess.DEVNULL,
+            stdout=log_file, stderr=subprocess.STDOUT)
+
+        self.state[job["name"]].update(status="running", output_dir=output_dir,
+                                       lookup_concurrency=concurrency, started_at=time.time(),
+                                       finished_at=None, exit_code=None)
+        self.write_state()
+
+        print(colored(
+            f"Started job {job['name']} ({concurrency} lookups in flight), log in {output_dir}/job.log", color="white"))
+
+        return process, log_file
+
+    def finish(self, name, exit_code, log_file):
+        log_file.close()
+        job_state = self.state[name]
+
+        job_state.update(status="done" if exit_code == 0 else "failed",
+                         exit_code=exit_code, finished_at=time.time())
+        job_state["seconds"] = round(job_state["finished_at"] - job_state["started_at"], 1)
+
+        counters = job_counters(job_state["output_dir"])
+        job_state.update(model_requests=counters.get("lookup_requests", 0),
+                         shared_lookups=counters.get("lookup_shared", 0))
+        self.write_state()
+
+        color = "white" if exit_code == 0 else "red"
+        print(colored(
+            f"Finished job {name} with exit code {exit_code} in {job_state['seconds']}s: "
+            f"{job_state['model_requests']} model requests, {job_state['shared_lookups']} "
+            f"tracks resolved by another job.", color=color))
+
+    def run(self):
+        """
+        Runs every job and returns the exit code of the first job that
+        didn't finish with 0, or 0.
+        """
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        # claims left by earlier runs that died are stale
+        cache = LookupCache(self.lookup_cache_file_path, model=None, prompt_version=None)
+        cache.clear_claims()
+        cache.close()
+
+        pending = list(self.jobs)
+        free_slots = list(range(len(self.slots)))
+        running = {}
+        self.write_state()
+
+        try:
+            while pending or running:
+                while pending and free_slots:
+                    job = pending.pop(0)
+                    slot = free_slots.pop(0)
+                    running[job["name"]] = (slot,) + self.start(job, slot)
+
+                time.sleep(JOB_POLL_INTERVAL)
+
+                for name, (slot, process, log_file) in list(running.items()):
+                    exit_code = process.poll()
+
+                    if exit_code is not None:
+                        del running[name]
+                        free_slots.append(slot)
+                        self.finish(name, exit_code, log_file)
+
+        except KeyboardInterrupt:
+            print(colored("\nInterrupted, stopping the running jobs...", color="magenta"))
+
+            for name, (slot, process, log_file) in running.items():
+                process.terminate()
+                self.finish(name, process.wait(), log_file)
+                self.state[name]["status"] = "interrupted"
+
+            self.write_state()
+            return 130
+
+        exit_codes = [self.state[job["name"]]["exit_code"] for job in self.jobs]
+
+        return next((exit_code for exit_code in exit_codes if exit_code), 0)
+
+
+# -----------  Run  ----------- #
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the app for several rekordbox collections at once, sharing one lookup cache. "
+                    "Arguments after -- are the app.py command run for every job (default lookup).")
+    parser.add_argument("--job", action="append", metavar="NAME=XML",
+                        help="a collection to run, can be repeated")
+    parser.add_argument("--jobs-file", metavar="PATH",
+                        help="json list of {\"name\", \"xml\", \"search_folders\"} jobs")
+    parser.add_argument("--jobs-dir", default=os.path.join(app.output_dir, "jobs"),
+                        help="folder of the jobs' output folders (default output/jobs)")
+    parser.add_argument("--parallel", type=int, default=2,
+                        help="jobs running at once (default 2)")
+    parser.add_argument("--lookup-concurrency", type=int, default=app.lookup_concurrency,
+                        help="requests in flight for all jobs together (LOOKUP_CONCURRENCY)")
+    parser.add_argument("--requests-per-minute", type=int, default=app.lookup_requests_per_minute,
+                        help="requests per minute for all jobs together (LOOKUP_REQUESTS_PER_MINUTE)")
+    parser.add_argument("--tokens-per-minute", type=int, default=app.lookup_tokens_per_minute,
+                        help="tokens per minute for all jobs together (LOOKUP_TOKENS_PER_MINUTE)")
+    parser.add_argument("command", nargs=argparse.REMAINDER,
+                        help="app.py command and flags, after --")
+    args = parser.parse_args()
+
+    try:
+        jobs = load_jobs(args.job, args.jobs_file)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    if not jobs:
+        parser.error("no jobs, pass --job NAME=XML or --jobs-file")
+
+    command = [argument for argument in args.command if argument != "--"] or DEFAULT_JOB_COMMAND
+
+    runner = JobRunner(jobs, args.jobs_dir, command, args.parallel, args.lookup_concurrency,
+                       args.requests_per_minute, args.tokens_per_minute)
+    exit_code = runner.run()
+
+    print(colored(f"Job states written to {runner.state_file_path}", color="white"))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# parallel file system scan of the music library.
+
+# the rekordbox.xml export used to be the only way to find the tracks.
+# the scan walks the library folders instead: directories are listed with
+# os.scandir by a pool of threads, since listing a NAS mounted folder is
+# almost all network wait, and every audio file found is handed out as
+# soon as its directory has been listed, so tag extraction can start
+# before the walk is done.  dot files (like the "._" files macOS leaves
+# on network shares) and symlinked directories are skipped.
+
+import os
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from termcolor import colored
+
+
+# file extensions of the audio formats tags can be read from
+DEFAULT_AUDIO_EXTENSIONS = [".mp3", ".m4a", ".mp4", ".aac", ".aif", ".aiff",
+                            ".flac", ".wav", ".ogg", ".opus"]
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# List one directory
+# returns a tuple of (list of (file path, size, mtime in ns) of its audio
+# files, list of its subdirectory paths)
+def scan_directory(directory, extensions):
+    """
+    Unreadable directories and files that vanish while being listed are
+    left out.
+    """
+    audio_files = []
+    subdirectories = []
+
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+
+                    elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                        stat = entry.stat()
+                        audio_files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+
+                except OSError:
+                    continue
+
+    except OSError as error:
+        print(colored(f"==> Could not list {directory}: {error}", color="magenta"))
+
+    return audio_files, subdirectories
+
+
+# Check a file path against the search folders
+# returns True if the file should be processed
+def is_in_scan_search_folders(file_path, search_folders):
+    """
+    Same as the rekordbox.xml filter, without the music-library dir, as
+    the scan roots already say where the library is.
+    """
+    if search_folders:
+        return any(substring in file_path for substring in search_folders)
+
+    return True
+
+
+# -----------  Parallel Scan  ----------- #
+
+# Walk the scan roots with a pool of threads
+# yields a tuple of (file path, size, mtime in ns) for every audio file,
+# in no particular order
+def iter_audio_file_stats(roots, extensions=DEFAULT_AUDIO_EXTENSIONS, search_folders=None, workers=8):
+    """
+    Lists up to workers directories at once.  Files are yielded as their
+    directory is listed, so a caller that is slower than the walk holds
+    it back instead of the listing piling up in memory.
+    """
+    extensions = set(extension.lower() for extension in extensions)
+    roots = [os.path.abspath(os.path.expanduser(root)) for root in roots]
+
+    for root in roots:
+        if not os.path.isdir(root):
+            print(colored(f"==> Scan root {root} is not a folder, skipping it.", color="magenta"))
+
+    pending = deque(root for root in roots if os.path.isdir(root))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        in_flight = set()
+
+        while pending or in_flight:
+            while pending and len(in_flight) < max(1, workers):
+                in_flight.add(executor.submit(scan_directory, pending.popleft(), extensions))
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                audio_files, subdirectories = future.result()
+                pending.extend(subdirectories)
+
+                for file_stat in audio_files:
+                    if is_in_scan_search_folders(file_stat[0], search_folders):
+                        yield file_stat
+
+
+# Walk the scan roots
+# yields the path of every audio file
+def iter_audio_files(roots, extensions=DEFAULT_AUDIO_EXTENSIONS, search_folders=None, workers=8):
+    for file_path, _, _ in iter_audio_file_stats(roots, extensions, search_folders, workers):
+        yield file_path
+
+
+# Read the state of every audio file under the scan roots
+# returns dict of file path -> ("", size, mtime) in the track state format
+# of sync.py, which has no rekordbox TrackID for scanned files
+def scan_library_state(roots, extensions=DEFAULT_AUDIO_EXTENSIONS, search_folders=None, workers=8):
+    return {file_path: ("", str(size), str(mtime_ns)) for file_path, size, mtime_ns in
+            iter_audio_file_stats(roots, extensions, search_folders, workers)}
@@ -0,0 +1,828 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# release year lookups against the openai responses api.
+
+# holds the prompt shared by every lookup path and a concurrent asyncio
+# lookup engine.  the engine keeps a fixed number of requests in flight,
+# stays under requests/tokens per minute limits with token buckets,
+# retries 429/5xx/timeouts with exponential backoff and hands results
+# back in input order so they can be written to track-years.csv as they
+# come in.  tracks that share a lookup key are only queried once per run,
+# and found years can be served from and saved to a LookupCache.
+
+# in packed mode up to pack_size tracks are sent in one request with a
+# json output schema, and any track the packed answer doesn't cover is
+# looked up on its own.
+
+# with samples > 1 every track is asked about samples times at once, every
+# resolver in the chain is asked too, and the answers are combined into a
+# consensus year and a confidence score (see consensus.py).
+
+# lookup_release_years_streaming() feeds the engine from a blocking
+# iterator (tag extraction) through a bounded queue, so lookups start
+# with the first track and a slow model holds the producer back instead of
+# letting tracks pile up in memory.
+
+import asyncio
+import concurrent.futures
+import json
+import random
+import threading
+import time
+
+from termcolor import colored
+
+from consensus import confidence_vote, consensus_year, is_valid_release_year
+from instrumentation import metrics
+from lookup_cache import lookup_key
+from normalize import DEFAULT_TITLE_STRIP_PATTERN
+
+
+# -----------  Variable Defs  ----------- #
+
+RELEASE_YEAR_MODEL = "gpt-5-nano"
+
+# bump whenever release_year_prompt changes so cached years made with the
+# old prompt are no longer served
+RELEASE_YEAR_PROMPT_VERSION = "1"
+
+# the same for escalated_release_year_prompt, whose answers are cached
+# apart from the plain prompt's
+ESCALATED_RELEASE_YEAR_PROMPT_VERSION = "escalated-1"
+
+# rough token cost of one lookup (prompt + reasoning + answer), used to
+# reserve tokens from the tokens per minute bucket before a request is sent
+ESTIMATED_TOKENS_PER_LOOKUP = 300
+
+# rough extra token cost of every additional track in a packed request
+ESTIMATED_TOKENS_PER_PACKED_TRACK = 60
+
+# seconds between checks of a track another run sharing the lookup cache
+# is looking up
+SHARED_CLAIM_POLL_INTERVAL = 0.25
+
+# finished lookup keys whose votes are kept for later tracks with the
+# same key.  older keys are dropped so streamed runs of huge libraries
+# don't grow without bound, and fall back to the cache
+RESOLVED_KEYS_LIMIT = 100000
+
+# how long a partly filled pack waits for more tracks before it is sent
+PACK_MAX_WAIT = 0.05
+
+# seconds the streaming producer waits on a full queue before checking
+# whether the lookups stopped
+PRODUCER_PUT_TIMEOUT = 0.25
+
+# structured output schema for packed requests
+PACKED_RELEASE_YEARS_FORMAT = {
+    "type": "json_schema",
+    "name": "release_years",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "year": {"type": "string"},
+                    },
+                    "required": ["id", "year"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["results"],
+        "additionalProperties": False,
+    },
+}
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Build the release year prompt for a track
+# returns the prompt string
+def release_year_prompt(track_title, artist):
+    """
+    Returns the prompt asking for the 4 digit release year of a track.
+    """
+    return f"What year was {track_title} by {artist} released?  Please return only exact 4 digit exact release year."
+
+
+# Build the more detailed prompt used when a track is asked about again
+# returns the prompt string
+def escalated_release_year_prompt(track_title, artist):
+    """
+    Returns a prompt for tracks the plain prompt got no year for, spelling
+    out which year is wanted and asking for the most likely year.
+    """
+    return (f"What year was the song {track_title} by {artist} first released?  It may be an edit, remix or "
+            f"re-release of an older song: give the year the original recording was first released, not the "
+            f"year of a compilation, remaster or re-release.  If you aren't certain, give the most likely year.  "
+            f"Please return only the 4 digit year.")
+
+
+# Check a model response for a 4 digit year
+# returns the year string or "0"
+def parse_release_year(output_text):
+    """
+    Returns the response text if it is a 4 digit year in the range a
+    release can be from, otherwise "0".
+    """
+    output_text = (output_text or "").strip()
+
+    if is_valid_release_year(output_text):
+        return output_text
+
+    return "0"
+
+
+# Build the release year prompt for several tracks at once
+# params: list of (track_title, artist) tuples
+# returns the prompt string
+def packed_release_year_prompt(tracks):
+    """
+    Returns the prompt asking for the 4 digit release year of every
+    numbered track.
+    """
+    track_lines = "\n".join(
+        f"{number}. {track_title} by {artist}" for number, (track_title, artist) in enumerate(tracks, start=1))
+
+    return ("What year was each of the following tracks released?  For every track return its number as id "
+            "and only the exact 4 digit release year as year, or \"0\" if unknown.\n" + track_lines)
+
+
+# Check a packed json response
+# returns list of year strings, None for every track without a valid answer
+def parse_packed_release_years(output_text, track_count):
+    """
+    Maps a packed json response back to the numbered tracks.  Tracks that
+    are missing or have a malformed answer are None.
+    """
+    found_years = [None] * track_count
+
+    try:
+        results = json.loads(output_text or "")["results"]
+    except (ValueError, KeyError, TypeError):
+        return found_years
+
+    if not isinstance(results, list):
+        return found_years
+
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+
+        number = result.get("id")
+        year = str(result.get("year", "")).strip()
+
+        if not isinstance(number, int) or not 1 <= number <= track_count:
+            continue
+
+        if year == "0" or parse_release_year(year) != "0":
+            found_years[number - 1] = year
+
+    return found_years
+
+
+# Get the tokens used by a response
+# returns the total token count, 0 if the response has no usage
+def response_total_tokens(response):
+    usage = getattr(response, "usage", None)
+
+    return getattr(usage, "total_tokens", None) or 0
+
+
+# Get the input and output tokens of a response
+# returns a tuple of (input_tokens, output_tokens), (0, 0) without usage
+def response_token_usage(response):
+    usage = getattr(response, "usage", None)
+
+    return getattr(usage, "input_tokens", None) or 0, getattr(usage, "output_tokens", None) or 0
+
+
+# Record the tokens of a response in the run metrics
+def record_token_usage(response):
+    input_tokens, output_tokens = response_token_usage(response)
+    metrics.increment("input_tokens", input_tokens)
+    metrics.increment("output_tokens", output_tokens)
+
+
+# Decide whether a failed request is worth retrying
+# returns True for rate limits, server errors, timeouts and dropped connections
+def is_retryable_error(error):
+    """
+    Returns True if the error is a 429, a 5xx, a timeout or a connection error.
+    """
+    import openai
+
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+
+    return False
+
+
+# Work out how long to wait before the next attempt
+# returns the delay in seconds
+def retry_delay(error, attempt, base_delay=1.0, max_delay=60.0):
+    """
+    Exponential backoff with jitter.  A Retry-After header on the error
+    response takes precedence.
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get(
+        "retry-after") if response is not None else None
+
+    if retry_after:
+        try:
+            return min(float(retry_after), max_delay)
+        except ValueError:
+            pass
+
+    delay = min(base_delay * (2 ** attempt), max_delay)
+
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# -----------  Rate Limiting  ----------- #
+
+class TokenBucket:
+    """
+    Async token bucket.  Holds up to capacity tokens and refills at
+    rate_per_minute.  Waiters are served in order.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        """
+        Waits until amount tokens are available and takes them.
+        """
+        amount = min(amount, self.capacity)
+
+        async with self.lock:
+            while True:
+                self._refill()
+
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+
+                await asyncio.sleep((amount - self.tokens) / self.rate_per_second)
+
+    def consume(self, amount):
+        """
+        Takes amount tokens without waiting.  The balance may go negative,
+        which delays the next acquire.
+        """
+        self._refill()
+        self.tokens -= amount
+
+
+# -----------  Async Lookup Engine  ----------- #
+
+class ReleaseYearLookupEngine:
+    """
+    Looks up release years with up to concurrency requests in flight.
+    requests_per_minute and tokens_per_minute are optional limits and
+    cache is an optional LookupCache.  With pack_size > 1 tracks are
+    looked up pack_size at a time.
+
+    resolvers is the chain of local sources tried before the model, each
+    with a get(artist, track_title) method returning a year or None.  It
+    defaults to just the cache.  With use_model=False tracks the chain
+    can't resolve get "0" instead of being looked up.  verbose=False
+    leaves out the per track "not a year" messages.
+
+    key_aliases maps lookup keys to the key of their fuzzy match cluster
+    (see normalize.cluster_track_keys), so a whole cluster shares one
+    lookup.  title_pattern holds the title strip rules lookup keys are
+    built with.  prompt builds the single track prompt from a title and
+    an artist.
+
+    samples is the number of model answers per track.  With 1 the chain
+    stops at the first resolver with a year and the model is only asked
+    when none has one.  With more every resolver is asked and the model
+    is asked samples times at once, unpacked, so up to concurrency *
+    samples requests are in flight.  Every track gets a year and a
+    confidence from the consensus of its votes and its tagged year.
+
+    With a shared cache (LookupCache(shared=True)) in the chain a track
+    another run is asking the model about is waited for and takes that
+    run's year, as a cache vote.
+    """
+
+    def __init__(self, client=None, model=RELEASE_YEAR_MODEL, concurrency=8,
+                 requests_per_minute=None, tokens_per_minute=None, timeout=60,
+                 max_retries=5, estimated_tokens=ESTIMATED_TOKENS_PER_LOOKUP, cache=None, pack_size=1,
+                 resolvers=None, use_model=True, key_aliases=None, verbose=True,
+                 prompt=release_year_prompt, samples=1, title_pattern=DEFAULT_TITLE_STRIP_PATTERN):
+        # retries are handled here so the openai client must not retry too
+        if client is None:
+            import openai
+            client = openai.AsyncOpenAI(max_retries=0)
+
+        self.client = client
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.estimated_tokens = estimated_tokens
+        self.cache = cache
+        self.pack_size = max(1, pack_size)
+        self.resolvers = resolvers if resolvers is not None else (
+            [cache] if cache else [])
+        self.use_model = use_model
+        self.verbose = verbose
+        self.key_aliases = key_aliases or {}
+        self.prompt = prompt
+        self.samples = max(1, samples)
+        self.title_pattern = title_pattern
+
+        # runs sharing the lookup cache claim the tracks they ask the model
+        # about.  escalated lookups skip the chain and never wait on claims
+        self.claims = bool(cache is not None and getattr(cache, "shared", False)
+                           and cache in self.resolvers)
+
+        # in packed mode every request carries up to pack_size tracks, so
+        # that many more tracks are kept in flight.  sampled lookups are
+        # never packed
+        self.workers = self.concurrency * \
+            (self.pack_size if self.samples == 1 else 1)
+
+        # tracks waiting to be sent in the next pack, and the timer that
+        # sends a partly filled pack
+        self.pending_pack = []
+        self.pack_timer = None
+        self.pack_tasks = set()
+
+        # lookup key -> future of the (source, year) votes, shared by every
+        # track with the same key while it is being looked up
+        self.resolving = {}
+
+        # lookup key -> votes of the last RESOLVED_KEYS_LIMIT finished keys
+        self.resolved = {}
+
+        self.request_bucket = TokenBucket(
+            requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(
+            tokens_per_minute) if tokens_per_minute else None
+
+        self.stats = {"requests": 0, "retries": 0, "failed": 0,
+                      "not_found": 0, "tokens": 0, "deduplicated": 0,
+                      "packed_requests": 0, "packed_tracks": 0, "packed_tokens": 0,
+                      "pack_fallbacks": 0, "resolved_locally": 0, "clustered": 0, "shared": 0,
+                      # resolver name -> number of tracks it resolved
+                      "resolver_hits": {}}
+
+    async def _create_response(self, prompt, estimated_tokens, **options):
+        if self.request_bucket:
+            await self.request_bucket.acquire(1)
+
+        if self.token_bucket:
+            await self.token_bucket.acquire(estimated_tokens)
+
+        self.stats["requests"] += 1
+
+        with metrics.timed("model_lookup"):
+            response = await asyncio.wait_for(
+                self.client.responses.create(
+                    model=self.model, input=prompt, **options),
+                timeout=self.timeout)
+
+        record_token_usage(response)
+
+        # settle the difference between the reserved and the used tokens
+        total_tokens = response_total_tokens(response)
+        self.stats["tokens"] += total_tokens
+
+        if self.token_bucket and total_tokens > estimated_tokens:
+            self.token_bucket.consume(total_tokens - estimated_tokens)
+
+        return response
+
+    async def _create_response_with_retries(self, prompt, description, estimated_tokens, **options):
+        """
+        Sends a request, retrying transient errors.  Returns the response,
+        or None once the request has failed for good.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._create_response(prompt, estimated_tokens, **options)
+
+            except Exception as error:
+                if attempt < self.max_retries and is_retryable_error(error):
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(retry_delay(error, attempt))
+                    continue
+
+                self.stats["failed"] += 1
+                print(colored(
+                    f"==> Lookup failed for {description}: {type(error).__name__}: {error}", color="red"))
+
+                return None
+
+    async def lookup(self, track_title, artist):
+        """
+        Looks up the release year for one track, retrying transient
+        errors.  Returns the year string or "0".
+        """
+        response = await self._create_response_with_retries(
+            self.prompt(track_title, artist), f"{track_title} by {artist}", self.estimated_tokens)
+
+        if response is None:
+            return "0"
+
+        found_year = parse_release_year(response.output_text)
+
+        if found_year == "0":
+            if self.verbose:
+                print(colored(
+                    f"==> Response not a 4 digit year for {track_title} by {artist}", color="white"))
+                print(colored(
+                    f"==> Chat response: {response.output_text}", color="red"))
+
+        return found_year
+
+    async def lookup_pack(self, tracks):
+        """
+        Looks up the release years of several (track_title, artist) tracks
+        in one request.  Returns a list of year strings, with None for every
+        track the response didn't answer properly.
+        """
+        estimated_tokens = self.estimated_tokens + \
+            ESTIMATED_TOKENS_PER_PACKED_TRACK * (len(tracks) - 1)
+
+        response = await self._create_response_with_retries(
+            packed_release_year_prompt(tracks), f"a pack of {len(tracks)} tracks",
+            estimated_tokens, text={"format": PACKED_RELEASE_YEARS_FORMAT})
+
+        self.stats["packed_requests"] += 1
+        self.stats["packed_tracks"] += len(tracks)
+
+        if response is None:
+            return [None] * len(tracks)
+
+        self.stats["packed_tokens"] += response_total_tokens(response)
+
+        return parse_packed_release_years(response.output_text, len(tracks))
+
+    async def _send_pack(self, pack):
+        try:
+            found_years = await self.lookup_pack(
+                [(track_title, artist) for track_title, artist, _ in pack])
+        except Exception as error:
+            for _, _, future in pack:
+                future.set_exception(error)
+            return
+
+        async def settle(track_title, artist, future, found_year):
+            # anything the packed answer missed is looked up on its own
+            if found_year is None:
+                self.stats["pack_fallbacks"] += 1
+                found_year = await self.lookup(track_title, artist)
+
+            future.set_result(found_year)
+
+        await asyncio.gather(*(settle(track_title, artist, future, found_year)
+                               for (track_title, artist, future), found_year in zip(pack, found_years)))
+
+    def _flush_pack(self):
+        if self.pack_timer is not None:
+            self.pack_timer.cancel()
+            self.pack_timer = None
+
+        if self.pending_pack:
+            pack = self.pending_pack
+            self.pending_pack = []
+
+            # keep a reference so the task isn't garbage collected mid pack
+            task = asyncio.ensure_future(self._send_pack(pack))
+            self.pack_tasks.add(task)
+            task.add_done_callback(self.pack_tasks.discard)
+
+    async def lookup_packed(self, track_title, artist):
+        """
+        Queues a track for the next pack and waits for its year.  A pack
+        is sent once it is full or PACK_MAX_WAIT seconds after its first
+        track was queued.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending_pack.append((track_title, artist, future))
+
+        if len(self.pending_pack) >= self.pack_size:
+            self._flush_pack()
+        elif self.pack_timer is None:
+            self.pack_timer = asyncio.get_running_loop().call_later(
+                PACK_MAX_WAIT, self._flush_pack)
+
+        return await future
+
+    def packing_report(self):
+        """
+        Returns a summary of the requests and tokens saved by packing
+        compared with one request per track.
+        """
+        packed_tracks = self.stats["packed_tracks"]
+        packed_requests = self.stats["packed_requests"]
+
+        # cost of a single track lookup, measured if there were any
+        single_requests = self.stats["requests"] - packed_requests
+        single_tokens = self.stats["tokens"] - self.stats["packed_tokens"]
+        tokens_per_single = single_tokens / \
+            single_requests if single_requests and single_tokens else self.estimated_tokens
+
+        requests_saved = packed_tracks - packed_requests - \
+            self.stats["pack_fallbacks"]
+        tokens_saved = int((packed_tracks - self.stats["pack_fallbacks"]) * tokens_per_single -
+                           self.stats["packed_tokens"])
+
+        return (f"Packing: {packed_tracks} tracks in {packed_requests} packed requests, "
+                f"{self.stats['pack_fallbacks']} single track fallbacks. "
+                f"Saved {requests_saved} requests and about {tokens_saved} tokens vs one request per track.")
+
+    def local_votes(self, track_title, artist):
+        """
+        Returns the (source, year) votes of the resolvers that have a
+        year.  With one sample the chain stops at the first of them.
+        """
+        votes = []
+
+        for resolver in self.resolvers:
+            name = getattr(resolver, "name", type(resolver).__name__)
+
+            # the lookup cache keeps the confidence its years were found with
+            if hasattr(resolver, "get_with_confidence"):
+                found = resolver.get_with_confidence(artist, track_title)
+                vote = confidence_vote(name, *found) if found else None
+            else:
+                found_year = resolver.get(artist, track_title)
+                vote = (name, found_year) if found_year is not None else None
+
+            if vote is not None:
+                resolver_hits = self.stats["resolver_hits"]
+                resolver_hits[name] = resolver_hits.get(name, 0) + 1
+                votes.append(vote)
+
+                if self.samples == 1:
+                    break
+
+        return votes
+
+    async def resolve_votes(self, track_title, artist):
+        """
+        Returns the (source, year) votes for a track from the resolver
+        chain and new lookups.
+        """
+        votes = self.local_votes(track_title, artist)
+
+        if not self.use_model or (votes and self.samples == 1):
+            if votes:
+                self.stats["resolved_locally"] += 1
+            else:
+                self.stats["not_found"] += 1
+
+            return votes
+
+        # another run sharing the cache may be looking the track up already
+        if self.claims:
+            shared = await self.wait_for_shared_lookup(track_title, artist)
+
+            if shared is not None:
+                resolver_hits = self.stats["resolver_hits"]
+                resolver_hits["shared"] = resolver_hits.get("shared", 0) + 1
+                self.stats["resolved_locally"] += 1
+                self.stats["shared"] += 1
+
+                return votes + [confidence_vote("cache", *shared)]
+
+        try:
+            if self.samples > 1:
+                found_years = await asyncio.gather(
+                    *(self.lookup(track_title, artist) for _ in range(self.samples)))
+            elif self.pack_size > 1:
+                found_years = [await self.lookup_packed(track_title, artist)]
+            else:
+                found_years = [await self.lookup(track_title, artist)]
+
+        except BaseException:
+            if self.claims:
+                self.cache.release(artist, track_title)
+            raise
+
+        votes += [("model", found_year) for found_year in found_years]
+        found_year, confidence = consensus_year(votes)
+
+        # counted once per track, however many answers it took
+        if found_year == "0":
+            self.stats["not_found"] += 1
+
+        if self.cache:
+            self.cache.put(artist, track_title, found_year, confidence)
+
+        return votes
+
+    async def wait_for_shared_lookup(self, track_title, artist):
+        """
+        Claims a track in the shared lookup cache, waiting while another
+        run holds the claim.  Returns the (year, confidence) the other run
+        cached, or None once this run holds the claim, which it also gets
+        when the other run found no year.
+        """
+        while True:
+            claimed, found = self.cache.claim(artist, track_title)
+
+            if claimed or found is not None:
+                return found
+
+            await asyncio.sleep(SHARED_CLAIM_POLL_INTERVAL)
+
+    async def resolve(self, track_title, artist, tagged_year=None):
+        """
+        Returns a tuple of (year, confidence) for a track.  The votes come
+        from this run's earlier lookups, or the resolver chain and new
+        lookups, and are combined with the tagged year.
+        """
+        own_key = lookup_key(artist, track_title, self.title_pattern)
+        key = self.key_aliases.get(own_key, own_key)
+
+        if key in self.resolved or key in self.resolving:
+            self.stats["deduplicated"] += 1
+            votes = self.resolved[key] if key in self.resolved else await self.resolving[key]
+
+            # a fuzzy match is a guess, so it isn't cached under this
+            # spelling
+            if own_key != key:
+                self.stats["clustered"] += 1
+
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.resolving[key] = future
+
+            votes = await self.resolve_votes(track_title, artist)
+            future.set_result(votes)
+
+            # waiters already hold the future, so only the votes are kept
+            del self.resolving[key]
+            self.resolved[key] = votes
+            if len(self.resolved) > RESOLVED_KEYS_LIMIT:
+                del self.resolved[next(iter(self.resolved))]
+
+        return consensus_year(votes + [("tag", tagged_year)])
+
+    async def run(self, track_data_list, on_result, ordered=True):
+        """
+        Looks up the release year of every track data item and calls
+        on_result(track_data_item, found_year, confidence) for each one.  With
+        ordered=True results are handed back in input order, so the output
+        file can be resumed from its last row.
+        """
+        items = enumerate(track_data_list)
+        completed = {}
+        next_index = 0
+
+        async def worker():
+            nonlocal next_index
+
+            # every worker pulls from the same iterator
+            for index, track_data_item in items:
+                found_year, confidence = await self.resolve(
+                    track_data_item[3], track_data_item[2], track_data_item[4])
+
+                if not ordered:
+                    on_result(track_data_item, found_year, confidence)
+                    continue
+
+                completed[index] = (track_data_item, found_year, confidence)
+
+                while next_index in completed:
+                    on_result(*completed.pop(next_index))
+                    next_index += 1
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+
+        if self.pack_size > 1 and self.samples == 1:
+            print(colored(self.packing_report(), color="white"))
+
+        return self.stats
+
+    async def run_queue(self, queue, on_result):
+        """
+        Looks up the release year of every track data item taken from an
+        asyncio queue, until a None item ends the stream, and calls
+        on_result(track_data_item, found_year, confidence) as each one
+        finishes.
+        """
+        async def worker():
+            while True:
+                track_data_item = await queue.get()
+
+                if track_data_item is None:
+                    # leave the end marker for the other workers
+                    queue.put_nowait(None)
+                    return
+
+                found_year, confidence = await self.resolve(
+                    track_data_item[3], track_data_item[2], track_data_item[4])
+                on_result(track_data_item, found_year, confidence)
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+
+        if self.pack_size > 1 and self.samples == 1:
+            print(colored(self.packing_report(), color="white"))
+
+        return self.stats
+
+
+# Run the lookup engine to completion from synchronous code
+# returns the engine stats dict
+def lookup_release_years(track_data_list, on_result, ordered=True, **engine_options):
+    """
+    Looks up release years for track_data_list with a
+    ReleaseYearLookupEngine, calling on_result for every track.
+    """
+    engine = ReleaseYearLookupEngine(**engine_options)
+
+    return asyncio.run(engine.run(track_data_list, on_result, ordered=ordered))
+
+
+# Run the lookup engine on track data items from a blocking iterator
+# returns the engine stats dict
+def lookup_release_years_streaming(track_data_iter, on_result, queue_size=256, **engine_options):
+    """
+    Pulls track data items from track_data_iter on a producer thread and
+    hands them to the engine through a queue of at most queue_size items.
+    The producer blocks while the queue is full, so only queue_size items
+    plus the requests in flight are held at once.  on_result is called in
+    completion order.  An error raised by track_data_iter is raised here
+    once the queued items are done.
+    """
+    engine = ReleaseYearLookupEngine(**engine_options)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=max(1, queue_size))
+        producer_errors = []
+        stopped = threading.Event()
+
+        def put(track_data_item):
+            future = asyncio.run_coroutine_threadsafe(queue.put(track_data_item), loop)
+
+            # blocks this thread while the queue is full, until the
+            # lookups stop taking items
+            while True:
+                try:
+                    future.result(timeout=PRODUCER_PUT_TIMEOUT)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stopped.is_set():
+                        future.cancel()
+                        return False
+
+        def produce():
+            try:
+                for track_data_item in track_data_iter:
+                    if not put(track_data_item):
+                        break
+                else:
+                    put(None)
+            except Exception as error:
+                producer_errors.append(error)
+                put(None)
+            finally:
+                # a generator is closed in the thread that ran it
+                if stopped.is_set() and hasattr(track_data_iter, "close"):
+                    track_data_iter.close()
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        try:
+            stats = await engine.run_queue(queue, on_result)
+        finally:
+            stopped.set()
+            await loop.run_in_executor(None, producer.join)
+
+        if producer_errors:
+            raise producer_errors[0]
+
+        return stats
+
+    return asyncio.run(run())
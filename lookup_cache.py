@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# persistent cache of release year lookups.
+
+# a DJ library holds many edits of the same song (clean, dirty, intro...)
+# which all collapse to the same formatted track title, and every run used
+# to query the model for all of them again.  found years are stored in a
+# sqlite file keyed by the normalized artist and formatted title, together
+# with the model and prompt version that produced them and the confidence
+# of the consensus behind them.  keys are the canonical keys of
+# normalize.py.
+
+# several runs can share one cache at once (see jobs.py).  with
+# shared=True a run claims every track it is about to ask the model
+# about, for its model and prompt version, and the other runs wait for
+# the claim to finish and take the cached year instead of asking too.  a
+# lookup that found no year gives its claim up, so the next run asks
+# again.  claims older than CLAIM_TTL_SECONDS are taken over, in case the
+# run that made them died.
+
+# usage:
+#   python3 lookup_cache.py
+#   python3 lookup_cache.py --prune-older-than 90
+#   python3 lookup_cache.py --clear
+
+import argparse
+import os
+import sqlite3
+import time
+
+from termcolor import colored
+
+from normalize import DEFAULT_TITLE_STRIP_PATTERN, canonical_key
+
+
+# seconds before an unfinished claim is taken over by another run
+CLAIM_TTL_SECONDS = 600
+
+# one entry per track and model and prompt version, so runs with
+# different models sharing a cache don't replace each other's years
+LOOKUPS_TABLE = """
+    CREATE TABLE IF NOT EXISTS lookups (
+        key TEXT NOT NULL,
+        artist TEXT,
+        title TEXT,
+        year TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        confidence REAL,
+        PRIMARY KEY (key, model, prompt_version)
+    )"""
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Build the cache key for a track
+# returns "artist|title" normalized
+def lookup_key(artist, track_title_formatted, pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Returns the cache key for an artist and formatted track title, the
+    canonical key from normalize.py with the title strip rules compiled
+    into pattern, so spelling variants of a track share one entry.
+    """
+    return canonical_key(artist, track_title_formatted, pattern)
+
+
+# -----------  Lookup Cache  ----------- #
+
+class LookupCache:
+    """
+    SQLite backed cache of found release years.  Entries older than
+    ttl_seconds, or made with a different model or prompt version, count
+    as misses.  shared=True turns on claims for runs sharing the cache at
+    once.  Keys are built with the title strip rules of title_pattern.
+    """
+
+    name = "cache"
+
+    def __init__(self, cache_file_path, model, prompt_version, ttl_seconds=None, shared=False,
+                 title_pattern=DEFAULT_TITLE_STRIP_PATTERN):
+        self.cache_file_path = cache_file_path
+        self.title_pattern = title_pattern
+        self.model = model
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.owner = f"{os.getpid()}@{time.time()}"
+
+        # runs sharing the cache wait for each other's writes
+        self.connection = sqlite3.connect(cache_file_path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.migrate_lookups()
+        self.connection.execute(LOOKUPS_TABLE)
+
+        # claims only live while runs are going, so claims made before
+        # they were kept per model and prompt version are dropped
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(claims)")]
+        if columns and "model" not in columns:
+            self.connection.execute("DROP TABLE claims")
+
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS claims (
+                key TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                claimed_at REAL NOT NULL,
+                PRIMARY KEY (key, model, prompt_version)
+            )""")
+
+        self.connection.commit()
+
+    def migrate_lookups(self):
+        """
+        Brings a lookups table made by an older version up to date.
+        """
+        with self.connection:
+            # another run sharing the cache may be migrating it too
+            self.connection.execute("BEGIN IMMEDIATE")
+            columns = {row[1]: row[5] for row in self.connection.execute(
+                "PRAGMA table_info(lookups)")}
+
+            # caches made before confidences were stored
+            if columns and "confidence" not in columns:
+                self.connection.execute("ALTER TABLE lookups ADD COLUMN confidence REAL")
+
+            # caches keyed by the track alone kept one model's year per
+            # track
+            if columns and sum(1 for pk in columns.values() if pk) == 1:
+                self.connection.execute("ALTER TABLE lookups RENAME TO lookups_by_key")
+                self.connection.execute(LOOKUPS_TABLE)
+                self.connection.execute(
+                    "INSERT INTO lookups SELECT key, artist, title, year, model, prompt_version, "
+                    "created_at, confidence FROM lookups_by_key")
+                self.connection.execute("DROP TABLE lookups_by_key")
+
+    def get(self, artist, track_title_formatted):
+        """
+        Returns the cached year for the track or None on a miss.
+        """
+        found = self.get_with_confidence(artist, track_title_formatted)
+
+        return found[0] if found else None
+
+    def get_with_confidence(self, artist, track_title_formatted):
+        """
+        Returns a tuple of (year, confidence) for the track, confidence
+        None for entries cached without one, or None on a miss.
+        """
+        found = self._cached(lookup_key(artist, track_title_formatted, self.title_pattern))
+
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return found
+
+    def _cached(self, key):
+        row = self.connection.execute(
+            "SELECT year, created_at, confidence FROM lookups "
+            "WHERE key = ? AND model = ? AND prompt_version = ?",
+            (key, self.model, self.prompt_version)).fetchone()
+
+        if row is not None:
+            year, created_at, confidence = row
+            expired = self.ttl_seconds is not None and time.time() - \
+                created_at > self.ttl_seconds
+
+            if not expired:
+                return year, confidence
+
+        return None
+
+    def put(self, artist, track_title_formatted, year, confidence=None):
+        """
+        Stores a found year, with the confidence of the consensus that
+        found it, and finishes the claim on the track.  "0" (no year
+        found) is never cached, and gives the claim up, so the track is
+        queried again.
+        """
+        key = lookup_key(artist, track_title_formatted, self.title_pattern)
+
+        if self.shared:
+            self._release(key)
+
+        if year != "0":
+            self.connection.execute(
+                "INSERT OR REPLACE INTO lookups (key, artist, title, year, model, prompt_version, created_at, confidence) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, artist, track_title_formatted,
+                 year, self.model, self.prompt_version, time.time(), confidence))
+
+        self.connection.commit()
+
+    def claim(self, artist, track_title_formatted):
+        """
+        Claims a track this run is about to look up.  Returns a tuple of
+        (claimed, found): (True, None) when this run should look it up,
+        (False, (year, confidence)) when another run has cached its year
+        and (False, None) while another run is still on it.
+        """
+        key = lookup_key(artist, track_title_formatted, self.title_pattern)
+        claim = (key, self.model, self.prompt_version)
+        now = time.time()
+
+        with self.connection:
+            claimed = self.connection.execute(
+                "INSERT OR IGNORE INTO claims VALUES (?, ?, ?, ?, ?)",
+                claim + (self.owner, now)).rowcount
+
+            # checked once the claim is held or known to be someone
+            # else's, so a year cached in between isn't missed
+            found = self._cached(key)
+            if found is not None:
+                if claimed:
+                    self._release(key)
+                return False, found
+
+            if claimed:
+                return True, None
+
+            owner, claimed_at = self.connection.execute(
+                "SELECT owner, claimed_at FROM claims WHERE key = ? AND model = ? AND prompt_version = ?",
+                claim).fetchone()
+
+            if owner == self.owner:
+                return True, None
+
+            # take over a claim whose run seems to have died
+            if now - claimed_at > CLAIM_TTL_SECONDS:
+                taken = self.connection.execute(
+                    "UPDATE claims SET owner = ?, claimed_at = ? "
+                    "WHERE key = ? AND model = ? AND prompt_version = ? AND owner = ?",
+                    (self.owner, now) + claim + (owner,)).rowcount
+
+                return bool(taken), None
+
+        return False, None
+
+    def release(self, artist, track_title_formatted):
+        """
+        Gives up a claim, so another run can look the track up.
+        """
+        self._release(lookup_key(artist, track_title_formatted, self.title_pattern))
+        self.connection.commit()
+
+    def _release(self, key):
+        self.connection.execute(
+            "DELETE FROM claims WHERE key = ? AND model = ? AND prompt_version = ? AND owner = ?",
+            (key, self.model, self.prompt_version, self.owner))
+
+    def clear_claims(self):
+        """
+        Deletes every claim, such as the ones left by runs that died.
+        Returns the number of deleted claims.
+        """
+        deleted = self.connection.execute("DELETE FROM claims").rowcount
+        self.connection.commit()
+
+        return deleted
+
+    def invalidate(self, older_than_seconds=None, model=None, prompt_version=None):
+        """
+        Deletes entries older than older_than_seconds and/or made with the
+        given model or prompt version.  With no arguments every entry is
+        deleted.  Returns the number of deleted entries.
+        """
+        conditions = []
+        params = []
+
+        if older_than_seconds is not None:
+            conditions.append("created_at < ?")
+            params.append(time.time() - older_than_seconds)
+
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+
+        if prompt_version is not None:
+            conditions.append("prompt_version = ?")
+            params.append(prompt_version)
+
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        deleted = self.connection.execute(
+            "DELETE FROM lookups" + where, params).rowcount
+        self.connection.commit()
+
+        return deleted
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM lookups").fetchone()[0]
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+
+        print(colored(
+            f"Lookup cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate).", color="white"))
+
+    def close(self):
+        if self.shared:
+            # claims left unfinished by this run
+            self.connection.execute(
+                "DELETE FROM claims WHERE owner = ?", (self.owner,))
+            self.connection.commit()
+
+        self.connection.close()
+
+
+# -----------  Run  ----------- #
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect or invalidate the release year lookup cache.")
+    parser.add_argument("--cache-file", default=os.path.dirname(
+        os.path.abspath(__file__)) + "/output/lookup-cache.sqlite")
+    parser.add_argument("--prune-older-than", type=float, metavar="DAYS",
+                        help="delete entries older than DAYS days")
+    parser.add_argument("--model", help="only delete entries made with MODEL")
+    parser.add_argument("--prompt-version",
+                        help="only delete entries made with PROMPT_VERSION")
+    parser.add_argument("--clear", action="store_true",
+                        help="delete every entry (or every matching entry)")
+    args = parser.parse_args()
+
+    cache = LookupCache(args.cache_file, model=None, prompt_version=None)
+
+    if args.clear or args.prune_older_than is not None:
+        older_than_seconds = args.prune_older_than * \
+            86400 if args.prune_older_than is not None else None
+        deleted = cache.invalidate(
+            older_than_seconds, model=args.model, prompt_version=args.prompt_version)
+        print(colored(f"Deleted {deleted} cached lookups.", color="white"))
+
+    print(colored(f"{cache.count()} cached lookups in {args.cache_file}", color="white"))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
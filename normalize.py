@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# artist / title normalization and fuzzy matching.
+
+# DJ pools tag the same song as "Song (Clean)", "Song [Extended Mix]",
+# "Song - Radio Edit", "Song (feat. Someone)"... and every spelling used to
+# be a separate lookup.  the version annotations are stripped with one
+# configurable rule set compiled into a single regex, canonical_key()
+# turns an artist and title into an accent, case, punctuation and feature
+# insensitive key, and TrigramIndex clusters keys that are still only
+# nearly the same (typos, "&" vs "and"...) so one lookup resolves the whole
+# cluster.
+
+import re
+import unicodedata
+
+
+# version annotations stripped from track titles, as regexes matched
+# case-insensitively. the first rule covers the old hardcoded list:
+# (Clean), (Intro - Dirty), (HH Dirty Mixshow)... it only strips brackets
+# holding nothing but these words, so "(Dirty South Remix)" is kept
+TITLE_ANNOTATION = r"(?:clean|dirty|intro|outro|hh|mixshow|mix show|quick hit|short edit|radio edit|extended mix|extended|original mix|club mix|explicit)"
+
+DEFAULT_TITLE_STRIP_RULES = [
+    rf"[\(\[]\s*{TITLE_ANNOTATION}(?:[\s/&,-]+{TITLE_ANNOTATION})*\s*[\)\]]",
+    r"\s+-\s+(?:radio edit|extended mix|extended version|original mix|club mix|clean|dirty|explicit)\s*$",
+    r"\*",
+]
+
+# featured artists, stripped from canonical keys
+FEATURE_PATTERN = re.compile(
+    r"[\(\[]\s*(?:feat|ft|featuring)\b\.?[^\)\]]*[\)\]]|\s(?:feat|ft|featuring)\b\.?\s.*$", re.IGNORECASE)
+
+# anything that isn't a letter, digit or space
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]|_")
+
+# the similarity two keys need to be clustered when fuzzy matching is
+# turned on
+DEFAULT_FUZZY_THRESHOLD = 0.85
+
+# trigrams shared by more keys than this are too common to find
+# candidates with ("the", "ove"...)
+MAX_TRIGRAM_POSTINGS = 1000
+
+
+# -----------  Title Rules  ----------- #
+
+# Compile a title strip rule set into one regex
+# returns a compiled pattern
+def compile_title_rules(rules):
+    """
+    Joins every rule into one alternation so a title is cleaned in a
+    single pass.
+    """
+    return re.compile("|".join(f"(?:{rule})" for rule in rules), re.IGNORECASE)
+
+
+DEFAULT_TITLE_STRIP_PATTERN = compile_title_rules(DEFAULT_TITLE_STRIP_RULES)
+
+
+# Strip version annotations from a track title
+# returns the formatted title
+def format_track_title(track_title, pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Removes every rule match and collapses the whitespace left behind.
+    The case and accents of the title are kept.
+    """
+    return " ".join(pattern.sub(" ", str(track_title)).split())
+
+
+# -----------  Canonical Keys  ----------- #
+
+# Fold a string to its canonical form
+# returns a lower case string without accents, punctuation or extra spaces
+def fold(value):
+    """
+    Decomposes accented characters and drops the accents, casefolds,
+    turns "&" into "and" and removes punctuation.
+    """
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(
+        character for character in value if not unicodedata.combining(character))
+    value = value.casefold().replace("&", " and ")
+    value = PUNCTUATION_PATTERN.sub(" ", value)
+
+    return " ".join(value.split())
+
+
+# Build the canonical key of a track
+# returns "artist|title"
+def canonical_key(artist, track_title, pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Strips version annotations and featured artists from the title,
+    featured artists from the artist, and folds both.
+    """
+    track_title = FEATURE_PATTERN.sub(
+        " ", format_track_title(track_title, pattern))
+    artist = FEATURE_PATTERN.sub(" ", str(artist))
+
+    return f"{fold(artist)}|{fold(track_title)}"
+
+
+# -----------  Fuzzy Matching  ----------- #
+
+# Split a key into its character trigrams
+# returns a set of strings
+def trigrams(key):
+    padded = f"  {key} "
+
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Trigram index over canonical keys.  clusters() groups keys whose
+    trigram sets have a Jaccard similarity of at least threshold and that
+    contain the same numbers, so "Part 1" and "Part 2" stay apart.
+    """
+
+    def __init__(self, threshold=DEFAULT_FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self.keys = []
+        self.key_ids = {}
+        self.key_trigrams = []
+        self.postings = {}
+
+    def add(self, key):
+        if key in self.key_ids:
+            return
+
+        key_id = len(self.keys)
+        self.key_ids[key] = key_id
+        self.keys.append(key)
+
+        key_trigrams = trigrams(key)
+        self.key_trigrams.append(key_trigrams)
+
+        for trigram in key_trigrams:
+            self.postings.setdefault(trigram, []).append(key_id)
+
+    def similar(self, key_id):
+        """
+        Yields the ids of the keys similar to key_id.
+        """
+        key_trigrams = self.key_trigrams[key_id]
+        numbers = re.findall(r"\d+", self.keys[key_id])
+        shared_counts = {}
+
+        for trigram in key_trigrams:
+            posting = self.postings[trigram]
+
+            if len(posting) > MAX_TRIGRAM_POSTINGS:
+                continue
+
+            for other_id in posting:
+                if other_id != key_id:
+                    shared_counts[other_id] = shared_counts.get(
+                        other_id, 0) + 1
+
+        for other_id, shared in shared_counts.items():
+            union = len(key_trigrams) + \
+                len(self.key_trigrams[other_id]) - shared
+
+            if shared / union >= self.threshold and re.findall(r"\d+", self.keys[other_id]) == numbers:
+                yield other_id
+
+    def clusters(self):
+        """
+        Returns a list of clusters (lists of keys) with more than one key.
+        """
+        parents = list(range(len(self.keys)))
+
+        def find(key_id):
+            while parents[key_id] != key_id:
+                parents[key_id] = parents[parents[key_id]]
+                key_id = parents[key_id]
+
+            return key_id
+
+        for key_id in range(len(self.keys)):
+            for other_id in self.similar(key_id):
+                root, other_root = find(key_id), find(other_id)
+
+                if root != other_root:
+                    parents[max(root, other_root)] = min(root, other_root)
+
+        groups = {}
+        for key_id, key in enumerate(self.keys):
+            groups.setdefault(find(key_id), []).append(key)
+
+        return [keys for keys in groups.values() if len(keys) > 1]
+
+
+# Cluster the near-duplicate tracks of a collection
+# params: list of track data items
+# returns dict of canonical key -> canonical key of its cluster, for keys in a cluster
+def cluster_track_keys(track_data_list, threshold=DEFAULT_FUZZY_THRESHOLD, pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Every key in a cluster maps to the cluster's first key, so tracks that
+    map to the same key can share one lookup.
+    """
+    index = TrigramIndex(threshold)
+
+    for track_data_item in track_data_list:
+        index.add(canonical_key(track_data_item[2], track_data_item[3], pattern))
+
+    aliases = {}
+    for keys in index.clusters():
+        for key in keys:
+            aliases[key] = keys[0]
+
+    return aliases
+
+
+class StreamingKeyAliases:
+    """
+    Clusters keys as they arrive, for pipelines where the whole
+    collection isn't known up front.  get() maps a key to the cluster key
+    of the first earlier key it is similar to, or to itself.  Every key
+    seen is kept for the rest of the run, so memory grows with the number
+    of unique tracks.
+    """
+
+    def __init__(self, threshold=DEFAULT_FUZZY_THRESHOLD):
+        self.index = TrigramIndex(threshold)
+        self.aliases = {}
+
+    def get(self, key, default=None):
+        if key not in self.aliases:
+            self.index.add(key)
+            similar = sorted(self.index.similar(self.index.key_ids[key]))
+
+            self.aliases[key] = self.aliases[self.index.keys[similar[0]]] if similar else key
+
+        return self.aliases[key]
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# offline release year index built from a local MusicBrainz or Discogs dump.
+
+# the import reads the dump once and keeps the earliest release year of
+# every normalized (artist, title).  the index file is a sorted array of
+# fixed width records (8 byte key hash, 2 byte year) behind a small
+# header, so it is memory-mapped and searched with a binary search
+# without loading it.  building sorts in bounded chunks that are merged at
+# the end, so dumps far larger than memory can be imported.
+
+# usage:
+#   python3 offline_index.py build --musicbrainz ~/mbdump --output output/offline-index.bin
+#   python3 offline_index.py build --discogs ~/discogs_20251001_releases.xml.gz
+#   python3 offline_index.py build --tsv my-years.tsv   (artist<TAB>title<TAB>year)
+#   python3 offline_index.py lookup "Artist" "Track Title"
+
+import argparse
+import csv
+import gzip
+import hashlib
+import heapq
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+
+from xml.etree.ElementTree import iterparse
+
+from termcolor import colored
+
+from lookup_cache import lookup_key
+from normalize import DEFAULT_TITLE_STRIP_PATTERN
+
+
+# bump when the key format changes, older indexes have to be rebuilt
+MAGIC = b"SYIDX002"
+HEADER = struct.Struct("<8sQ")
+RECORD = struct.Struct("<QH")
+
+# keys kept in memory before a sorted chunk is written to disk
+CHUNK_SIZE = 2_000_000
+
+# years outside this range in a dump are treated as bad data
+MIN_YEAR = 1860
+MAX_YEAR = 2100
+
+# backslash escapes of PostgreSQL COPY text dumps
+COPY_ESCAPE = re.compile(r"\\(x[0-9A-Fa-f]{1,2}|[0-7]{1,3}|.)")
+COPY_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Hash the normalized (artist, title) key
+# returns a 64 bit int
+def key_hash(artist, track_title, pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Returns the 64 bit hash of the normalized lookup key.
+    """
+    digest = hashlib.blake2b(lookup_key(artist, track_title, pattern).encode(
+        "utf-8"), digest_size=8).digest()
+
+    return int.from_bytes(digest, "little")
+
+
+# Pull the year out of a dump date
+# returns the year as an int or None
+def parse_dump_year(value):
+    """
+    Reads the year from "1999", "1999-05" or "1999-05-01" style dates.
+    """
+    value = (value or "").strip()
+
+    if len(value) < 4 or not value[:4].isdigit():
+        return None
+
+    year = int(value[:4])
+
+    return year if MIN_YEAR <= year <= MAX_YEAR else None
+
+
+# Decode one field of a PostgreSQL COPY text dump
+# returns the field as a string, or None for \N (NULL)
+def decode_copy_field(value):
+    """
+    COPY escapes tabs, newlines and backslashes in text with a backslash,
+    and may write other characters as octal or hex escapes.
+    """
+    if value == "\\N":
+        return None
+
+    if "\\" not in value:
+        return value
+
+    return COPY_ESCAPE.sub(_decode_copy_escape, value)
+
+
+def _decode_copy_escape(match):
+    escape = match.group(1)
+
+    if escape in COPY_ESCAPES:
+        return COPY_ESCAPES[escape]
+    if escape[0] == "x":
+        return chr(int(escape[1:], 16))
+    if escape[0].isdigit():
+        return chr(int(escape, 8))
+
+    return escape
+
+
+# -----------  Dump Readers  ----------- #
+
+# every reader yields (artist, title, year) tuples
+
+def iter_tsv_dump(tsv_file_path):
+    """
+    Reads an artist<TAB>title<TAB>year file.
+    """
+    with open(tsv_file_path, newline="") as file:
+        for row in csv.reader(file, delimiter="\t"):
+            if len(row) >= 3:
+                year = parse_dump_year(row[2])
+                if year:
+                    yield row[0], row[1], year
+
+
+def iter_musicbrainz_dump(mbdump_dir, temp_dir=None):
+    """
+    Reads the recording, artist_credit and recording_first_release_date
+    tables of an extracted MusicBrainz mbdump directory.  The tables are
+    copied into a temporary sqlite file in temp_dir and joined there, so
+    none of them has to fit in memory.
+    """
+    def table_rows(table, columns):
+        with open(os.path.join(mbdump_dir, table), encoding="utf-8") as file:
+            for line in file:
+                row = line.rstrip("\n").split("\t")
+
+                if len(row) > max(columns):
+                    yield tuple(decode_copy_field(row[column]) for column in columns)
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as join_dir:
+        connection = sqlite3.connect(os.path.join(join_dir, "musicbrainz.sqlite"))
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.executescript("""
+            CREATE TABLE artist_credit (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE first_release (recording INTEGER PRIMARY KEY, year INTEGER);
+            CREATE TABLE recording (name TEXT, artist_credit INTEGER, year INTEGER);
+            """)
+
+        try:
+            print(colored("Reading MusicBrainz artist credits...", color="white"))
+            connection.executemany("INSERT OR REPLACE INTO artist_credit VALUES (?, ?)",
+                                   table_rows("artist_credit", (0, 1)))
+
+            print(colored("Reading MusicBrainz first release dates...", color="white"))
+            connection.executemany("INSERT OR REPLACE INTO first_release VALUES (?, ?)",
+                                   ((recording, int(year)) for recording, year in table_rows(
+                                       "recording_first_release_date", (0, 1))
+                                    if year and year.isdigit() and MIN_YEAR <= int(year) <= MAX_YEAR))
+
+            # the recordings are the biggest table, their year is looked up
+            # as they are copied and recordings without one are left out
+            print(colored("Reading MusicBrainz recordings...", color="white"))
+            connection.executemany(
+                "INSERT INTO recording SELECT ?, ?, year FROM first_release WHERE recording = ?",
+                ((name, artist_credit, recording) for recording, name, artist_credit in table_rows(
+                    "recording", (0, 2, 3)) if name))
+            connection.commit()
+
+            for artist, title, year in connection.execute(
+                    "SELECT artist_credit.name, recording.name, recording.year FROM recording "
+                    "JOIN artist_credit ON artist_credit.id = recording.artist_credit "
+                    "WHERE artist_credit.name IS NOT NULL"):
+                yield artist, title, year
+
+        finally:
+            connection.close()
+
+
+def iter_discogs_dump(releases_xml_file_path):
+    """
+    Streams a Discogs releases xml dump (optionally gzipped).  Every
+    track gets the release date of its release and the track artists, or
+    the release artists when the track has none.
+    """
+    opener = gzip.open if releases_xml_file_path.endswith(
+        ".gz") else open
+
+    with opener(releases_xml_file_path, "rb") as file:
+        releases = None
+
+        for event, release in iterparse(file, events=("start", "end")):
+            if event == "start":
+                if releases is None:
+                    releases = release
+                continue
+
+            if release.tag != "release":
+                continue
+
+            year = parse_dump_year(release.findtext("released"))
+
+            if year:
+                release_artists = [name.text for name in release.findall(
+                    "artists/artist/name") if name.text]
+
+                for track in release.findall("tracklist/track"):
+                    title = track.findtext("title")
+                    track_artists = [name.text for name in track.findall(
+                        "artists/artist/name") if name.text]
+
+                    for artist in (track_artists or release_artists)[:1]:
+                        if title:
+                            yield artist, title, year
+
+            # detach the release from <releases> so memory use stays flat
+            release.clear()
+            if releases is not release:
+                releases.remove(release)
+
+
+# -----------  Build  ----------- #
+
+def _write_chunk(chunk, temp_dir):
+    file_descriptor, chunk_file_path = tempfile.mkstemp(
+        suffix=".chunk", dir=temp_dir)
+
+    with os.fdopen(file_descriptor, "wb") as file:
+        for hash_value in sorted(chunk):
+            file.write(RECORD.pack(hash_value, chunk[hash_value]))
+
+    return chunk_file_path
+
+
+def _iter_chunk(chunk_file_path):
+    with open(chunk_file_path, "rb") as file:
+        while True:
+            data = file.read(RECORD.size * 4096)
+            if not data:
+                return
+
+            yield from RECORD.iter_unpack(data)
+
+
+# Build the index file from (artist, title, year) entries
+# returns the number of keys in the index
+def build_index(entries, index_file_path, chunk_size=CHUNK_SIZE, title_pattern=DEFAULT_TITLE_STRIP_PATTERN):
+    """
+    Keeps the earliest year of every key, built with the title strip
+    rules of title_pattern.  Keys are collected in chunks of chunk_size,
+    each chunk is sorted to a temp file and the chunks are merged into the
+    final index.
+    """
+    temp_dir = tempfile.mkdtemp(
+        dir=os.path.dirname(os.path.abspath(index_file_path)))
+    chunk_file_paths = []
+    chunk = {}
+    entry_count = 0
+
+    try:
+        for artist, title, year in entries:
+            hash_value = key_hash(artist, title, title_pattern)
+            chunk[hash_value] = min(year, chunk.get(hash_value, year))
+            entry_count += 1
+
+            if len(chunk) >= chunk_size:
+                chunk_file_paths.append(_write_chunk(chunk, temp_dir))
+                chunk = {}
+
+        if chunk:
+            chunk_file_paths.append(_write_chunk(chunk, temp_dir))
+
+        print(colored(
+            f"Merging {entry_count} entries from {len(chunk_file_paths)} chunks...", color="white"))
+
+        key_count = 0
+        temp_index_file_path = index_file_path + ".tmp"
+
+        with open(temp_index_file_path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, 0))
+
+            merged = heapq.merge(*(_iter_chunk(path)
+                                 for path in chunk_file_paths))
+            current_hash, current_year = None, None
+
+            for hash_value, year in merged:
+                if hash_value == current_hash:
+                    current_year = min(current_year, year)
+                    continue
+
+                if current_hash is not None:
+                    file.write(RECORD.pack(current_hash, current_year))
+                    key_count += 1
+
+                current_hash, current_year = hash_value, year
+
+            if current_hash is not None:
+                file.write(RECORD.pack(current_hash, current_year))
+                key_count += 1
+
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, key_count))
+
+        os.replace(temp_index_file_path, index_file_path)
+
+    finally:
+        for path in chunk_file_paths:
+            os.remove(path)
+        os.rmdir(temp_dir)
+
+    return key_count
+
+
+# -----------  Lookup  ----------- #
+
+class OfflineIndex:
+    """
+    Memory-mapped release year index.  get() has the same interface as
+    LookupCache.get() so it can sit in a resolver chain.  title_pattern
+    has to match the rules the index was built with.
+    """
+
+    name = "offline"
+
+    def __init__(self, index_file_path, title_pattern=DEFAULT_TITLE_STRIP_PATTERN):
+        self.index_file_path = index_file_path
+        self.title_pattern = title_pattern
+
+        with open(index_file_path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.key_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(
+                f"{index_file_path} is not an offline release year index of this version, rebuild it with offline_index.py build.")
+
+        self.hits = 0
+        self.misses = 0
+        self.latencies = []
+
+    def get(self, artist, track_title_formatted):
+        """
+        Returns the earliest release year as a string, or None.
+        """
+        start = time.perf_counter()
+        target = key_hash(artist, track_title_formatted, self.title_pattern)
+
+        low, high = 0, self.key_count
+        found_year = None
+
+        while low < high:
+            middle = (low + high) // 2
+            hash_value, year = RECORD.unpack_from(
+                self.map, HEADER.size + middle * RECORD.size)
+
+            if hash_value < target:
+                low = middle + 1
+            elif hash_value > target:
+                high = middle
+            else:
+                found_year = str(year)
+                break
+
+        self.latencies.append(time.perf_counter() - start)
+
+        if found_year is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return found_year
+
+    def print_stats(self):
+        lookups = self.hits + self.misses
+
+        if not lookups:
+            return
+
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2] * 1_000_000
+        p99 = latencies[min(len(latencies) - 1,
+                            int(len(latencies) * 0.99))] * 1_000_000
+
+        print(colored(
+            f"Offline index: {self.hits} hits, {self.misses} misses ({self.hits / lookups * 100:.1f}% hit rate), "
+            f"lookup p50 {p50:.1f}µs p99 {p99:.1f}µs.", color="white"))
+
+    def close(self):
+        self.map.close()
+
+
+# -----------  Run  ----------- #
+
+def main():
+    # the index path and title strip rules the app is configured with
+    import app
+
+    default_index_file_path = app.offline_index_file_path
+
+    parser = argparse.ArgumentParser(
+        description="Build or query the offline release year index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser(
+        "build", help="import a dump into a new index")
+    source = build_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--musicbrainz", metavar="MBDUMP_DIR",
+                        help="extracted MusicBrainz mbdump directory")
+    source.add_argument("--discogs", metavar="RELEASES_XML",
+                        help="Discogs releases xml dump (.xml or .xml.gz)")
+    source.add_argument("--tsv", metavar="TSV",
+                        help="artist<TAB>title<TAB>year file")
+    build_parser.add_argument("--output", default=default_index_file_path)
+    build_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    lookup_parser = subparsers.add_parser(
+        "lookup", help="look up a track in the index")
+    lookup_parser.add_argument("artist")
+    lookup_parser.add_argument("title")
+    lookup_parser.add_argument("--index", default=default_index_file_path)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.musicbrainz:
+            entries = iter_musicbrainz_dump(
+                args.musicbrainz, os.path.dirname(os.path.abspath(args.output)))
+        elif args.discogs:
+            entries = iter_discogs_dump(args.discogs)
+        else:
+            entries = iter_tsv_dump(args.tsv)
+
+        start = time.perf_counter()
+        key_count = build_index(entries, args.output, args.chunk_size, app.title_strip_pattern)
+        print(colored(
+            f"Built {args.output} with {key_count} tracks in {time.perf_counter() - start:.1f}s.", color="white"))
+
+    else:
+        index = OfflineIndex(args.index, app.title_strip_pattern)
+        found_year = index.get(args.artist, args.title)
+        print(found_year or "not found")
+        index.print_stats()
+        index.close()
+        sys.exit(0 if found_year else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# streaming reader for the rekordbox.xml collection export.
+
+# rekordbox.xml exports can hold tens of thousands of tracks plus hundreds
+# of MB of playlist, tempo and cue data.  instead of loading the whole file
+# into a DOM, the file is read with iterparse, each <TRACK> in <COLLECTION>
+# is handed out as soon as it has been read and then cleared, and reading
+# stops at the end of <COLLECTION> so <PLAYLISTS> is never parsed.
+
+# the writer streams the export the other way: the file is copied through
+# in chunks and only the Year attribute of each <TRACK> start tag in
+# <COLLECTION> is replaced, so everything else comes out byte for byte and
+# the result can be imported back into rekordbox.
+
+import os
+import re
+import time
+
+from urllib.parse import unquote
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import unescape
+
+from instrumentation import metrics
+
+
+# characters read from the rekordbox.xml at a time by the writer
+XML_WRITE_CHUNK_SIZE = 1024 * 1024
+
+COLLECTION_START = re.compile(r"<COLLECTION\b")
+
+# the next collection <TRACK> start tag or the end of the collection.
+# quoted attribute values may hold a ">"
+COLLECTION_ITEM = re.compile(r"<TRACK\b(?:[^>\"']|\"[^\"]*\"|'[^']*')*>|</COLLECTION\s*>")
+
+# the longest text that can be the unfinished start of a match
+PARTIAL_MATCH_LENGTH = len("</COLLECTION")
+
+LOCATION_ATTRIBUTE = re.compile(r"\sLocation=\"([^\"]*)\"")
+YEAR_ATTRIBUTE = re.compile(r"(\sYear=\")([^\"]*)(\")")
+
+# rekordbox year attributes that count as unset
+UNSET_XML_YEARS = ("", "0")
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Convert a rekordbox Location attribute to a local file path
+# returns the file path string
+def location_to_file_path(location):
+    """
+    Unencodes a rekordbox Location url and strips the localhost prefix.
+    """
+    # the element will be URL encoded, so we first need to unencode using the imported unquote function
+    url_unencoded_file_path = unquote(location)
+
+    # now we can remove the "localhost" in the file path string
+    return url_unencoded_file_path.replace("file://localhost", "")
+
+
+# Check a file path against the music-library dir and the search folders
+# returns True if the track should be processed
+def is_in_search_folders(file_path, search_folders):
+    """
+    Returns True if the file path is in the music-library dir and,
+    when search folders are given, in one of the search folders.
+    """
+    if "music-library" not in file_path:
+        return False
+
+    if search_folders:
+        return any(substring in file_path for substring in search_folders)
+
+    return True
+
+
+# -----------  Streaming Collection Reader  ----------- #
+
+# Stream every <TRACK> entry of the <COLLECTION> node
+# yields a tuple of (file_path, track attributes dict)
+def iter_collection_tracks(rekordbox_xml):
+    """
+    Streams the <TRACK> entries of the rekordbox.xml <COLLECTION> node one
+    at a time.  Processed elements are cleared as we go and parsing stops
+    at the end of the collection, so <PLAYLISTS> is skipped entirely.
+    """
+    collection = None
+
+    for event, element in iterparse(rekordbox_xml, events=("start", "end")):
+        if event == "start":
+            if element.tag == "COLLECTION":
+                collection = element
+            continue
+
+        if collection is None:
+            continue
+
+        if element.tag == "TRACK":
+            attributes = dict(element.attrib)
+            location = attributes.get("Location")
+
+            # drop the <TEMPO> and <POSITION_MARK> children and detach the
+            # track from <COLLECTION> so memory use stays flat
+            element.clear()
+            collection.remove(element)
+
+            if location:
+                yield location_to_file_path(location), attributes
+
+        elif element.tag == "COLLECTION":
+            # everything after the collection is playlist data, stop here
+            break
+
+
+# Stream the file paths in the collection that match our filters
+# yields track file paths in collection order
+def iter_rekordbox_file_paths(rekordbox_xml, search_folders):
+    """
+    Streams the file paths of the tracks in the rekordbox collection that
+    are in the music-library dir and in the specified search folders.
+    """
+    for file_path, _ in iter_collection_tracks(rekordbox_xml):
+        if is_in_search_folders(file_path, search_folders):
+            yield file_path
+
+
+# -----------  Streaming Collection Writer  ----------- #
+
+# Replace the Year attribute of one <TRACK> start tag
+# params: the tag text, and a function of (file_path, current year) that
+# returns the new year or None to leave the track alone
+# returns a tuple of (tag text, True if the year was changed)
+def patch_track_tag(tag, year_for_track):
+    location = LOCATION_ATTRIBUTE.search(tag)
+
+    if location is None:
+        return tag, False
+
+    file_path = location_to_file_path(
+        unescape(location.group(1), {"&quot;": '"', "&apos;": "'"}))
+    year_attribute = YEAR_ATTRIBUTE.search(tag)
+    current_year = year_attribute.group(2) if year_attribute else ""
+
+    year = year_for_track(file_path, current_year)
+
+    if year is None or str(year) == current_year:
+        return tag, False
+
+    if year_attribute:
+        return tag[:year_attribute.start(2)] + str(year) + tag[year_attribute.end(2):], True
+
+    # no Year attribute, add one at the end of the tag
+    end = len(tag) - (2 if tag.endswith("/>") else 1)
+
+    return f"{tag[:end].rstrip()} Year=\"{year}\"{tag[end:]}", True
+
+
+# Stream the rekordbox.xml with the years of the collection tracks replaced
+# yields the text of the updated file in pieces
+def iter_patched_rekordbox_xml(file, year_for_track, stats, chunk_size=XML_WRITE_CHUNK_SIZE):
+    """
+    Reads file chunk_size characters at a time and yields it back with
+    the Year of every <TRACK> in <COLLECTION> set from year_for_track.
+    Only the text since the last match is held, so memory use doesn't
+    grow with the size of the file.  stats counts the "tracks" seen and
+    the "patched" ones.
+    """
+    buffer = ""
+    position = 0
+    in_collection = False
+    end_of_file = False
+
+    while True:
+        if in_collection:
+            match = COLLECTION_ITEM.search(buffer, position)
+        else:
+            match = COLLECTION_START.search(buffer, position)
+
+        # a start tag cut off at the end of the buffer needs the next chunk
+        if match and (match.end() < len(buffer) or end_of_file):
+            yield buffer[position:match.start()]
+            position = match.end()
+
+            if not in_collection:
+                in_collection = True
+                yield match.group()
+
+            elif match.group().startswith("</"):
+                yield match.group()
+                yield buffer[position:]
+
+                # the rest of the file is <PLAYLISTS>, copy it as is
+                while True:
+                    chunk = file.read(chunk_size)
+                    if not chunk:
+                        return
+
+                    yield chunk
+
+            else:
+                start = time.perf_counter()
+                tag, patched = patch_track_tag(match.group(), year_for_track)
+                metrics.record("xml_write", time.perf_counter() - start)
+
+                stats["tracks"] += 1
+                stats["patched"] += patched
+
+                yield tag
+
+            continue
+
+        if end_of_file:
+            yield buffer[position:]
+            return
+
+        # keep what could be the start of a match, or of a track start tag
+        # that runs past the end of the buffer
+        if match:
+            keep_from = match.start()
+        else:
+            keep_from = max(position, len(buffer) - PARTIAL_MATCH_LENGTH)
+            if in_collection:
+                tag_start = buffer.rfind("<TRACK", position)
+                if tag_start >= 0:
+                    keep_from = min(keep_from, tag_start)
+
+        yield buffer[position:keep_from]
+
+        chunk = file.read(chunk_size)
+        end_of_file = not chunk
+        buffer = buffer[keep_from:] + chunk
+        position = 0
+
+
+# Write a copy of the rekordbox.xml with the years of the collection tracks replaced
+# returns dict with the number of "tracks" in the collection and "patched" tracks
+def write_patched_rekordbox_xml(rekordbox_xml, output_xml, year_for_track, chunk_size=XML_WRITE_CHUNK_SIZE):
+    """
+    Streams rekordbox_xml to output_xml in one pass, setting the Year of
+    every collection <TRACK> for which year_for_track(file_path,
+    current_year) returns a year.  The copy is written next to output_xml
+    and renamed over it when done, so an interrupted run leaves no half
+    written file.  The audio files are never touched.
+    """
+    stats = {"tracks": 0, "patched": 0}
+    temp_file_path = output_xml + ".tmp"
+
+    # newline="" keeps the line endings of the export as they are
+    with open(rekordbox_xml, encoding="utf-8", newline="") as file, \
+            open(temp_file_path, "w", encoding="utf-8", newline="") as output_file:
+        for text in iter_patched_rekordbox_xml(file, year_for_track, stats, chunk_size):
+            output_file.write(text)
+
+    os.replace(temp_file_path, output_xml)
+
+    return stats
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# batched, crash safe writer of lookup results.
+
+# track-years.csv used to get a flush and a journal write for every row,
+# and nothing was ever fsynced.  ResultsWriter takes rows from any number
+# of threads, formats them into a buffer and appends the buffer to the csv
+# file with a single write once batch_size rows are waiting, or with the
+# next row once the oldest of them is FLUSH_INTERVAL seconds old.  every
+# fsync_interval seconds and on close the file is fsynced, and only then
+# are the Locations of the rows it synced appended to the processed
+# journal, which is fsynced in turn.  so a Location is only ever journaled
+# once its row is on disk, even after a power loss, and a crash costs at
+# most the rows of the last interval a second lookup.  a row is never
+# split between two writes, and a write the os only got partly to disk
+# before a crash is cut off by repair_torn_tail when the file is opened
+# again.
+
+# rows come in completion order.  compact() rewrites the finished file
+# with one row per Location, the last one written, sorted by Location.
+
+# benchmarks/bench_results_writer.py compares it with the per row writer.
+
+import csv
+import io
+import os
+import threading
+import time
+
+from checkpoint import ProcessedJournal, repair_torn_tail
+
+
+# age in seconds at which a batch that isn't full yet is written with the
+# next row
+FLUSH_INTERVAL = 1.0
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Write all of data to a file descriptor
+def write_all(file_descriptor, data):
+    view = memoryview(data)
+
+    while view:
+        view = view[os.write(file_descriptor, view):]
+
+
+# Rewrite a csv file with one row per Location, sorted by Location
+# the last row written for a Location wins
+# returns a tuple of (rows kept, duplicate rows dropped)
+def compact_csv(csv_file_path):
+    """
+    Writes the compacted rows to a temp file, fsyncs it and renames it
+    over the csv file, so the file is either the old or the new one.  The
+    header line is kept as it is.
+    """
+    rows = {}
+    row_count = 0
+
+    with open(csv_file_path) as file:
+        header = file.readline()
+
+        for row in csv.reader(file):
+            if row:
+                rows[row[0]] = row
+                row_count += 1
+
+    temp_file_path = csv_file_path + ".compacting"
+
+    with open(temp_file_path, "w") as file:
+        file.write(header)
+        csv.writer(file, quoting=csv.QUOTE_ALL).writerows(
+            rows[location] for location in sorted(rows))
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_file_path, csv_file_path)
+
+    return len(rows), row_count - len(rows)
+
+
+# -----------  Results Writer  ----------- #
+
+class ResultsWriter:
+    """
+    Appends result rows to a csv file and their Locations to a processed
+    journal in batches, journaling rows once they are fsynced.  fresh=True
+    starts both files over and writes header, otherwise a partly written
+    last row is cut off first.  fsync_interval=None only fsyncs, and
+    journals, on close.  write() may be called from several threads.
+    """
+
+    def __init__(self, csv_file_path, journal_file_path, fresh=False, header=None,
+                 batch_size=256, fsync_interval=5.0):
+        self.csv_file_path = csv_file_path
+        self.batch_size = max(1, batch_size)
+        self.fsync_interval = fsync_interval
+        self.rows_written = 0
+        self.batches_written = 0
+        self.syncs = 0
+
+        if not fresh and os.path.exists(csv_file_path):
+            self.repaired = repair_torn_tail(csv_file_path)
+        else:
+            self.repaired = False
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if fresh:
+            flags |= os.O_TRUNC
+
+        self.file_descriptor = os.open(csv_file_path, flags, 0o644)
+        self.journal = ProcessedJournal(journal_file_path, fresh=fresh)
+
+        if header and (fresh or os.fstat(self.file_descriptor).st_size == 0):
+            write_all(self.file_descriptor, header.encode("utf-8"))
+
+        self.lock = threading.Lock()
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, quoting=csv.QUOTE_ALL)
+        self.locations = []
+        self.unsynced_locations = []
+        self.buffered_at = None
+        self.synced_at = time.monotonic()
+
+    def write(self, row):
+        """
+        Buffers a row, writing the batch when it is full or old enough.
+        """
+        with self.lock:
+            self.writer.writerow(row)
+            self.locations.append(row[0])
+
+            if self.buffered_at is None:
+                self.buffered_at = time.monotonic()
+
+            if len(self.locations) >= self.batch_size or \
+                    time.monotonic() - self.buffered_at >= FLUSH_INTERVAL:
+                self._flush()
+
+    def flush(self, sync=False):
+        """
+        Writes the buffered rows, fsyncing with sync=True.
+        """
+        with self.lock:
+            self._flush(sync)
+
+    def _flush(self, sync=False):
+        if self.locations:
+            write_all(self.file_descriptor, self.buffer.getvalue().encode("utf-8"))
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+            self.unsynced_locations += self.locations
+            self.rows_written += len(self.locations)
+            self.batches_written += 1
+            self.locations = []
+            self.buffered_at = None
+
+        if sync or (self.fsync_interval is not None and
+                    time.monotonic() - self.synced_at >= self.fsync_interval):
+            os.fsync(self.file_descriptor)
+
+            # only journaled once the rows are on disk
+            if self.unsynced_locations:
+                self.journal.append_many(self.unsynced_locations)
+                self.journal.sync()
+                self.unsynced_locations = []
+
+            self.synced_at = time.monotonic()
+            self.syncs += 1
+
+    def close(self):
+        self.flush(sync=True)
+        os.close(self.file_descriptor)
+        self.journal.close()
+
+    def compact(self):
+        """
+        Compacts the finished csv file, see compact_csv.  Call after close.
+        """
+        return compact_csv(self.csv_file_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# incremental collection sync.
+
+# a new rekordbox.xml export with a few hundred new tracks shouldn't mean
+# redoing the whole library.  the state of every processed track
+# (Location, rekordbox TrackID, file size and mtime) is kept in
+# track-state.csv.  the current export is diffed against it so only added
+# or modified tracks are extracted and looked up, and deleted tracks are
+# pruned from the track store.  a scanned library is diffed the same way,
+# with an empty TrackID.
+
+import csv
+import os
+import time
+
+from termcolor import colored
+
+from rekordbox import is_in_search_folders, iter_collection_tracks
+
+
+TRACK_STATE_HEADER = "Location, TrackID, Size, Mtime\n"
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Get the size and mtime of a file
+# returns a tuple of (size, mtime) strings, ("-1", "-1") if the file is missing
+def file_signature(file_path):
+    """
+    Returns the size and modification time of a file as strings.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return "-1", "-1"
+
+    return str(stat.st_size), str(stat.st_mtime_ns)
+
+
+# Read the stored track state
+# returns dict of Location -> (TrackID, size, mtime)
+def load_track_state(track_state_csv_file_path):
+    """
+    Reads track-state.csv.  Returns an empty dict if it doesn't exist.
+    """
+    if not os.path.exists(track_state_csv_file_path):
+        return {}
+
+    with open(track_state_csv_file_path) as file:
+        reader = csv.reader(file)
+        next(reader, None)
+
+        return {row[0]: tuple(row[1:4]) for row in reader if row}
+
+
+# Read the current track state from the rekordbox.xml and the file system
+# returns dict of Location -> (TrackID, size, mtime)
+def scan_collection_state(rekordbox_xml_file_path, search_folders):
+    """
+    Streams the rekordbox collection and stats every track that passes
+    the music-library and search folder filters.
+    """
+    print(colored("Reading collection state from rekordbox.xml...", color="white"))
+
+    current_state = {}
+
+    for file_path, attributes in iter_collection_tracks(rekordbox_xml_file_path):
+        if is_in_search_folders(file_path, search_folders):
+            current_state[file_path] = (
+                attributes.get("TrackID", ""),) + file_signature(file_path)
+
+    return current_state
+
+
+# Compare the stored and the current track state
+# returns a tuple of sorted lists (added, modified, deleted) of Locations
+def diff_track_state(stored_state, current_state):
+    """
+    Tracks are added if they aren't in the stored state, modified if their
+    TrackID, size or mtime changed and deleted if they are no longer in
+    the collection.
+    """
+    added = sorted(
+        location for location in current_state if location not in stored_state)
+    modified = sorted(location for location, signature in current_state.items()
+                      if location in stored_state and stored_state[location] != signature)
+    deleted = sorted(
+        location for location in stored_state if location not in current_state)
+
+    return added, modified, deleted
+
+
+# Leave out the files that changed too recently to be done copying
+# returns the current state with every file modified in the last
+# settle_seconds at its stored state, or left out if it is new
+def hold_back_unsettled(current_state, stored_state, settle_seconds):
+    """
+    A file still being copied into the library would be read half
+    written.  It is picked up by a later sync once it has settled.
+    """
+    settled_before = (time.time() - settle_seconds) * 1_000_000_000
+    settled_state = {}
+
+    for location, signature in current_state.items():
+        if int(signature[2]) <= settled_before:
+            settled_state[location] = signature
+        elif location in stored_state:
+            settled_state[location] = stored_state[location]
+
+    return settled_state
+
+
+# Write the track state
+def write_track_state(track_state_csv_file_path, state):
+    """
+    Writes the track state to track-state.csv, sorted by Location.
+    """
+    write_rows_to_csv(track_state_csv_file_path, TRACK_STATE_HEADER,
+                      [[location] + list(signature) for location, signature in sorted(state.items())])
+
+
+# Write rows to a csv file with a header, through a temp file
+def write_rows_to_csv(csv_file_path, header, rows):
+    """
+    Writes the header and rows to a temp file and moves it into place,
+    so an interrupted write can't leave a truncated file behind.
+    """
+    temp_file_path = csv_file_path + ".tmp"
+
+    with open(temp_file_path, "w") as file:
+        file.write(header)
+        writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+        writer.writerows(rows)
+
+    os.replace(temp_file_path, csv_file_path)
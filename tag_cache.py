@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# persistent cache of the tags read from audio files.
+
+# every run used to open every audio file again to read its title, artist
+# and year, though nearly all of a library is unchanged between exports.
+# the tags of every file read are stored in a sqlite file keyed by its
+# path, size and mtime, so an unchanged file costs one stat.  with
+# content hashing turned on a partial hash of the file (its size, its
+# first and last 64KB and the part of the file that holds its tags) is
+# stored too, so a file that was moved or renamed is still recognized by
+# its content.  files whose tags can't be found without parsing them are
+# read once to confirm the match.
+
+# usage:
+#   python3 tag_cache.py
+#   python3 tag_cache.py --verify [--sample 500] [--prune]
+#   python3 tag_cache.py --clear
+
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import struct
+import time
+
+from datetime import datetime
+
+from termcolor import colored
+
+
+# bytes hashed from the start and from the end of a file
+CONTENT_HASH_BLOCK_SIZE = 64 * 1024
+
+# the biggest tag region hashed, files with bigger ones are read to
+# confirm a match
+MAX_TAG_REGION_SIZE = 16 * 1024 * 1024
+
+# bump when the content hash changes, so old hashes never match
+CONTENT_HASH_VERSION = b"2"
+
+# puts written per transaction
+COMMIT_EVERY = 500
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Read the title, artist and year tags of an audio file
+# returns a tuple of (title, artist, year) strings, year "None" when unset
+def read_tags(file_path):
+    """
+    Reads the tags with tinytag and formats the year to 4 digits.
+    """
+    from tinytag import TinyTag
+
+    tag: TinyTag = TinyTag.get(file_path)
+
+    # format existing year to 4 digits
+    if tag.year == None:
+        year = tag.year
+
+    else:
+        if len(tag.year) == 4:
+            year = tag.year
+
+        elif len(tag.year) == 10:
+            dt = datetime.strptime(tag.year, "%Y-%m-%d")
+            year = dt.year
+
+        else:
+            dt = datetime.strptime(tag.year, "%Y-%m-%dT%H:%M:%SZ")
+            year = dt.year
+
+    return str(tag.title), str(tag.artist), str(year)
+
+
+# Get the size and mtime of a file
+# returns a tuple of (size, mtime in ns) or None if the file is missing
+def file_signature(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Find the part of an audio file that holds its tags
+# returns a tuple of (offset, length), or None when the format isn't known
+# or the region is too big
+def tag_region(file, size):
+    """
+    Knows ID3v2 tags at the start of a file (mp3, aac), the metadata
+    blocks of flac files and the moov atom of mp4 / m4a files, which can
+    sit anywhere in the file.
+    """
+    header = file.read(10)
+    region = None
+
+    if header[:3] == b"ID3" and len(header) == 10:
+        # syncsafe size, without the header and the footer
+        tag_size = 0
+        for byte in header[6:10]:
+            tag_size = tag_size << 7 | byte & 0x7F
+
+        region = (0, 10 + tag_size + (10 if header[5] & 0x10 else 0))
+
+    elif header[:4] == b"fLaC":
+        offset = 4
+        while offset < size:
+            file.seek(offset)
+            block_header = file.read(4)
+            if len(block_header) < 4:
+                break
+
+            offset += 4 + int.from_bytes(block_header[1:4], "big")
+            if block_header[0] & 0x80:
+                break
+
+        region = (0, offset)
+
+    elif header[4:8] == b"ftyp":
+        offset = 0
+        while offset + 8 <= size:
+            file.seek(offset)
+            atom_size, atom_type = struct.unpack(">I4s", file.read(8))
+
+            if atom_size == 1:
+                atom_size = struct.unpack(">Q", file.read(8))[0]
+            elif atom_size == 0:
+                atom_size = size - offset
+
+            if atom_type == b"moov":
+                region = (offset, atom_size)
+                break
+            if atom_size < 8:
+                break
+
+            offset += atom_size
+
+    if region is None or region[1] > MAX_TAG_REGION_SIZE:
+        return None
+
+    return region
+
+
+# Hash the size, the first and last blocks and the tag region of a file
+# returns a tuple of (hex digest, True if the tag region was hashed)
+def partial_content_hash(file_path, size):
+    """
+    Cheap stand-in for a hash of the whole file: audio files that share
+    their size, start, end and tags are the same recording with the same
+    tags.  The first and last blocks alone can miss tags that sit in the
+    middle of the file, like the moov atom of an mp4.
+    """
+    digest = hashlib.blake2b(CONTENT_HASH_VERSION + str(size).encode(), digest_size=16)
+
+    with open(file_path, "rb") as file:
+        region = tag_region(file, size)
+
+        file.seek(0)
+        digest.update(file.read(CONTENT_HASH_BLOCK_SIZE))
+
+        if size > CONTENT_HASH_BLOCK_SIZE:
+            file.seek(max(CONTENT_HASH_BLOCK_SIZE, size - CONTENT_HASH_BLOCK_SIZE))
+            digest.update(file.read(CONTENT_HASH_BLOCK_SIZE))
+
+        if region is not None:
+            file.seek(region[0])
+            digest.update(file.read(region[1]))
+
+    return digest.hexdigest(), region is not None
+
+
+# -----------  Tag Cache  ----------- #
+
+class TagCache:
+    """
+    SQLite backed cache of (title, artist, year) tags by file path.  An
+    entry whose size or mtime no longer matches the file is a miss.  With
+    use_content_hash=True a path miss is matched by content as well, and
+    counts as a hit for a moved file.
+    """
+
+    name = "tag_cache"
+
+    def __init__(self, cache_file_path, use_content_hash=False):
+        self.cache_file_path = cache_file_path
+        self.use_content_hash = use_content_hash
+        self.hits = 0
+        self.misses = 0
+        self.moved = 0
+        self.uncommitted = 0
+
+        self.connection = sqlite3.connect(cache_file_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tags (
+                file_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                title TEXT,
+                artist TEXT,
+                year TEXT,
+                read_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tags_content_hash ON tags (content_hash);
+            """)
+        self.connection.commit()
+
+    def get(self, file_path):
+        """
+        Returns the cached (title, artist, year) of an unchanged file or
+        None on a miss.
+        """
+        signature = file_signature(file_path)
+
+        if signature is None:
+            self.misses += 1
+            return None
+
+        row = self.connection.execute(
+            "SELECT title, artist, year FROM tags WHERE file_path = ? AND size = ? AND mtime_ns = ?",
+            (file_path,) + signature).fetchone()
+
+        if row is None and self.use_content_hash:
+            row = self.get_moved(file_path, signature)
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return tuple(row)
+
+    def get_moved(self, file_path, signature):
+        """
+        Looks a file up by its content hash and, on a match, moves its
+        entry to the new path.  A file whose tag region wasn't hashed is
+        read to confirm the match.  Returns the tags or None.
+        """
+        try:
+            content_hash, tags_hashed = partial_content_hash(file_path, signature[0])
+        except OSError:
+            return None
+
+        row = self.connection.execute(
+            "SELECT file_path, title, artist, year FROM tags WHERE content_hash = ? AND size = ? LIMIT 1",
+            (content_hash, signature[0])).fetchone()
+
+        if row is None:
+            return None
+
+        old_file_path, tags = row[0], tuple(row[1:])
+
+        if not tags_hashed:
+            try:
+                if read_tags(file_path) != tags:
+                    return None
+            except Exception:
+                return None
+
+        self.moved += 1
+        self._store(file_path, signature, content_hash, *tags)
+
+        # a copy keeps the entry of the original
+        if old_file_path != file_path and not os.path.exists(old_file_path):
+            self.connection.execute("DELETE FROM tags WHERE file_path = ?", (old_file_path,))
+
+        return tags
+
+    def put(self, file_path, title, artist, year):
+        """
+        Stores the tags just read from a file.
+        """
+        signature = file_signature(file_path)
+
+        if signature is None:
+            return
+
+        content_hash = None
+        if self.use_content_hash:
+            try:
+                content_hash = partial_content_hash(file_path, signature[0])[0]
+            except OSError:
+                pass
+
+        self._store(file_path, signature, content_hash, title, artist, year)
+
+    def _store(self, file_path, signature, content_hash, title, artist, year):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (file_path,) + signature + (content_hash, title, artist, year, time.time()))
+
+        # commit in batches, a fresh run puts every file of the library
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def verify(self, read_tags_func=read_tags, sample=None, prune=False, progress=True):
+        """
+        Checks cached entries against the files: "missing" files are gone,
+        "changed" ones have a new size or mtime and would be read again,
+        "mismatched" ones are unchanged but their tags read differently now
+        and "ok" ones match.  sample checks that many random entries
+        instead of all of them, and prune deletes every entry that isn't
+        ok.  Returns dict of result -> number of entries.
+        """
+        from tqdm import tqdm
+
+        rows = self.connection.execute(
+            "SELECT file_path, size, mtime_ns, title, artist, year FROM tags").fetchall()
+
+        if sample is not None and sample < len(rows):
+            rows = random.sample(rows, sample)
+
+        results = {"ok": 0, "changed": 0, "missing": 0, "mismatched": 0}
+        stale = []
+
+        for file_path, size, mtime_ns, title, artist, year in tqdm(
+                rows, desc="Verifying tag cache", unit="file", disable=not progress):
+            signature = file_signature(file_path)
+
+            if signature is None:
+                result = "missing"
+            elif signature != (size, mtime_ns):
+                result = "changed"
+            else:
+                try:
+                    result = "ok" if read_tags_func(file_path) == (title, artist, year) else "mismatched"
+                except Exception:
+                    result = "mismatched"
+
+            results[result] += 1
+            if result != "ok":
+                stale.append(file_path)
+
+        if prune and stale:
+            self.connection.executemany(
+                "DELETE FROM tags WHERE file_path = ?", [(file_path,) for file_path in stale])
+            self.connection.commit()
+
+        return results
+
+    def clear(self):
+        self.connection.execute("DELETE FROM tags")
+        self.connection.commit()
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+
+    def print_stats(self):
+        moved = f", {self.moved} of them moved files matched by content" if self.use_content_hash else ""
+
+        print(colored(
+            f"Tag cache: {self.hits} unchanged files skipped{moved}, {self.misses} read.", color="white"))
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+# -----------  Run  ----------- #
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect, verify or clear the tag cache.")
+    parser.add_argument("--cache-file", default=os.path.dirname(
+        os.path.abspath(__file__)) + "/output/tag-cache.sqlite")
+    parser.add_argument("--verify", action="store_true",
+                        help="read the tags of the cached files again and compare them to the cache")
+    parser.add_argument("--sample", type=int, metavar="N",
+                        help="only verify N random entries")
+    parser.add_argument("--prune", action="store_true",
+                        help="with --verify, delete the entries that don't match their file")
+    parser.add_argument("--clear", action="store_true",
+                        help="delete every entry")
+    args = parser.parse_args()
+
+    cache = TagCache(args.cache_file)
+
+    if args.clear:
+        cache.clear()
+        print(colored("Cleared the tag cache.", color="white"))
+
+    if args.verify:
+        results = cache.verify(sample=args.sample, prune=args.prune)
+        pruned = " and pruned" if args.prune else ""
+
+        print(colored(
+            f"{results['ok']} ok, {results['changed']} changed, {results['missing']} missing, "
+            f"{results['mismatched']} with different tags{pruned}.", color="white"))
+
+    print(colored(f"{cache.count()} cached files in {args.cache_file}", color="white"))
+    cache.close()
+
+    # a cache that doesn't match its files fails the check
+    if args.verify and not args.prune and results["mismatched"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
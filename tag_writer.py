@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# release year tag writer.
+
+# each file is opened once with mutagen's easy interface, which detects
+# the format from the same handle and maps "date" to the ID3 TDRC frame
+# for mp3 and to the ©day atom for mp4.  files are written across a
+# bounded pool of threads.  with atomic=True the tags are written to a
+# copy of the file next to it which is then renamed over the original, so
+# an interrupted run can't leave a half written audio file behind.
+
+import os
+import shutil
+import tempfile
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from termcolor import colored
+
+from instrumentation import metrics
+
+
+# formats we know how to write a year to
+SUPPORTED_MIME_TYPES = ["audio/mp3", "audio/mp4"]
+
+# statuses of a write result
+WRITTEN = "written"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Set the year on an open mutagen easy file and save it
+# returns the mime type of the file or None if the format isn't supported
+def _set_year_on_file(file_path, year, dry_run):
+    from mutagen import File
+
+    audio = File(file_path, easy=True)
+
+    if audio is None:
+        return None
+
+    mime_type = audio.mime[0]
+    if mime_type not in SUPPORTED_MIME_TYPES:
+        return mime_type
+
+    if not dry_run:
+        if audio.tags is None:
+            audio.add_tags()
+
+        audio["date"] = year
+        audio.save()
+
+    return mime_type
+
+
+# Write the year tag of one audio file
+# returns a tuple of (file_path, year, status, message)
+def write_year(file_path, year, dry_run=False, atomic=False):
+    """
+    Opens the file once, detects its format and writes the year.  Never
+    raises: errors come back as a "failed" result.
+    """
+    if not os.path.exists(file_path):
+        return file_path, year, SKIPPED, "file doesn't exist"
+
+    temp_file_path = None
+
+    try:
+        target_file_path = file_path
+
+        if atomic and not dry_run:
+            # work on a copy in the same dir so the rename is atomic. the copy
+            # keeps the extension, which mutagen uses to detect the format
+            directory, name = os.path.split(file_path)
+            extension = os.path.splitext(name)[1]
+            file_descriptor, temp_file_path = tempfile.mkstemp(
+                prefix=f".{name}.", suffix=f".tmp{extension}", dir=directory)
+            os.close(file_descriptor)
+            shutil.copy2(file_path, temp_file_path)
+            target_file_path = temp_file_path
+
+        mime_type = _set_year_on_file(target_file_path, year, dry_run)
+
+        if mime_type is None:
+            return file_path, year, SKIPPED, "unknown format"
+
+        if mime_type not in SUPPORTED_MIME_TYPES:
+            return file_path, year, SKIPPED, f"\"{mime_type}\" format isn't supported"
+
+        if temp_file_path:
+            os.replace(temp_file_path, file_path)
+            temp_file_path = None
+
+        if dry_run:
+            return file_path, year, WRITTEN, f"would write \"{year}\" ({mime_type}, dry run)"
+
+        return file_path, year, WRITTEN, f"wrote \"{year}\" ({mime_type})"
+
+    except Exception as error:
+        return file_path, year, FAILED, f"{type(error).__name__}: {error}"
+
+    finally:
+        if temp_file_path and os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+
+# Write the year tag of one audio file and record it in the run metrics
+# returns a tuple of (file_path, year, status, message)
+def _timed_write_year(file_path, year, dry_run, atomic):
+    start = time.perf_counter()
+    result = write_year(file_path, year, dry_run, atomic)
+    metrics.record("tag_write", time.perf_counter() - start,
+                   error=result[2] == FAILED)
+
+    return result
+
+
+# -----------  Concurrent Writer  ----------- #
+
+# Write years to many files across a bounded thread pool
+# params: iterable of (file_path, year) tuples
+# yields a tuple of (file_path, year, status, message) per file as each finishes
+def iter_written_years(tracks, workers=8, dry_run=False, atomic=False):
+    """
+    Streams write results.  At most workers * 2 files are in flight.
+    """
+    track_iter = iter(tracks)
+    max_in_flight = max(1, workers) * 2
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        in_flight = deque()
+
+        def submit_next():
+            track = next(track_iter, None)
+            if track is None:
+                return False
+
+            file_path, year = track
+            in_flight.append(executor.submit(
+                _timed_write_year, file_path, year, dry_run, atomic))
+            return True
+
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            result = in_flight.popleft().result()
+            submit_next()
+
+            yield result
+
+
+# Write years to many files with a progress bar
+# returns dict of status -> list of results
+def write_years(tracks, workers=8, dry_run=False, atomic=False, on_result=None, progress=True):
+    """
+    Writes the year of every (file_path, year) track and returns the
+    results grouped by status.  on_result is called with every result.
+    """
+    from tqdm import tqdm
+
+    results = {WRITTEN: [], SKIPPED: [], FAILED: []}
+    total = len(tracks) if hasattr(tracks, "__len__") else None
+
+    with tqdm(total=total, desc="Writing tags", unit="track", disable=not progress) as progress_bar:
+        for result in iter_written_years(tracks, workers, dry_run, atomic):
+            file_path, _, status, message = result
+            results[status].append(result)
+
+            if status != WRITTEN:
+                progress_bar.write(colored(
+                    f"==> {status.capitalize()} {file_path}: {message}", color="magenta"))
+
+            if on_result:
+                on_result(result)
+
+            progress_bar.update(1)
+
+    verb = "Would write" if dry_run else "Wrote"
+    print(colored(
+        f"{verb} {len(results[WRITTEN])} tags, skipped {len(results[SKIPPED])}, {len(results[FAILED])} failed.", color="white"))
+
+    return results
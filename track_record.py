@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# compact track record.
+
+# a track data item used to be a plain list of 5 to 7 strings, and whole
+# libraries are held as lists of them.  TrackRecord keeps the same fields
+# in __slots__ instead: artists are interned, a formatted title equal to
+# the title shares its string, and years are ints shared between records
+# instead of "1999" / "None" / "0" strings.  it still behaves like the old
+# list (item[4], item[5:] = [...], csv.writer(...).writerow(item), len),
+# reading years back as the same strings, so the code indexing track data
+# items doesn't change.  benchmarks/bench_track_memory.py measures the
+# saving.
+
+import sys
+
+
+# the fields of a track data item, in column order
+FIELDS = ("file_path", "track_title", "artist", "track_title_formatted",
+          "year", "found_year", "confidence")
+
+YEAR_FIELDS = (4, 5)
+
+# one int object per distinct year, shared by every record
+_years = {}
+
+
+# -----------  Helper Function Defs  ----------- #
+
+# Convert a year column to its compact form
+# returns a shared int, None for "None", or the string if it isn't a plain number
+def pack_year(value):
+    if value is None or value == "None":
+        return None
+
+    if isinstance(value, int):
+        return _years.setdefault(value, value)
+
+    value = str(value)
+
+    # "0999" or "1999-05" would not come back the same from an int
+    if value.isdigit() and str(int(value)) == value:
+        year = int(value)
+        return _years.setdefault(year, year)
+
+    return value
+
+
+# Intern an artist so every record of the artist shares one string
+def intern_artist(artist):
+    return sys.intern(artist) if type(artist) is str else artist
+
+
+# Convert a compact year back to its column string
+def unpack_year(value):
+    return "None" if value is None else str(value)
+
+
+# -----------  Track Record  ----------- #
+
+class TrackRecord:
+    """
+    [file_path, track_title, artist, track_title_formatted, year,
+    found_year, confidence] with list-style access.  found_year is None
+    until the track has been looked up and confidence None without a
+    score; the record is 5 long until then, 6 with a found year and 7
+    with a confidence.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, file_path, track_title, artist, track_title_formatted, year,
+                 found_year=None, confidence=None):
+        self.file_path = file_path
+        self.track_title = track_title
+        self.artist = intern_artist(artist)
+        self.track_title_formatted = track_title if track_title_formatted == track_title \
+            else track_title_formatted
+        self.year = pack_year(year)
+        self.found_year = None
+        self.confidence = None
+
+        if found_year is not None:
+            self[5:] = [found_year, confidence]
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Makes a record from a tracks.csv, track-years.csv or track store
+        row.  An empty confidence cell is no confidence.
+        """
+        row = list(row)
+        confidence = row[6] if len(row) > 6 and row[6] not in (None, "") else None
+
+        return cls(*row[:5], row[5] if len(row) > 5 else None,
+                   float(confidence) if confidence is not None else None)
+
+    def __len__(self):
+        if self.confidence is not None:
+            return 7
+
+        return 6 if self.found_year is not None else 5
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError("track record index out of range")
+
+        value = getattr(self, FIELDS[index])
+
+        return unpack_year(value) if index in YEAR_FIELDS else value
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            # only the found year and confidence columns can be replaced
+            # as a slice, which is how a lookup result is set
+            if index != slice(5, None, None) or len(value) > 2:
+                raise TypeError("only track record slice [5:] can be set")
+
+            value = list(value) + [None] * (2 - len(value))
+            self.found_year = pack_year(value[0]) if value[0] is not None else None
+            self.confidence = float(value[1]) if value[1] not in (None, "") else None
+            return
+
+        if index < 0:
+            index += len(self)
+
+        if index == 2:
+            value = intern_artist(value)
+        elif index in YEAR_FIELDS:
+            value = pack_year(value)
+
+        setattr(self, FIELDS[index], value)
+
+    def __iter__(self):
+        # csv.writer iterates every record it writes, so the row is built
+        # here instead of going through __getitem__ field by field
+        values = [self.file_path, self.track_title, self.artist,
+                  self.track_title_formatted, unpack_year(self.year)]
+
+        if self.confidence is not None:
+            values += [unpack_year(self.found_year), self.confidence]
+        elif self.found_year is not None:
+            values.append(unpack_year(self.found_year))
+
+        return iter(values)
+
+    def __eq__(self, other):
+        if isinstance(other, (TrackRecord, list, tuple)):
+            return list(self) == list(other)
+
+        return NotImplemented
+
+    def __repr__(self):
+        return f"TrackRecord({list(self)!r})"
+
+    def __getstate__(self):
+        # records go through pickle when tags are read in worker processes
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    def __setstate__(self, state):
+        for field, value in zip(FIELDS, state):
+            setattr(self, field, value)
+
+        # share the artist and years with the records of this process
+        self.artist = intern_artist(self.artist)
+        self.year = pack_year(self.year)
+        if self.found_year is not None:
+            self.found_year = pack_year(self.found_year)
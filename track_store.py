@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# indexed track store.
+
+# fix missing years and write tags used to re-parse track-years.csv and
+# rewrite the whole file to change a single row.  the track data now lives
+# in a sqlite table indexed on Location, tagged year and found year, rows
+# are updated one at a time and the "missing" and "differing" track lists
+# are indexed selects.  track-years.csv can still be imported and exported
+# for compatibility.  every found year has the confidence score of the
+# consensus it came from, so tags are only written for confident years and
+# the rest can be looked up again.
+
+# usage:
+#   python3 track_store.py --import-csv output/track-years.csv
+#   python3 track_store.py --export-csv output/track-years.csv
+
+import argparse
+import csv
+import os
+import sqlite3
+
+from termcolor import colored
+
+from track_record import TrackRecord
+
+
+TRACK_YEARS_CSV_HEADER = "Location, Track Title, Artist, Track Title Formatted, Year, Possible Year, Confidence\n"
+
+# tagged years that count as unset
+UNSET_YEARS = ("0", "None")
+
+# rows with a found year to write, with a confidence of at least the
+# second parameter if it isn't NULL
+FOUND_YEAR_WHERE = "found_year IS NOT NULL AND found_year != '0' AND (? IS NULL OR confidence >= ?)"
+UNSET_YEAR_WHERE = "year IN (?, ?) AND " + FOUND_YEAR_WHERE
+DIFFERING_YEAR_WHERE = "(year IS NULL OR year != found_year) AND " + FOUND_YEAR_WHERE
+
+
+# -----------  Track Store  ----------- #
+
+class TrackStore:
+    """
+    SQLite backed store of track data items.  Rows are returned in the
+    track data item layout:
+    [file_path, track_title, artist, track_title_formatted, year, found_year, confidence]
+    found_year is None for tracks that haven't been looked up yet, and
+    confidence is None for tracks looked up before confidence scores.
+    """
+
+    def __init__(self, store_file_path):
+        self.store_file_path = store_file_path
+
+        self.connection = sqlite3.connect(store_file_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                location TEXT PRIMARY KEY,
+                title TEXT,
+                artist TEXT,
+                title_formatted TEXT,
+                year TEXT,
+                found_year TEXT,
+                confidence REAL
+            );
+            CREATE INDEX IF NOT EXISTS tracks_found_year ON tracks (found_year);
+            CREATE INDEX IF NOT EXISTS tracks_year ON tracks (year);
+            """)
+
+        # stores made before confidence scores get the column
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(tracks)")]
+        if "confidence" not in columns:
+            self.connection.execute("ALTER TABLE tracks ADD COLUMN confidence REAL")
+
+        self.connection.commit()
+
+    # -----------  Reads  ----------- #
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def get(self, location):
+        """
+        Returns the row for a Location or None.
+        """
+        row = self.connection.execute(
+            "SELECT * FROM tracks WHERE location = ?", (location,)).fetchone()
+
+        return TrackRecord.from_row(row) if row else None
+
+    def all_tracks(self):
+        """
+        Returns every row, ordered by Location.
+        """
+        return [TrackRecord.from_row(row) for row in self.connection.execute("SELECT * FROM tracks ORDER BY location")]
+
+    def locations(self):
+        return set(row[0] for row in self.connection.execute("SELECT location FROM tracks"))
+
+    def missing_found_years(self):
+        """
+        Returns the rows where no release year was found ("0").
+        """
+        return [TrackRecord.from_row(row) for row in self.connection.execute(
+            "SELECT * FROM tracks WHERE found_year = '0' ORDER BY location")]
+
+    def tracks_with_unset_year(self, min_confidence=None):
+        """
+        Returns the rows whose tagged year is unset but that have a found
+        year, with a confidence of at least min_confidence if given.
+        """
+        return [TrackRecord.from_row(row) for row in self.connection.execute(
+            "SELECT * FROM tracks WHERE " + UNSET_YEAR_WHERE + " ORDER BY location",
+            UNSET_YEARS + (min_confidence, min_confidence))]
+
+    def count_tracks_with_unset_year(self, min_confidence=None):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM tracks WHERE " + UNSET_YEAR_WHERE,
+            UNSET_YEARS + (min_confidence, min_confidence)).fetchone()[0]
+
+    def tracks_with_differing_year(self, min_confidence=None):
+        """
+        Returns the rows that have a found year different from the tagged
+        year, with a confidence of at least min_confidence if given.
+        """
+        return [TrackRecord.from_row(row) for row in self.connection.execute(
+            "SELECT * FROM tracks WHERE " + DIFFERING_YEAR_WHERE + " ORDER BY location",
+            (min_confidence, min_confidence))]
+
+    def count_tracks_with_differing_year(self, min_confidence=None):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM tracks WHERE " + DIFFERING_YEAR_WHERE,
+            (min_confidence, min_confidence)).fetchone()[0]
+
+    def found_year(self, location, min_confidence=None):
+        """
+        Returns the found year of a Location, or None if it has none or
+        its confidence is below min_confidence.
+        """
+        row = self.connection.execute(
+            "SELECT found_year FROM tracks WHERE location = ? AND found_year IS NOT NULL "
+            "AND found_year != '0' AND (? IS NULL OR confidence >= ?)",
+            (location, min_confidence, min_confidence)).fetchone()
+
+        return row[0] if row else None
+
+    def low_confidence_tracks(self, min_confidence):
+        """
+        Returns the rows with a found year whose confidence is below
+        min_confidence.  Rows without a confidence count as below.
+        """
+        return [TrackRecord.from_row(row) for row in self.connection.execute(
+            "SELECT * FROM tracks WHERE found_year IS NOT NULL AND found_year != '0' "
+            "AND (confidence IS NULL OR confidence < ?) ORDER BY location", (min_confidence,))]
+
+    # -----------  Writes  ----------- #
+
+    def upsert_tracks(self, track_data_list):
+        """
+        Inserts or replaces track data items.  Items without a found year
+        keep the found year and confidence already stored for their
+        Location.
+        """
+        rows = []
+        for item in track_data_list:
+            row = (list(item) + [None, None])[:7]
+            # an empty csv cell is an unknown confidence
+            row[6] = float(row[6]) if row[6] not in (None, "") else None
+            rows.append(row)
+
+        self.connection.executemany("""
+            INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (location) DO UPDATE SET
+                title = excluded.title,
+                artist = excluded.artist,
+                title_formatted = excluded.title_formatted,
+                year = excluded.year,
+                found_year = COALESCE(excluded.found_year, tracks.found_year),
+                confidence = CASE WHEN excluded.found_year IS NULL
+                    THEN tracks.confidence ELSE excluded.confidence END
+            """, rows)
+        self.connection.commit()
+
+    def set_found_year(self, location, found_year, confidence=None):
+        self.connection.execute(
+            "UPDATE tracks SET found_year = ?, confidence = ? WHERE location = ?",
+            (found_year, confidence, location))
+        self.connection.commit()
+
+    def set_found_years(self, found_years):
+        """
+        Updates the found year and confidence of many (location,
+        found_year, confidence) rows in one transaction.
+        """
+        self.connection.executemany(
+            "UPDATE tracks SET found_year = ?, confidence = ? WHERE location = ?",
+            [(found_year, confidence, location) for location, found_year, confidence in found_years])
+        self.connection.commit()
+
+    def set_year(self, location, year):
+        self.connection.execute(
+            "UPDATE tracks SET year = ? WHERE location = ?", (year, location))
+        self.connection.commit()
+
+    def delete(self, locations):
+        self.connection.executemany(
+            "DELETE FROM tracks WHERE location = ?", [(location,) for location in locations])
+        self.connection.commit()
+
+    def clear(self):
+        self.connection.execute("DELETE FROM tracks")
+        self.connection.commit()
+
+    # -----------  CSV Import / Export  ----------- #
+
+    def import_csv(self, csv_file_path, replace=False):
+        """
+        Loads a tracks.csv or track-years.csv file into the store.  With
+        replace=True the store is emptied first.  Returns the number of
+        imported rows.
+        """
+        print(colored(f"Importing {os.path.basename(csv_file_path)} into the track store...", color="white"))
+
+        if replace:
+            self.clear()
+
+        with open(csv_file_path) as file:
+            reader = csv.reader(file)
+            # skip the header line ["Location", "Title", "Artist"....]
+            next(reader, None)
+            rows = [row for row in reader if row]
+
+        self.upsert_tracks(rows)
+
+        return len(rows)
+
+    def export_csv(self, csv_file_path):
+        """
+        Writes every row to a track-years.csv style file.
+        """
+        print(colored(f"Exporting the track store to {os.path.basename(csv_file_path)}...", color="white"))
+
+        temp_file_path = csv_file_path + ".tmp"
+
+        with open(temp_file_path, "w") as file:
+            file.write(TRACK_YEARS_CSV_HEADER)
+            writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+
+            for row in self.connection.execute("SELECT * FROM tracks ORDER BY location"):
+                # an unknown confidence stays empty rather than becoming 0
+                writer.writerow(["0" if value is None else value for value in row[:6]] +
+                                ["" if row[6] is None else row[6]])
+
+        os.replace(temp_file_path, csv_file_path)
+
+    def close(self):
+        self.connection.close()
+
+
+# -----------  Run  ----------- #
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import or export the track store as csv.")
+    parser.add_argument("--store-file", default=os.path.dirname(
+        os.path.abspath(__file__)) + "/output/tracks.sqlite")
+    parser.add_argument("--import-csv", metavar="CSV",
+                        help="load a tracks.csv or track-years.csv file into the store")
+    parser.add_argument("--replace", action="store_true",
+                        help="empty the store before importing")
+    parser.add_argument("--export-csv", metavar="CSV",
+                        help="write the store to a track-years.csv style file")
+    args = parser.parse_args()
+
+    store = TrackStore(args.store_file)
+
+    if args.import_csv:
+        imported = store.import_csv(args.import_csv, replace=args.replace)
+        print(colored(f"Imported {imported} tracks.", color="white"))
+
+    if args.export_csv:
+        store.export_csv(args.export_csv)
+
+    print(colored(f"{store.count()} tracks in {args.store_file}", color="white"))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()